@@ -0,0 +1,12 @@
+#!/bin/bash
+set -e
+
+NAME="celery_beat"                 # Name of the application
+DJANGO_DIR=/app                  # Django project directory
+
+echo "Starting $NAME as `whoami`"
+
+cd $DJANGO_DIR
+
+# Start celery beat, a single instance sends the periodic tasks to the workers
+exec celery -A sushibar beat -l info
@@ -297,6 +297,38 @@ MMVP_REDIS_TEST_DB = 1
 # ------------------------------------------------------------------------------
 DEFAULT_STUDIO_SERVER = get_env('DEFAULT_STUDIO_SERVER', 'https://develop.contentworkshop.learningequality.org')
 
+# Run logs received via websockets are buffered and flushed to disk in batches
+LOGSINK_MAX_OPEN_FILES = 128        # max number of logfile handles kept open
+LOGSINK_FLUSH_BYTES = 64 * 1024     # flush a logfile's buffer when it grows past this size
+LOGSINK_FLUSH_INTERVAL = 1.0        # or when its oldest line is older than this (in seconds)
+LOG_INDEX_INTERVAL = 1000           # logfile indexes store the offset of every N-th line
+LOG_SEGMENT_MAX_BYTES = 16 * 1024 * 1024    # logfiles are sealed and gzipped in segments of this size
+LOG_API_MAX_LINES = 5000            # max number of lines returned by the run logs API
+RUN_STAGES_BULK_MAX = 500           # max number of stages sent at once to the bulk run stages API
+LOG_TAIL_LENGTH = 20                # number of last ERROR and CRITICAL lines kept in redis for each run
+LOGS_VIEW_MAX_LINES = 200           # max number of log lines pushed to browsers in one websocket message
+LOGS_VIEW_FLUSH_INTERVAL = 0.5      # max delay (in seconds) before buffered lines are pushed to browsers
+
+# Channel statuses from Kolibri Studio are cached (see sushibar.ccserverlib.status_cache)
+STUDIO_STATUS_FRESH_FOR = 5 * 60            # refresh cached statuses in the background after this many seconds
+STUDIO_STATUS_MAX_AGE = 24 * 60 * 60        # but keep serving them for up to this long
+STUDIO_STATUS_REFRESH_INTERVAL = 5 * 60     # how often celery beat refreshes the statuses of active channels
+STUDIO_STATUS_ACTIVE_DAYS = 14              # channels with a run in the last N days are considered active
+
+# Requests to Kolibri Studio
+STUDIO_REQUEST_TIMEOUT = (5, 60)            # (connect, read) timeouts in seconds
+STUDIO_REQUEST_RETRIES = 3                  # retries with exponential backoff for failed requests
+STUDIO_CONNECTION_POOL_SIZE = 10            # keep-alive connections kept open per Studio server (see sushibar.ccserverlib.client)
+STUDIO_TREE_CRAWLER_CONCURRENCY = 8         # max number of concurrent requests when loading a channel tree
+STUDIO_SINGLE_FLIGHT_TIMEOUT = 120          # max seconds identical concurrent requests wait for the first one (see sushibar.ccserverlib.singleflight)
+
+# Sign-in token validations (see sushibar.ccserverlib.token_cache)
+STUDIO_AUTH_SUCCESS_TTL = 10 * 60           # seconds valid email/token pairs are remembered
+STUDIO_AUTH_FAILURE_TTL = 60                # seconds rejected email/token pairs are remembered
+STUDIO_AUTH_BREAKER_THRESHOLD = 5           # stop calling Studio after this many failed validation requests
+STUDIO_AUTH_BREAKER_WINDOW = 60             # ... within this many seconds
+STUDIO_AUTH_BREAKER_COOLDOWN = 30           # ... for this many seconds
+
 
 
 
@@ -305,6 +337,15 @@ DEFAULT_STUDIO_SERVER = get_env('DEFAULT_STUDIO_SERVER', 'https://develop.conten
 TRELLO_API_KEY = get_env('TRELLO_API_KEY')
 TRELLO_TOKEN = get_env('TRELLO_TOKEN')
 TRELLO_BOARD = get_env('TRELLO_BOARD')
+TRELLO_RATE_LIMIT = 8                       # max writes per second to Trello (it allows 100 requests per 10 seconds per token)
+TRELLO_RATE_BURST = 20                      # ... with bursts of up to this many
+TRELLO_OUTBOX_MAX_ATTEMPTS = 6              # attempts at a write before recording it as a TrelloRequestFailure
+TRELLO_OUTBOX_BACKOFF = 5                   # seconds before the first retry, doubled for each retry
+TRELLO_CACHE_TTL = 60 * 60                  # seconds Trello cards and checklists are cached (see sushibar.services.trello.cache)
+TRELLO_LIST_CACHE_TTL = 24 * 60 * 60        # seconds Trello lists are cached
+TRELLO_WEBHOOK_BATCH_SIZE = 100             # max card changes from the Trello webhook applied per batch
+TRELLO_WEBHOOK_BATCH_DELAY = 2              # seconds card changes are collected before applying them
+TRELLO_RECONCILE_INTERVAL = 15 * 60         # how often celery beat syncs the channel flags with the Trello board
 
 
 # Google integraion
@@ -312,6 +353,7 @@ TRELLO_BOARD = get_env('TRELLO_BOARD')
 GOOGLE_AUTH_JSON = "credentials/client_secret.json"
 GOOGLE_QA_TEMPLATE_ID = get_env('GOOGLE_QA_TEMPLATE_ID', default='13neY4jW6EFKyls91IVMNs8Fiu9gujvblcgHljqVsZVA')
 TARGET_FOLDER_ID = get_env('TARGET_FOLDER_ID', default="0BziX9-4A2RIIQTFDX2FQeWV4dVU")
+QA_SHEET_PENDING_TIMEOUT = 10 * 60   # seconds before "Flag for QA" can queue another QA sheet creation for a channel
 LOCAL_DEV_DEFAULT_DOMAIN = None   # set to something like `92832de0.ngrok.io` for testing webhooks
 
 
@@ -325,3 +367,13 @@ CELERY_RESULT_SERIALIZER = 'json'
 BROKER_URL = 'redis://localhost:6379/6'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/6'
 CELERY_TIMEZONE = 'America/Los_Angeles'
+CELERYBEAT_SCHEDULE = {
+    'refresh-studio-channel-statuses': {
+        'task': 'refresh_active_channel_statuses_task',
+        'schedule': STUDIO_STATUS_REFRESH_INTERVAL,
+    },
+    'reconcile-trello-board': {
+        'task': 'reconcile_trello_board_task',
+        'schedule': TRELLO_RECONCILE_INTERVAL,
+    },
+}
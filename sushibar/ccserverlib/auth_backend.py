@@ -1,7 +1,7 @@
 
 from sushibar.users.models import BarUser
 
-from .services import ccserver_authenticate_user
+from .token_cache import authenticate_token
 
 
 
@@ -24,25 +24,28 @@ class ContentCurationServerAuthBackend(object):
 
         except BarUser.DoesNotExist:
             # No BarUser exists with this cctoken, let's check if token is valid
-            status, data = ccserver_authenticate_user(cctoken, ccemail)
+            status, data = authenticate_token(cctoken, ccemail)
             if status == 'success':
                 # We know `cctoken` and `ccemail` provided are valid, create the BarUser
-                new_baruser = BarUser.objects.create(
+                # or update its token if it was rotated on Studio
+                baruser, created = BarUser.objects.update_or_create(
                     username=ccemail,
-                    email=ccemail,
-                    cctoken=cctoken,
-                    is_staff = data.get('is_admin'),
-                    first_name = data.get('first_name'),
-                    last_name = data.get('last_name'),
+                    defaults=dict(
+                        email=ccemail,
+                        cctoken=cctoken,
+                        is_staff = data.get('is_admin'),
+                        first_name = data.get('first_name'),
+                        last_name = data.get('last_name'),
+                    ),
                 )
-                return new_baruser
+                return baruser
 
-            elif status == 'failure':
+            elif status in ('failure', 'unavailable'):
                 print('Authentication failed:', data)
                 return None
 
             else:
-                raise ValueError('Unrecognized status from ccserver_authenticate_user')
+                raise ValueError('Unrecognized status from authenticate_token')
 
     def get_user(self, user_id):
         try:
@@ -0,0 +1,127 @@
+"""
+HTTP client for the internal API of Kolibri Studio.
+
+There is one `StudioClient` per content server (see `get_client`), shared by all
+the helpers in `sushibar.ccserverlib.services` and by the tree crawler. Each
+client keeps a pool of keep-alive connections to its server, applies the
+`STUDIO_REQUEST_TIMEOUT` connect/read timeouts to every request, retries failed
+requests with exponential backoff, and records the number of requests, errors
+and retries and the latency of each endpoint (see `get_metrics`).
+
+Requests that change data on Studio (e.g. publishing a channel) are made with
+`retry=False`, so that a request that timed out after reaching Studio is not
+sent again.
+"""
+from collections import defaultdict
+import json
+import threading
+import time
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _empty_metrics():
+    return {'requests': 0, 'errors': 0, 'retries': 0, 'total_time': 0.0, 'max_time': 0.0}
+
+
+class StudioClient(object):
+    """
+    Makes requests to the Studio server at `content_server`.
+    """
+    def __init__(self, content_server, timeout=None, retries=None, backoff=0.5,
+                 pool_size=None, session=None):
+        self.content_server = content_server.rstrip('/')
+        self.timeout = timeout or settings.STUDIO_REQUEST_TIMEOUT
+        self.retries = settings.STUDIO_REQUEST_RETRIES if retries is None else retries
+        self.backoff = backoff
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size or settings.STUDIO_CONNECTION_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics = defaultdict(_empty_metrics)   # path --> metrics of the endpoint
+        self._metrics_lock = threading.Lock()
+
+    def post(self, path, token, data=None, retry=True):
+        return self.request('POST', path, token, data=data, retry=retry)
+
+    def get(self, path, token, data=None, retry=True):
+        return self.request('GET', path, token, data=data, retry=retry)
+
+    def request(self, method, path, token, data=None, retry=True):
+        """
+        Send `data` as JSON to the endpoint `path` using the Studio token `token`
+        and return the response. Connection errors, timeouts and server errors
+        are retried if `retry` is set; the last connection error or timeout is
+        raised if all attempts failed.
+        """
+        url = self.content_server + path
+        headers = {'Authorization': 'Token %s' % token,
+                   'Content-Type': 'application/json'}
+        body = json.dumps(data if data is not None else {})
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, data=body, headers=headers,
+                                                timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(path, time.monotonic() - started, attempt, error=True)
+                print('Request to', url, 'failed:', e)
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            failed = response.status_code >= 500
+            self._record(path, time.monotonic() - started, attempt, error=failed)
+            if not failed or attempt + 1 == attempts:
+                return response
+            print('Request to', url, 'failed:', response.status_code)
+
+    def _record(self, path, duration, attempt, error=False):
+        with self._metrics_lock:
+            metrics = self._metrics[path]
+            metrics['requests'] += 1
+            metrics['errors'] += int(error)
+            metrics['retries'] += int(attempt > 0)
+            metrics['total_time'] += duration
+            metrics['max_time'] = max(metrics['max_time'], duration)
+
+    def get_metrics(self):
+        """
+        Return `{path: metrics}` with the number of requests, errors and retries
+        made to each endpoint and their average and max latency in seconds.
+        """
+        with self._metrics_lock:
+            metrics = {path: dict(values) for path, values in self._metrics.items()}
+        for values in metrics.values():
+            values['avg_time'] = values['total_time'] / values['requests']
+        return metrics
+
+
+_clients = {}   # content_server --> StudioClient
+_clients_lock = threading.Lock()
+
+
+def get_client(content_server=None):
+    """
+    Return the shared client for `content_server` (`DEFAULT_STUDIO_SERVER` if None).
+    """
+    content_server = (content_server or settings.DEFAULT_STUDIO_SERVER).rstrip('/')
+    with _clients_lock:
+        client = _clients.get(content_server)
+        if client is None:
+            client = _clients[content_server] = StudioClient(content_server)
+        return client
+
+
+def get_metrics():
+    """
+    Return `{content_server: {path: metrics}}` for all the clients of this process.
+    """
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.content_server: client.get_metrics() for client in clients}
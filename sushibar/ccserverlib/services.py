@@ -1,53 +1,43 @@
-import json
-
-from django.conf import settings
 import requests
 
-BASE_URL = settings.DEFAULT_STUDIO_SERVER
-# TODO(Ivan) need to think about this, because BASE_URL could be different on a
-# per-channel basis, so might want to pass paths below as "templates" and let the
-# calling function fill them in using `run.content_server`    @Jordan: thoughts?
+from .client import get_client
+from .singleflight import request_key, single_flight
 
-PUBLISH_CHANNEL_URL = "%s/api/internal/publish_channel" % BASE_URL
-GET_CHANNELS_URL = "%s/get_user_channels" % BASE_URL
-CHECK_USER_URL = "%s/api/internal/check_user_is_editor" % BASE_URL
-ACTIVATE_CHANNEL_URL = "%s/api/internal/activate_channel_internal" % BASE_URL
-GET_CHANNEL_STATUS_URL = "%s/api/internal/get_channel_status" % BASE_URL
-FINISH_CHANNEL_URL = "%s/api/internal/finish_channel" % BASE_URL
+# Paths of the internal API endpoints of Kolibri Studio. Requests made on behalf
+# of a `baruser` go to `DEFAULT_STUDIO_SERVER`, requests for a run go to its
+# `run.content_server`.
+PUBLISH_CHANNEL_PATH = "/api/internal/publish_channel"
+GET_CHANNELS_PATH = "/get_user_channels"
+CHECK_USER_PATH = "/api/internal/check_user_is_editor"
+ACTIVATE_CHANNEL_PATH = "/api/internal/activate_channel_internal"
+GET_CHANNEL_STATUS_PATH = "/api/internal/get_channel_status"
+FINISH_CHANNEL_PATH = "/api/internal/finish_channel"
 
-def post_request(baruser, auth_url, data=None):
+def post_request(baruser, path, data=None, retry=True):
     if not baruser.is_authenticated or not baruser.cctoken:
         return ('failure', 'User does not have a Kolibri Studio token')
     try:
-        request = requests.post(
-                auth_url,
-                data=json.dumps(data),
-                headers={'Authorization': 'Token %s' % baruser.cctoken,
-                         'Content-Type': 'application/json'})
+        request = get_client().post(path, baruser.cctoken, data=data, retry=retry)
         if request.status_code == 200:
             return ('success', request.json())
         else:
             return ('failure', 'Request failed: %s' % request.reason)
 
-    except requests.ConnectionError: # fallback when ccserver can't be reached
+    except requests.RequestException: # fallback when ccserver can't be reached
         return ('failure', 'Connection error: could not reach the ccserver.')
 
-def get_request(baruser, auth_url, data=None):
+def get_request(baruser, path, data=None):
     if not baruser.is_authenticated or not baruser.cctoken:
         return ('failure', 'User does not have a Kolibri Studio token')
 
     try:
-        request = requests.get(
-                auth_url,
-                data=json.dumps(data or {}),
-                headers={'Authorization': 'Token %s' % baruser.cctoken,
-                         'Content-Type': 'application/json'})
+        request = get_client().get(path, baruser.cctoken, data=data)
         if request.status_code == 200:
             return ('success', request.json())
         else:
             return ('failure', 'Request failed: %s' % request.reason)
 
-    except requests.ConnectionError: # fallback when ccserver can't be reached
+    except requests.RequestException: # fallback when ccserver can't be reached
         return ('failure', 'Connection error: could not reach the ccserver.')
 
 
@@ -74,28 +64,30 @@ def ccserver_authenticate_user(cctoken, ccemail=None):
          will contain the email address associated with `cctoken` on the CC Server.
       - `status='failure'` if `cctoken` is not recognized as as a valid token
          for any CCUser in this case `email_or_msg` (str) is the reason for the failure.
+      - `status='unavailable'` if the CC Server can't be reached or fails to
+         answer, in which case nothing is known about `cctoken`.
     """
-    ccserver_base_url = settings.DEFAULT_STUDIO_SERVER
-    auth_url = "%s/api/internal/authenticate_user_internal" % ccserver_base_url
     try:
-        request = requests.post(
-                auth_url,
-                data=json.dumps({}),
-                headers={'Authorization': 'Token %s' % cctoken,
-                         'Content-Type': 'application/json'})
-        response_data = request.json()
-        if request.ok and response_data['success']:
-            if ccemail and ccemail != response_data['username']:
-                return ('failure', 'Token valid but CC Server has a different email file.')
+        # not retried: sign-in shouldn't hang, and `token_cache` stops calling a failing Studio
+        request = get_client().post("/api/internal/authenticate_user_internal", cctoken, retry=False)
+    except requests.RequestException: # fallback when ccserver can't be reached
+        return ('unavailable', 'Connection error: could not reach the ccserver.')
+    if request.status_code >= 500:
+        return ('unavailable', 'CC Server error: %s' % request.status_code)
 
-            print('Successfully authenticated against CCServer')
-            return ('success', response_data)
+    try:
+        response_data = request.json()
+    except ValueError:
+        response_data = {}
+    if request.ok and response_data.get('success'):
+        if ccemail and ccemail != response_data['username']:
+            return ('failure', 'Token valid but CC Server has a different email file.')
 
-        else: # e.g. Error 403 Unauthorized
-            return ('failure', 'Failed to authenticate against CCServer (`cctoken` not recognized)')
+        print('Successfully authenticated against CCServer')
+        return ('success', response_data)
 
-    except requests.ConnectionError: # fallback when ccserver can't be reached
-        return ('failure', 'Connection error: could not reach the ccserver.')
+    else: # e.g. Error 403 Unauthorized
+        return ('failure', 'Failed to authenticate against CCServer (`cctoken` not recognized)')
 
 
 
@@ -103,21 +95,21 @@ def ccserver_publish_channel(baruser, channel_id):
     """
         returns {"success": True, "channel_id": str}
     """
-    return post_request(baruser, PUBLISH_CHANNEL_URL, data={"channel_id": channel_id})
+    return post_request(baruser, PUBLISH_CHANNEL_PATH, data={"channel_id": channel_id}, retry=False)
 
 
 def get_user_channels(baruser):
     """
         returns serialized channel list
     """
-    return get_request(baruser, GET_CHANNELS_URL)
+    return get_request(baruser, GET_CHANNELS_PATH)
 
 
 def check_user_is_editor(baruser, channel_id):
     """
         returns success if user is an editor
     """
-    return post_request(baruser, CHECK_USER_URL, data={"channel_id": channel_id})
+    return post_request(baruser, CHECK_USER_PATH, data={"channel_id": channel_id})
 
 
 
@@ -125,37 +117,43 @@ def finish_channel(baruser, channel_id, stage=False):
     """
         Moves chef tree to either staging tree or main tree depending on user specification
     """
-    return post_request(baruser, FINISH_CHANNEL_URL, data={"channel_id": channel_id})
+    return post_request(baruser, FINISH_CHANNEL_PATH, data={"channel_id": channel_id}, retry=False)
 
 
 def activate_channel(baruser, channel_id):
     """
         activates staged channels
     """
-    return post_request(baruser, ACTIVATE_CHANNEL_URL, data={"channel_id": channel_id})
+    return post_request(baruser, ACTIVATE_CHANNEL_PATH, data={"channel_id": channel_id}, retry=False)
 
 
 
-def get_channel_status_bulk(content_server, cctoken, channel_ids):
+def get_channel_status_bulk(content_server, cctoken, channel_ids, raise_errors=False):
     """
     Retrieve a dict of channel statuses in bulk from Kolibri Studio.
-    Uses authorization Token `cctoken` to make the request.
+    Uses authorization Token `cctoken` to make the request. Concurrent calls
+    for the same channels share one request. If the request fails, returns an
+    empty dict, or raises `requests.RequestException` if `raise_errors` is set.
     """
-    no_data = {}
+    path = "/api/internal/get_channel_status_bulk"
+    data = {"channel_ids": channel_ids}
     try:
-        response = requests.post(
-                "%s/api/internal/get_channel_status_bulk" % content_server,
-                data=json.dumps({"channel_ids": channel_ids}),
-                headers={'Authorization': 'Token %s' % cctoken,
-                         'Content-Type': 'application/json'})
-        if response.ok:
-            response_data = response.json()
-            if response_data['success']:
-                return response_data['statuses']
-    except requests.ConnectionError:   # fallback when ccserver can't be reached
-        print('ConnectionError, returning default empty dict {}')
+        return single_flight(request_key(content_server, path, cctoken, data),
+                             lambda: _get_channel_status_bulk(content_server, cctoken, path, data))
+    except requests.RequestException as e:   # fallback when ccserver can't be reached
+        if raise_errors:
+            raise
+        print('Could not get channel statuses, returning default empty dict {}:', e)
+        return {}
 
-    return no_data
+def _get_channel_status_bulk(content_server, cctoken, path, data):
+    """Raises `requests.RequestException` if the request failed, so it isn't shared."""
+    response = get_client(content_server).post(path, cctoken, data=data)
+    response.raise_for_status()
+    response_data = response.json()
+    if not response_data['success']:
+        raise requests.RequestException('Studio could not return the channel statuses')
+    return response_data['statuses']
 
 
 
@@ -189,19 +187,16 @@ def compare_trees(baruser, channel_id, tree='staging'):
     """
     staging = True if tree == 'staging' else False
     try:
-        request = requests.post(
-                "%s/api/internal/compare_trees" % settings.DEFAULT_STUDIO_SERVER,
-                data=json.dumps({
+        request = get_client().post(
+                "/api/internal/compare_trees", baruser.cctoken, data={
                     "channel_id": channel_id,
                     "staging": staging,
-                }),
-                headers={'Authorization': 'Token %s' % baruser.cctoken,
-                         'Content-Type': 'application/json'})
+                })
         if request.ok:
             return request.json()
         else:
-            print('ERROR', request.status)
-    except requests.ConnectionError as e:   # fallback when ccserver can't be reached
+            print('ERROR', request.status_code)
+    except requests.RequestException as e:   # fallback when ccserver can't be reached
         pass
     return {}
 
@@ -210,46 +205,42 @@ def ccserver_get_topic_tree(run):
     This used to call the API endpoint `/api/internal/get_tree_data` but it was
     not reliable (request times out for large channels), so we're replacing it
     with a multiple calls to `/api/internal/get_node_tree_data` (defined below).
+    Blocks until the whole tree is loaded, so views use `schedule_tree_load`.
     """
-    from sushibar.runs.utils import load_tree_for_channel
-    run_dict = dict(
-        content_server=run.content_server,
-        channel_id=run.channel.channel_id.hex,
-        started_by_user_token=run.started_by_user_token,
-        tree_data_path=run.get_tree_data_path(),
-    )
-    tree_data = load_tree_for_channel(run_dict)
+    from sushibar.runs.utils import get_tree_run_dict, load_tree_for_channel
+    tree_data = load_tree_for_channel(get_tree_run_dict(run))
     return tree_data
 
 def ccserver_get_node_children(run_dict, node_id=None):
     """
     Retrieve from Kolibri Studio json data for children of `node_id` for the run
     info provided in `run_dict`. If node_id is None, we retrieve the channel root.
+    Concurrent calls for the same node share one request.
     """
-    data = []
+    path = "/api/internal/get_node_tree_data"
+    data = {"node_id" : node_id, "channel_id": run_dict['channel_id']}
+    key = request_key(run_dict['content_server'], path, run_dict['started_by_user_token'], data)
     try:
-        request = requests.post(
-                "%s/api/internal/get_node_tree_data" % run_dict['content_server'],
-                data=json.dumps({"node_id" : node_id, "channel_id": run_dict['channel_id']}),
-                headers={'Authorization': 'Token %s' % run_dict['started_by_user_token'],
-                         'Content-Type': 'application/json'})
-        if request.ok:
-            data = request.json().get("tree", [])
-    except requests.ConnectionError:   # fallback when ccserver can't be reached
-        pass
-    return data
+        return single_flight(key, lambda: _get_node_children(run_dict, path, data))
+    except requests.RequestException:   # fallback when ccserver can't be reached
+        return []
+
+def _get_node_children(run_dict, path, data):
+    """Raises `requests.RequestException` if the request failed, so it isn't shared."""
+    request = get_client(run_dict['content_server']).post(
+            path, run_dict['started_by_user_token'], data=data)
+    request.raise_for_status()
+    return request.json().get("tree", [])
 
 def ccserver_check_channel_staged(run):
     data = []
     try:
-        request = requests.post(
-                "%s/api/internal/check_channel_is_staged" % run.content_server,
-                data=json.dumps({"channel_id": run.channel.channel_id.hex}),
-                headers={'Authorization': 'Token %s' % run.started_by_user_token,
-                         'Content-Type': 'application/json'})
+        request = get_client(run.content_server).post(
+                "/api/internal/check_channel_is_staged", run.started_by_user_token,
+                data={"channel_id": run.channel.channel_id.hex})
         if request.ok:
             data = request.json().get("staged", False)
-    except requests.ConnectionError:   # fallback when ccserver can't be reached
+    except requests.RequestException:   # fallback when ccserver can't be reached
         pass
     return data
 # api/internal/get_tree_data
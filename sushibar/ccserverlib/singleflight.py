@@ -0,0 +1,117 @@
+"""
+Coalescing of identical in-flight requests to Kolibri Studio.
+
+When several web workers or celery tasks need the result of the same request
+at the same time (e.g. the statuses of the channels on the dashboard), only the
+first one makes it: it takes a lock in redis for the request's key, makes the
+request and stores the result under a key unique to this "flight". The others
+see the lock, wait for that result and return it instead of calling Studio.
+
+Only successful results are shared: `fn` must raise when the request fails
+rather than return a fallback value. If the caller holding the lock fails or
+the lock expires without a result, the callers waiting on it make the request
+themselves. Results are only kept for
+`RESULT_TTL` seconds, long enough for the waiting callers to pick them up; this
+is not a cache. Without redis every caller makes its own request.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+import redis
+
+
+REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
+                          port=settings.MMVP_REDIS_PORT,
+                          db=settings.MMVP_REDIS_DB,
+                          charset="utf-8",
+                          decode_responses=True)
+
+RESULT_TTL = 10            # seconds results are kept for callers waiting on them
+MAX_POLL_INTERVAL = 0.5    # seconds between checks for the result, backing off from 10ms
+
+# Delete the lock only if it is still held by this flight
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def request_key(content_server, path, token, data):
+    """
+    Key identifying a request, including the token since results can depend on
+    the permissions of the user making it.
+    """
+    request = json.dumps([content_server, path, token, data], sort_keys=True)
+    return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+def lock_key(key):
+    return 'singleflight:%s' % key
+
+def result_key(key, flight):
+    return 'singleflight:%s:%s' % (key, flight)
+
+
+def single_flight(key, fn, client=None):
+    """
+    Return `fn()`, sharing its result with all concurrent calls for `key`.
+    Results must be JSON-serializable; exceptions raised by `fn` are not shared.
+    """
+    client = client or REDIS
+    flight = uuid.uuid4().hex
+    try:
+        leader = client.set(lock_key(key), flight, nx=True, ex=settings.STUDIO_SINGLE_FLIGHT_TIMEOUT)
+        if not leader:
+            found, result = _wait(client, key)
+    except redis.RedisError as e:
+        print('Request coalescing unavailable:', e)
+        return fn()
+    if leader:
+        return _lead(client, key, flight, fn)
+    return result if found else fn()
+
+
+def _lead(client, key, flight, fn):
+    """
+    Return `fn()` and share its result. Redis errors past this point only
+    affect the waiting callers, which then make the request themselves.
+    """
+    try:
+        result = fn()
+        try:
+            client.set(result_key(key, flight), json.dumps([result]), ex=RESULT_TTL)
+        except redis.RedisError as e:
+            print('Could not share result of request:', e)
+        return result
+    finally:
+        try:
+            client.eval(RELEASE_SCRIPT, 1, lock_key(key), flight)
+        except redis.RedisError as e:
+            print('Could not release request lock:', e)
+
+
+def _wait(client, key):
+    """
+    Wait for the result of the flight in progress for `key`.
+    Returns `(found, result)`.
+    """
+    deadline = time.monotonic() + settings.STUDIO_SINGLE_FLIGHT_TIMEOUT
+    interval = 0.01
+    flight = client.get(lock_key(key))
+    while flight and time.monotonic() < deadline:
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        value = client.get(result_key(key, flight))
+        if value is not None:
+            return True, json.loads(value)[0]
+        if client.get(lock_key(key)) != flight:
+            # the flight ended without a result, or a new one started
+            value = client.get(result_key(key, flight))
+            if value is not None:
+                return True, json.loads(value)[0]
+            return False, None
+    return False, None
@@ -0,0 +1,112 @@
+"""
+Cache of channel statuses reported by Kolibri Studio, so that pages showing
+them never wait on Studio.
+
+Statuses are cached per `(content_server, channel_id)` in the django cache for
+`STUDIO_STATUS_MAX_AGE` seconds. Views read them with `get_channel_statuses`,
+which returns whatever is cached and queues a background refresh for statuses
+that are missing or older than `STUDIO_STATUS_FRESH_FOR` seconds. The celery
+beat task `refresh_active_channel_statuses_task` also refreshes the statuses of
+all recently active channels every `STUDIO_STATUS_REFRESH_INTERVAL` seconds.
+"""
+from collections import defaultdict
+from datetime import timedelta
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from sushibar.runs.models import ChannelSummary
+
+from .services import get_channel_status_bulk
+
+
+REFRESH_PENDING_TIMEOUT = 60     # don't queue a refresh of a status again for this long
+REFRESH_BATCH_SIZE = 100         # max number of channel ids per request to Studio
+
+
+def status_key(content_server, channel_id):
+    return 'studio-status:%s:%s' % (content_server, channel_id)
+
+def refresh_pending_key(content_server, channel_id):
+    return 'studio-status-refresh:%s:%s' % (content_server, channel_id)
+
+
+def get_channel_statuses(content_server, cctoken, channel_ids):
+    """
+    Return `{channel_id: status}` for the statuses of `channel_ids` found in the
+    cache, even if stale. Statuses missing from the cache or stale are refreshed
+    in the background using the Studio token `cctoken`.
+    """
+    keys = {status_key(content_server, channel_id): channel_id for channel_id in channel_ids}
+    cached = cache.get_many(list(keys.keys()))
+    now = time.time()
+    statuses = {}
+    to_refresh = []
+    for key, channel_id in keys.items():
+        entry = cached.get(key)
+        if entry is not None:
+            status, fetched_at = entry
+            if status is not None:
+                statuses[channel_id] = status
+            if now - fetched_at < settings.STUDIO_STATUS_FRESH_FOR:
+                continue
+        to_refresh.append(channel_id)
+    if to_refresh and cctoken:
+        schedule_status_refresh(content_server, cctoken, to_refresh)
+    return statuses
+
+
+def schedule_status_refresh(content_server, cctoken, channel_ids):
+    """
+    Queue a refresh of the statuses of `channel_ids`, skipping the ones that
+    already have a refresh pending.
+    """
+    from sushibar.tasks import refresh_channel_statuses_task
+    pending = [channel_id for channel_id in channel_ids
+               if cache.add(refresh_pending_key(content_server, channel_id), True, REFRESH_PENDING_TIMEOUT)]
+    if not pending:
+        return
+    try:
+        refresh_channel_statuses_task.delay(content_server, cctoken, pending)
+    except Exception as e:
+        cache.delete_many([refresh_pending_key(content_server, channel_id) for channel_id in pending])
+        print('ERROR could not queue refresh of Studio channel statuses', e)
+
+
+def refresh_channel_statuses(content_server, cctoken, channel_ids):
+    """
+    Fetch the statuses of `channel_ids` from Studio in bulk and cache them.
+    Cached statuses are left as they are if Studio can't be reached.
+    """
+    statuses = {}
+    for i in range(0, len(channel_ids), REFRESH_BATCH_SIZE):
+        batch = channel_ids[i:i + REFRESH_BATCH_SIZE]
+        batch_statuses = get_channel_status_bulk(content_server, cctoken, batch)
+        cache.delete_many([refresh_pending_key(content_server, channel_id) for channel_id in batch])
+        if not batch_statuses:
+            continue   # request failed
+        now = time.time()
+        cache.set_many({status_key(content_server, channel_id): (batch_statuses.get(channel_id), now)
+                        for channel_id in batch},
+                       settings.STUDIO_STATUS_MAX_AGE)
+        statuses.update(batch_statuses)
+    return statuses
+
+
+def refresh_active_channel_statuses():
+    """
+    Refresh the statuses of all channels that had a run in the last
+    `STUDIO_STATUS_ACTIVE_DAYS` days, using the token of their last run.
+    """
+    since = timezone.now() - timedelta(days=settings.STUDIO_STATUS_ACTIVE_DAYS)
+    summaries = ChannelSummary.objects.filter(last_run_date__gte=since, last_run__isnull=False)\
+                    .select_related('channel', 'last_run')
+    channel_ids_by_server = defaultdict(list)
+    for summary in summaries:
+        run = summary.last_run
+        if run.content_server and run.started_by_user_token:
+            channel_ids_by_server[(run.content_server, run.started_by_user_token)].append(summary.channel.channel_id.hex)
+    for (content_server, cctoken), channel_ids in channel_ids_by_server.items():
+        refresh_channel_statuses(content_server, cctoken, channel_ids)
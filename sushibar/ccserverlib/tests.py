@@ -1,3 +1,334 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+import redis
+import requests
+
+from sushibar.ccserverlib import services, singleflight, status_cache, token_cache
+from sushibar.ccserverlib.client import StudioClient
+from sushibar.ccserverlib.status_cache import get_channel_statuses, refresh_channel_statuses
+from sushibar.ccserverlib.tree_crawler import StudioTreeCrawler
+
+
+SERVER = 'https://studio.example.org'
+
+
+@override_settings(STUDIO_STATUS_FRESH_FOR=60, STUDIO_STATUS_MAX_AGE=3600)
+class StatusCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(status_cache, 'schedule_status_refresh')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(status_cache, 'get_channel_status_bulk')
+    def test_never_blocks_on_studio(self, get_bulk):
+        self.assertEqual(get_channel_statuses(SERVER, 'token', ['a', 'b']), {})
+        self.assertFalse(get_bulk.called)
+        self.schedule.assert_called_once_with(SERVER, 'token', ['a', 'b'])
+
+    @mock.patch.object(status_cache, 'get_channel_status_bulk')
+    def test_stale_while_revalidate(self, get_bulk):
+        get_bulk.return_value = {'a': 'active'}
+        refresh_channel_statuses(SERVER, 'token', ['a', 'b'])
+        self.assertEqual(get_channel_statuses(SERVER, 'token', ['a', 'b']), {'a': 'active'})
+        self.assertFalse(self.schedule.called)   # fresh, including the missing 'b'
+        with mock.patch.object(status_cache.time, 'time', return_value=status_cache.time.time() + 120):
+            self.assertEqual(get_channel_statuses(SERVER, 'token', ['a']), {'a': 'active'})
+        self.schedule.assert_called_once_with(SERVER, 'token', ['a'])
+
+    @mock.patch.object(status_cache, 'get_channel_status_bulk')
+    def test_failed_refresh_keeps_cached_status(self, get_bulk):
+        get_bulk.return_value = {'a': 'staged'}
+        refresh_channel_statuses(SERVER, 'token', ['a'])
+        get_bulk.return_value = {}
+        refresh_channel_statuses(SERVER, 'token', ['a'])
+        self.assertEqual(get_channel_statuses(SERVER, 'token', ['a']), {'a': 'staged'})
+
+
+STUDIO_TREE = {
+    None: [{'node_id': 'a', 'title': 'A'}, {'title': 'leaf'}, {'node_id': 'c', 'title': 'C'}],
+    'a': [{'node_id': 'a1', 'title': 'A1'}, {'title': 'A2'}],
+    'a1': [{'title': 'A1 leaf'}],
+    'c': [{'node_id': 'c1', 'title': 'C1', 'children': 'overwritten'}],
+    'c1': [],
+}
+
+
+class FakeStudioSession(requests.Session):
+    """
+    Serves `STUDIO_TREE`, answering requests for deeper nodes faster so that
+    responses arrive out of order. Fails the first `failures` requests.
+    """
+    def __init__(self, failures=0, tree=STUDIO_TREE):
+        super(FakeStudioSession, self).__init__()
+        self.tree = tree
+        self.failures = failures
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        node_id = json.loads(data)['node_id']
+        with self.lock:
+            self.requested.append(node_id)
+            if self.failures:
+                self.failures -= 1
+                raise requests.ConnectionError('connection refused')
+        time.sleep(0.01 if node_id in ['a', 'c'] else 0)
+        return mock.Mock(ok=True, status_code=200,
+                         json=lambda: {'tree': json.loads(json.dumps(self.tree[node_id]))})
+
+
+def load_tree_sequentially(node_id=None, studio_tree=STUDIO_TREE):
+    tree = []
+    for child in json.loads(json.dumps(studio_tree[node_id])):
+        if child.get('node_id'):
+            child.update({'children': load_tree_sequentially(child['node_id'], studio_tree)})
+        tree.append(child)
+    return tree
+
+
+class FakeRedis(object):
+    """
+    The subset of redis used by `single_flight`.
+    """
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def eval(self, script, numkeys, key, flight):
+        with self.lock:
+            if self.data.get(key) == flight:
+                del self.data[key]
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.calls = 0
+
+    def _slow_call(self, result):
+        def call():
+            self.calls += 1
+            time.sleep(0.1)
+            return result
+        return call
+
+    def test_concurrent_calls_share_result(self):
+        results = []
+        def call():
+            results.append(singleflight.single_flight('key', self._slow_call({'a': 'active'}), client=self.redis))
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'a': 'active'}] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertNotIn(singleflight.lock_key('key'), self.redis.data)
+        # results are not cached once the flight is over
+        singleflight.single_flight('key', self._slow_call(None), client=self.redis)
+        self.assertEqual(self.calls, 2)
+
+    def test_waiting_callers_retry_when_leader_fails(self):
+        self.redis.set(singleflight.lock_key('key'), 'crashed-flight')
+        def release_lock():
+            time.sleep(0.05)
+            self.redis.eval(singleflight.RELEASE_SCRIPT, 1, singleflight.lock_key('key'), 'crashed-flight')
+        threading.Thread(target=release_lock).start()
+        self.assertEqual(singleflight.single_flight('key', self._slow_call([]), client=self.redis), [])
+        self.assertEqual(self.calls, 1)
+
+    def test_failures_are_not_shared(self):
+        results = []
+        def failing_call():
+            self.calls += 1
+            time.sleep(0.1)
+            raise requests.ConnectionError('studio down')
+        def lead():
+            with self.assertRaises(requests.ConnectionError):
+                singleflight.single_flight('key', failing_call, client=self.redis)
+        leader = threading.Thread(target=lead)
+        leader.start()
+        time.sleep(0.02)
+        results.append(singleflight.single_flight('key', self._slow_call({'a': 'active'}), client=self.redis))
+        leader.join()
+        self.assertEqual(results, [{'a': 'active'}])
+        self.assertEqual(self.calls, 2)
+
+    def test_result_is_returned_if_it_cant_be_shared(self):
+        client = mock.Mock(wraps=self.redis)
+        real_set = self.redis.set
+        client.set.side_effect = lambda key, value, **kwargs: (
+            real_set(key, value, **kwargs) if kwargs.get('nx') else self._raise(redis.ConnectionError('gone')))
+        self.assertEqual(singleflight.single_flight('key', self._slow_call(1), client=client), 1)
+        self.assertEqual(self.calls, 1)
+
+    def _raise(self, error):
+        raise error
+
+    def test_without_redis(self):
+        client = mock.Mock()
+        client.set.side_effect = redis.ConnectionError('connection refused')
+        self.assertEqual(singleflight.single_flight('key', self._slow_call(1), client=client), 1)
+
+
+class ChannelStatusBulkTest(SimpleTestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(singleflight, 'REDIS', FakeRedis()),
+            mock.patch.object(services, 'get_client', return_value=mock.Mock(**{
+                'post.side_effect': requests.ConnectionError('studio down')})),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_unreachable_studio(self):
+        self.assertEqual(services.get_channel_status_bulk(SERVER, 'token', ['abc']), {})
+        with self.assertRaises(requests.ConnectionError):
+            services.get_channel_status_bulk(SERVER, 'token', ['abc'], raise_errors=True)
+
+
+class StudioTreeCrawlerTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(singleflight, 'REDIS', FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _crawler(self, session):
+        client = StudioClient(SERVER, timeout=1, retries=2, backoff=0, session=session)
+        return StudioTreeCrawler(SERVER, 'token', 'channel', concurrency=4, client=client)
+
+    def test_same_tree_as_sequential_load(self):
+        session = FakeStudioSession()
+        tree = self._crawler(session).crawl()
+        self.assertEqual(json.dumps(tree), json.dumps(load_tree_sequentially()))
+        self.assertEqual(session.requested[:3], [None, 'a', 'c'])   # breadth-first
+        self.assertEqual(sorted(session.requested[3:]), ['a1', 'c1'])
+
+    def test_retries_failed_requests(self):
+        session = FakeStudioSession(failures=2)
+        tree = self._crawler(session).crawl()
+        self.assertEqual(json.dumps(tree), json.dumps(load_tree_sequentially()))
+        self.assertEqual(session.requested[:3], [None, None, None])
+
+    def test_root_request_fails(self):
+        previous_tree = self._crawler(FakeStudioSession()).crawl()
+        session = FakeStudioSession(failures=3)
+        self.assertIsNone(self._crawler(session).crawl(previous_tree=previous_tree))
+        self.assertEqual(session.requested, [None, None, None])
+
+    def test_reuses_unchanged_subtrees(self):
+        previous_tree = self._crawler(FakeStudioSession()).crawl()
+        # a resource is added under C1, which changes the counts listed for C and C1
+        studio_tree = dict(STUDIO_TREE, c1=[{'title': 'new'}])
+        studio_tree[None] = STUDIO_TREE[None][:2] + [{'node_id': 'c', 'title': 'C', 'count': 1}]
+        studio_tree['c'] = [{'node_id': 'c1', 'title': 'C1', 'count': 1}]
+        session = FakeStudioSession(tree=studio_tree)
+        crawler = self._crawler(session)
+        tree = crawler.crawl(previous_tree=json.loads(json.dumps(previous_tree)))
+        self.assertEqual(json.dumps(tree), json.dumps(load_tree_sequentially(studio_tree=studio_tree)))
+        self.assertEqual(session.requested, [None, 'c', 'c1'])
+        self.assertEqual(crawler.requests_made, 3)
+        self.assertEqual(crawler.requests_saved, 2)   # 'a' and 'a1'
+
+    def test_keeps_previous_subtree_when_requests_fail(self):
+        previous_tree = self._crawler(FakeStudioSession()).crawl()
+        studio_tree = dict(STUDIO_TREE)
+        studio_tree[None] = STUDIO_TREE[None][:2] + [{'node_id': 'c', 'title': 'C', 'count': 1}]
+        session = FakeStudioSession(tree=studio_tree)
+        crawler = self._crawler(session)
+        with mock.patch.object(crawler, 'fetch_children', side_effect=lambda node_id: (
+                None if node_id == 'c' else StudioTreeCrawler.fetch_children(crawler, node_id))):
+            tree = crawler.crawl(previous_tree=json.loads(json.dumps(previous_tree)))
+        self.assertEqual(tree[2]['children'], previous_tree[2]['children'])
+
+
+class StudioClientTest(SimpleTestCase):
+
+    def _client(self, *responses):
+        session = requests.Session()
+        session.request = mock.Mock(side_effect=list(responses))
+        return StudioClient(SERVER + '/', timeout=(1, 2), retries=2, backoff=0, session=session)
+
+    def test_request(self):
+        client = self._client(mock.Mock(status_code=200))
+        self.assertEqual(client.post('/api/internal/x', 'token', data={'a': 1}).status_code, 200)
+        client.session.request.assert_called_once_with(
+            'POST', SERVER + '/api/internal/x', data='{"a": 1}', timeout=(1, 2),
+            headers={'Authorization': 'Token token', 'Content-Type': 'application/json'})
+
+    def test_retries_and_metrics(self):
+        client = self._client(requests.ConnectionError('refused'), mock.Mock(status_code=502),
+                              mock.Mock(status_code=200))
+        self.assertEqual(client.post('/api/internal/x', 'token').status_code, 200)
+        metrics = client.get_metrics()['/api/internal/x']
+        self.assertEqual((metrics['requests'], metrics['errors'], metrics['retries']), (3, 2, 2))
+        self.assertGreaterEqual(metrics['max_time'], metrics['avg_time'])
+
+    def test_gives_up_after_retries(self):
+        client = self._client(*[requests.Timeout('read timeout')] * 3)
+        with self.assertRaises(requests.Timeout):
+            client.get('/api/internal/x', 'token')
+        client = self._client(*[mock.Mock(status_code=503)] * 3)
+        self.assertEqual(client.get('/api/internal/x', 'token').status_code, 503)
+        self.assertEqual(client.session.request.call_count, 3)
+
+    def test_no_retry(self):
+        client = self._client(mock.Mock(status_code=504), mock.Mock(status_code=200))
+        self.assertEqual(client.post('/api/internal/publish_channel', 'token', retry=False).status_code, 504)
+        client = self._client(mock.Mock(status_code=404), mock.Mock(status_code=200))
+        self.assertEqual(client.post('/api/internal/x', 'token').status_code, 404)
+
+
+@override_settings(STUDIO_AUTH_SUCCESS_TTL=600, STUDIO_AUTH_FAILURE_TTL=60, STUDIO_AUTH_BREAKER_THRESHOLD=3,
+                   STUDIO_AUTH_BREAKER_WINDOW=60, STUDIO_AUTH_BREAKER_COOLDOWN=30)
+class TokenCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(token_cache, 'ccserver_authenticate_user')
+        self.authenticate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_caches_validations_by_hash(self):
+        self.authenticate.return_value = ('success', {'username': 'a@example.org'})
+        for _ in range(3):
+            self.assertEqual(token_cache.authenticate_token('secret-token', 'a@example.org'),
+                             ('success', {'username': 'a@example.org'}))
+        self.authenticate.return_value = ('failure', 'not recognized')
+        for _ in range(3):
+            self.assertEqual(token_cache.authenticate_token('bad-token', 'a@example.org')[0], 'failure')
+        self.assertEqual(self.authenticate.call_count, 2)
+        key = token_cache.validation_key('secret-token', 'a@example.org')
+        self.assertNotIn('secret-token', key)
+        self.assertNotEqual(key, token_cache.validation_key('secret-token', 'b@example.org'))
+
+    def test_circuit_breaker(self):
+        self.authenticate.return_value = ('unavailable', 'could not reach the ccserver')
+        for i in range(5):
+            self.assertEqual(token_cache.authenticate_token('token-%d' % i)[0], 'unavailable')
+        self.assertEqual(self.authenticate.call_count, 3)   # open after the third failure
+        cache.delete(token_cache.BREAKER_OPEN_KEY)          # cooldown over
+        self.authenticate.return_value = ('success', {})
+        self.assertEqual(token_cache.authenticate_token('token-5')[0], 'success')
+        self.assertIsNone(cache.get(token_cache.BREAKER_FAILURES_KEY))
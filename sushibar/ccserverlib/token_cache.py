@@ -0,0 +1,67 @@
+"""
+Cache of the validations of Kolibri Studio tokens made when users sign in.
+
+Each validation of an email/token pair by Studio is cached under a hash of the
+pair (tokens are never stored) for `STUDIO_AUTH_SUCCESS_TTL` seconds if it was
+accepted and `STUDIO_AUTH_FAILURE_TTL` seconds if it was rejected, so repeated
+sign-in attempts with the same credentials don't each cost a request to Studio.
+
+Validation requests that fail because Studio is unreachable or erroring are
+not cached. Instead, a circuit breaker stops sending validation requests for
+`STUDIO_AUTH_BREAKER_COOLDOWN` seconds after `STUDIO_AUTH_BREAKER_THRESHOLD` of
+them failed within `STUDIO_AUTH_BREAKER_WINDOW` seconds. The cache and the
+breaker live in the django cache, so they are shared by all workers.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .services import ccserver_authenticate_user
+
+
+BREAKER_FAILURES_KEY = 'studio-auth-breaker:failures'
+BREAKER_OPEN_KEY = 'studio-auth-breaker:open'
+
+
+def validation_key(cctoken, ccemail):
+    pair = '%s\n%s' % (ccemail or '', cctoken)
+    return 'studio-auth:' + hashlib.sha256(pair.encode('utf-8')).hexdigest()
+
+
+def authenticate_token(cctoken, ccemail=None):
+    """
+    Same as `ccserver_authenticate_user`, using cached validations and not
+    calling Studio while the circuit breaker is open.
+    """
+    key = validation_key(cctoken, ccemail)
+    validation = cache.get(key)
+    if validation is not None:
+        return validation
+    if cache.get(BREAKER_OPEN_KEY):
+        return ('unavailable', 'Kolibri Studio is unavailable, please try again later.')
+
+    status, data = ccserver_authenticate_user(cctoken, ccemail)
+    if status == 'unavailable':
+        record_failure()
+        return (status, data)
+    cache.delete(BREAKER_FAILURES_KEY)
+    ttl = settings.STUDIO_AUTH_SUCCESS_TTL if status == 'success' else settings.STUDIO_AUTH_FAILURE_TTL
+    cache.set(key, (status, data), ttl)
+    return (status, data)
+
+
+def record_failure():
+    """
+    Count a failed validation request, opening the breaker past the threshold.
+    """
+    cache.add(BREAKER_FAILURES_KEY, 0, settings.STUDIO_AUTH_BREAKER_WINDOW)
+    try:
+        failures = cache.incr(BREAKER_FAILURES_KEY)
+    except ValueError:   # expired since the add
+        failures = 1
+        cache.set(BREAKER_FAILURES_KEY, failures, settings.STUDIO_AUTH_BREAKER_WINDOW)
+    if failures >= settings.STUDIO_AUTH_BREAKER_THRESHOLD:
+        # the counter outlives the cooldown, so the first failure after it reopens the breaker
+        print('Studio token validations failing, pausing them for', settings.STUDIO_AUTH_BREAKER_COOLDOWN, 'seconds')
+        cache.set(BREAKER_OPEN_KEY, True, settings.STUDIO_AUTH_BREAKER_COOLDOWN)
@@ -0,0 +1,135 @@
+"""
+Crawler loading the topic tree of a channel from Kolibri Studio.
+
+Studio only returns the children of one node per `get_node_tree_data` request,
+so the crawler walks the tree breadth-first with up to `concurrency` requests in
+flight over a pool of keep-alive connections. Children are attached to their
+parent node as responses arrive, so the resulting tree doesn't depend on the
+order in which requests complete and is the same as loading it one node at a
+time: a list of the root's children, where every node with a `node_id` has
+a `children` list. Requests go through the shared `StudioClient` of the content
+server, which retries failed requests, and are coalesced with identical requests
+made at the same time by other crawls (see `sushibar.ccserverlib.singleflight`).
+
+Given the tree loaded for a previous run, the crawler only fetches the children
+of topics that changed: a topic whose metadata, as listed by its parent, has the
+same fingerprint as in the previous tree gets the previous subtree. This relies
+on the aggregate fields (e.g. counts and sizes) Studio lists topics with, which
+change when content is added or removed anywhere below a topic.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+
+from django.conf import settings
+import requests
+
+from .client import get_client
+from .singleflight import request_key, single_flight
+
+
+def node_fingerprint(node):
+    """
+    Hash of the metadata of `node`, excluding its children.
+    """
+    metadata = {key: value for key, value in node.items() if key != 'children'}
+    return hashlib.sha1(json.dumps(metadata, sort_keys=True).encode('utf-8')).hexdigest()
+
+def count_topics(nodes):
+    """
+    Number of nodes with a `node_id` in `nodes` and their descendants, i.e. the
+    number of requests needed to load their children.
+    """
+    count = 0
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node.get('node_id'):
+            count += 1
+            stack.extend(node.get('children', []))
+    return count
+
+
+class StudioTreeCrawler(object):
+    """
+    Loads the tree of `channel_id` from `content_server` using the token `cctoken`.
+    """
+    def __init__(self, content_server, cctoken, channel_id, concurrency=None, client=None):
+        self.content_server = content_server
+        self.cctoken = cctoken
+        self.channel_id = channel_id
+        self.concurrency = concurrency or settings.STUDIO_TREE_CRAWLER_CONCURRENCY
+        self.client = client or get_client(content_server)
+        self.requests_made = 0
+        self.requests_saved = 0
+
+    def crawl(self, previous_tree=None):
+        """
+        Return the tree of the channel as a list of the children of its root,
+        reusing the unchanged subtrees of `previous_tree` if given, or None if
+        the children of the root couldn't be fetched.
+        """
+        previous_nodes = {}   # node_id --> node of previous_tree
+        stack = list(previous_tree or [])
+        while stack:
+            node = stack.pop()
+            if node.get('node_id') and 'children' in node:
+                previous_nodes[node['node_id']] = node
+                stack.extend(node['children'])
+
+        self.requests_made += 1
+        tree = self.fetch_children(None)
+        if tree is None:
+            return None
+        frontier = deque(tree)
+        in_flight = {}    # future --> node whose children it fetches
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while frontier or in_flight:
+                while frontier and len(in_flight) < self.concurrency:
+                    node = frontier.popleft()
+                    if not node.get('node_id'):
+                        continue
+                    previous_node = previous_nodes.get(node['node_id'])
+                    if previous_node and node_fingerprint(previous_node) == node_fingerprint(node):
+                        node['children'] = previous_node['children']
+                        self.requests_saved += 1 + count_topics(node['children'])
+                    else:
+                        # counted here rather than in the worker threads
+                        self.requests_made += 1
+                        in_flight[executor.submit(self.fetch_children, node['node_id'])] = node
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = in_flight.pop(future)
+                    children = future.result()
+                    if children is None:
+                        # keep what we had rather than dropping the subtree
+                        previous_node = previous_nodes.get(node['node_id'])
+                        node['children'] = previous_node['children'] if previous_node else []
+                        continue
+                    node['children'] = children
+                    frontier.extend(children)
+        return tree
+
+    def fetch_children(self, node_id):
+        """
+        Return the children of `node_id` (or of the channel root if None), or
+        None if the request failed after retries.
+        """
+        path = "/api/internal/get_node_tree_data"
+        data = {"node_id": node_id, "channel_id": self.channel_id}
+        try:
+            return single_flight(request_key(self.content_server, path, self.cctoken, data),
+                                 lambda: self._fetch_children(path, data))
+        except requests.RequestException as e:
+            print('Request for children of node', node_id, 'failed:', e)
+        print('ERROR could not load children of node', node_id, 'for channel', self.channel_id)
+        return None
+
+    def _fetch_children(self, path, data):
+        """Raises `requests.RequestException` if the request failed, so it isn't shared."""
+        response = self.client.post(path, self.cctoken, data=data)
+        response.raise_for_status()
+        return response.json().get("tree", [])
@@ -0,0 +1,111 @@
+from datetime import timedelta
+import shutil
+import tempfile
+from unittest import mock
+import uuid
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from sushibar.dashboard.views import annotate_dashboard_channels
+from sushibar.runs.models import ContentChannel, ContentChannelRun, ChannelRunStage, rebuild_channel_summary
+from sushibar.runs.treestore import write_tree
+from sushibar.users.models import BarUser
+
+
+class DashboardChannelsTest(TestCase):
+
+    def setUp(self):
+        self.user = BarUser.objects.create(username='dashboard-user', cctoken='usertoken')
+
+    def _create_channels(self, count):
+        """
+        Create `count` channels with two runs of two stages each. Uses bulk_create
+        (which skips the post_save hooks) so that 1,000 channels are cheap, and
+        rebuilds the channel summaries afterwards.
+        """
+        now = timezone.now()
+        channels = ContentChannel.objects.bulk_create(
+            ContentChannel(channel_id=uuid.uuid4(), name='channel %d' % i) for i in range(count))
+        runs = []
+        for channel in ContentChannel.objects.filter(name__startswith='channel '):
+            for token in ['othertoken', 'usertoken']:
+                runs.append(ContentChannelRun(channel=channel, chef_name='chef', started_by_user_token=token))
+        ContentChannelRun.objects.bulk_create(runs)
+        ChannelRunStage.objects.bulk_create(
+            ChannelRunStage(run=run, name=name, finished=now + timedelta(minutes=i), duration=timedelta(minutes=1))
+            for run in runs for i, name in enumerate(['Status.STARTED', 'Status.COMPLETED']))
+        for channel in ContentChannel.objects.all():
+            rebuild_channel_summary(channel)
+        return channels
+
+    def test_last_run_and_annotations(self):
+        channel = ContentChannel.objects.create(channel_id=uuid.uuid4(), name='tracked')
+        new_channel = ContentChannel.objects.create(channel_id=uuid.uuid4(), name='new')
+        channel.followers.add(self.user)
+        ContentChannelRun.objects.create(channel=channel, started_by_user_token='usertoken')
+        last_run = ContentChannelRun.objects.create(channel=channel, started_by_user_token='othertoken')
+        now = timezone.now()
+        ChannelRunStage.objects.create(run=last_run, name='Status.STARTED', finished=now, duration=timedelta(seconds=30))
+        last_event = ChannelRunStage.objects.create(run=last_run, name='Status.COMPLETED',
+                                                    finished=now + timedelta(minutes=1), duration=timedelta(seconds=45))
+
+        channels = {c.pk: c for c in annotate_dashboard_channels(ContentChannel.objects.all(), self.user)}
+        tracked = channels[channel.pk]
+        self.assertEqual(tracked.last_run, last_run)
+        self.assertEqual(tracked.last_run.last_event, last_event)
+        self.assertEqual(tracked.last_run.total_duration, timedelta(seconds=75))
+        self.assertTrue(tracked.starred)
+        self.assertTrue(tracked.can_edit)
+        self.assertIsNone(channels[new_channel.pk].last_run)
+        self.assertFalse(channels[new_channel.pk].starred)
+        self.assertFalse(channels[new_channel.pk].can_edit)
+
+    def test_query_count_does_not_depend_on_number_of_channels(self):
+        for count in [10, 1000]:
+            ContentChannel.objects.all().delete()
+            self._create_channels(count)
+            with self.assertNumQueries(1):
+                channels = annotate_dashboard_channels(ContentChannel.objects.all(), self.user)
+                for channel in channels:
+                    channel.last_run.last_event.name
+            self.assertEqual(len(channels), count)
+
+
+class RunTreeChildrenTest(TestCase):
+
+    def setUp(self):
+        self.trees_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(TREES_DIR=self.trees_dir)
+        self.settings_override.enable()
+        channel = ContentChannel.objects.create(channel_id=uuid.uuid4(), name='tree channel')
+        self.run = ContentChannelRun.objects.create(channel=channel, started_by_user_token='usertoken')
+        self.url = '/runs/%s/tree/' % self.run.run_id.hex
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.trees_dir)
+
+    @mock.patch('sushibar.dashboard.views.schedule_tree_load')
+    def test_missing_tree_is_loaded_in_background(self, schedule_tree_load):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'node_id': None, 'building': True, 'children': []})
+        schedule_tree_load.assert_called_once_with(self.run)
+
+    @mock.patch('sushibar.dashboard.views.schedule_tree_load')
+    def test_children(self, schedule_tree_load):
+        write_tree(self.run.get_tree_data_path(), [
+            {'title': 'Topic', 'kind': 'topic', 'node_id': 't', 'children': [
+                {'title': 'Video', 'kind': 'video', 'file_size': 2048}]},
+        ])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        topic = response.json()['children'][0]
+        self.assertTrue(topic['is_topic'])
+        self.assertEqual(topic['file_size'], '2.0KB')
+        self.assertNotIn('children', topic)
+        video = self.client.get(self.url, {'node_id': 't'}).json()['children'][0]
+        self.assertFalse(video['is_topic'])
+        self.assertEqual(self.client.get(self.url, {'node_id': 'missing'}).status_code, 404)
+        schedule_tree_load.assert_not_called()
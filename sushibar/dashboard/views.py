@@ -4,38 +4,33 @@ import json
 import re
 import uuid
 
-from channels import Group
-from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
-from django.db.models import Q, Max
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
-from django.shortcuts import redirect
+from django.db.models import Exists, OuterRef, Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import render_to_string
 from django.template import RequestContext
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.generic.base import TemplateView
-import redis
 
-from sushibar.ccserverlib.services import ccserver_get_topic_tree, get_channel_status_bulk, activate_channel, ccserver_publish_channel
-from sushibar.runs.models import ContentChannel, ContentChannelRun, ChannelRunStage
+from sushibar.ccserverlib.services import activate_channel, ccserver_publish_channel
+from sushibar.ccserverlib.status_cache import get_channel_statuses
+from sushibar.runs.live import get_live_status
+from sushibar.runs.logstats import empty_log_stats
+from sushibar.runs.models import ContentChannel, ContentChannelRun
+from sushibar.runs.treestore import TreeReader
+from sushibar.runs.utils import schedule_tree_load
 from sushibar.services.trello.api import trello_add_card_to_channel
 
 from .forms import ChannelCreateForm
 
 
-REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
-                          port=settings.MMVP_REDIS_PORT,
-                          db=settings.MMVP_REDIS_DB,
-                          charset="utf-8",
-                          decode_responses=True)
-
-
 def open_channel_page(request, channel):
-    channel = ContentChannel.objects.get(channel_id=uuid.UUID(channel))
-    last_run = channel.get_last_run()
-    return redirect('runs', last_run and last_run.run_id)
+    channel = ContentChannel.objects.select_related('summary').get(channel_id=uuid.UUID(channel))
+    summary = getattr(channel, 'summary', None)
+    return redirect('runs', summary and summary.last_run_id)
 
 def deploy_channel(request, channelid):
     status, response = activate_channel(request.user, channelid)
@@ -108,15 +103,15 @@ def get_status(status, run=None, channel_id=None):
 
 def get_bulk_status_mapping_for_channels_as_baruser(channels, baruser):
     """
-    Makes "bulk requests" to Studio server to get channel status for all the
-    channels we're about to display on the dashboard.
+    Gets the Studio channel status for all the channels we're about to display
+    on the dashboard from the status cache, which refreshes them in bulk.
     Assumptions: baruser has access to
     """
     status_mapping = {}
     # Group requests based on the Studio instance that we need to query
     channels_by_studio_server = defaultdict(list)
     for channel in channels:
-        last_run = channels.exists() and channel.get_last_run()
+        last_run = channel.last_run   # see annotate_dashboard_channels
         if last_run:
             studio_server = last_run.content_server
             if studio_server:
@@ -125,18 +120,43 @@ def get_bulk_status_mapping_for_channels_as_baruser(channels, baruser):
     # Do batchs requests for statuses from all Kolibri servers
     for studio_server, channels in channels_by_studio_server.items():
         if 'learningequality.org' in studio_server:
-            print('Making bulk request to', studio_server)
             channel_ids = [c.channel_id.hex for c in channels]
-            statuses_dict = get_channel_status_bulk(studio_server, baruser.cctoken, channel_ids)
+            statuses_dict = get_channel_statuses(studio_server, baruser.cctoken, channel_ids)
             status_mapping.update(statuses_dict)
         else:
-            print('Skipping bulk request to', studio_server)
+            print('Skipping status lookup for', studio_server)
     #
     return status_mapping
 
 
 
 
+def annotate_dashboard_channels(channels, baruser):
+    """
+    Load the `channels` queryset with everything the dashboard shows about each
+    channel in a single query, reading the last run of each channel from its
+    `ChannelSummary`. Returns a list of channels ordered by last run date, each
+    with a `last_run` attribute (None for new channels) that has `last_event`
+    and `total_duration` attributes, and `starred` and `can_edit` annotations
+    for `baruser`.
+    """
+    followers = ContentChannel.followers.through.objects.filter(contentchannel=OuterRef('pk'), baruser=baruser.pk)
+    user_runs = ContentChannelRun.objects.filter(channel=OuterRef('pk'), started_by_user_token=baruser.cctoken)
+    channels = channels.select_related('summary__last_run', 'summary__last_event').annotate(
+        starred=Exists(followers),
+        can_edit=Exists(user_runs),
+    ).order_by('-summary__last_run_date')
+
+    channels = list(channels)
+    for channel in channels:
+        summary = getattr(channel, 'summary', None)
+        channel.last_run = summary and summary.last_run
+        if channel.last_run:
+            channel.last_run.last_event = summary.last_event
+            channel.last_run.total_duration = summary.total_duration
+    return channels
+
+
 # DASHABOARD ###################################################################
 class DashboardView(LoginRequiredMixin, TemplateView):
 
@@ -192,7 +212,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                             .values_list('channel__id', flat=True).distinct()
             channels = ContentChannel.objects.filter(pk__in=channel_ids)
 
-        channels = channels.annotate(last_run_date=Max('runs__modified_at')).order_by('-last_run_date')
+        channels = annotate_dashboard_channels(channels, self.request.user)
 
         # Try to get channel status information from Kolibri Studio
         status_mapping = {}   # { "<channel_id>": "{{status_str}}", ... }
@@ -202,21 +222,28 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             status_mapping = {}
             print('ERROR during get_bulk_status_mapping_for_channels_as_baruser, continuing...', e)
 
+        # Progress, log stats and chef presence for all channels, in bulk
+        run_ids = [channel.last_run.run_id.hex for channel in channels if channel.last_run]
+        channel_ids = [channel.channel_id.hex for channel in channels if channel.last_run]
+        try:
+            progress_by_run, log_stats_by_run, listening = get_live_status(run_ids, channel_ids)
+        except Exception as e:
+            progress_by_run, log_stats_by_run, listening = {}, {}, {}
+            print('ERROR during get_live_status, continuing...', e)
+
         # MAIN LOOP
         ########################################################################
-        # TODO(arvnd): This can very easily be optimized by querying the runs table directly.
         for channel in channels:
 
             # Get the most recent run for the channel
-            try:
-                last_run = channel.runs.latest("created_at")
-            except ContentChannelRun.DoesNotExist:
+            last_run = channel.last_run
+            if last_run is None:
                 print("No runs for channel %s " % channel.name, "continuing...")
                 channel_data = {
                     "channel": channel.name,
                     "due_date": channel.due_date,
                     "id": channel.channel_id.hex,
-                    "starred": self.request.user.is_authenticated and self.request.user.saved_channels.filter(channel_id=channel.channel_id).exists(),
+                    "starred": channel.starred,
                     "status": "New",
                     "spec_sheet_url": channel.spec_sheet_url,
                     "chef_repo_url": channel.chef_repo_url,
@@ -226,26 +253,22 @@ class DashboardView(LoginRequiredMixin, TemplateView):
 
                 continue
 
-            try:
-                last_event = last_run.events.latest("finished")
-            except ChannelRunStage.DoesNotExist:
+            last_event = last_run.last_event
+            if last_event is None:
                 print("No stages for run %s" % last_run.run_id.hex, "continuing...")
                 continue
 
-            progress = REDIS.hgetall(last_run.run_id.hex)
-            total_duration = sum((event.duration for event in last_run.events.all()), timedelta())
+            progress = progress_by_run.get(last_run.run_id.hex)
+            total_duration = last_run.total_duration
 
             # Channels with errors are flagged in YELLLOW, channels with critical errors in RED
-            logs = last_run.get_logs()
-            failed = any(logs.get('critical'))
-            warnings = any(logs.get('error'))
+            log_stats = log_stats_by_run.get(last_run.run_id.hex) or empty_log_stats()
+            failed_count = log_stats['counts']['CRITICAL']
+            warning_count = log_stats['counts']['ERROR']
+            failed = failed_count > 0
 
             # check if any daemonized chef is listening for control commands
-            control_group = Group('control-' + channel.channel_id.hex)
-            listeners = control_group.channel_layer.group_channels(control_group.name)
-            active = True if len(listeners) > 0 else False
-
-            starred = self.request.user.is_authenticated and self.request.user.saved_channels.filter(channel_id=channel.channel_id).exists()
+            active = listening.get(channel.channel_id.hex, False)
 
             # Channel status according to Kolibri Studio (main soruce of truth)
             ccstatus = get_status_for_mapping(channel, status_mapping, run=last_run)
@@ -262,7 +285,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 "active": active,
                 "id": channel.channel_id.hex,
                 "ccstatus": ccstatus,
-                "starred": starred,
+                "starred": channel.starred,
                 "last_run_date": datetime.strftime(last_event.finished, "%b %d, %H:%M"),
                 "last_run_id": last_run.run_id,
                 "duration": str(timedelta(seconds=total_duration.seconds)),
@@ -272,9 +295,10 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 "chef_name": fmt_chef_name(last_run.chef_name),
                 "chef_link": make_chef_link(last_run.chef_name),
                 "cl_flags": fmt_cl_flags(last_run),
-                "failed_count": failed and len(logs.get('critical')),
-                "warning_count": warnings and len(logs.get('error')),
-                "can_edit": self.request.user.is_staff or channel.runs.filter(started_by_user_token=self.request.user.cctoken).exists(),
+                "failed_count": failed_count,
+                "warning_count": warning_count,
+                "last_error": (log_stats['critical'] or log_stats['error'] or [None])[-1],
+                "can_edit": self.request.user.is_staff or channel.can_edit,
             }
             context['channels'].append(channel_data)
 
@@ -335,13 +359,39 @@ def get_run_stats(current_run_stats, previous_run_stats, format_value_fn = lambd
             })
     return stats
 
-def modify_data_recursively(data):
-    for root in data:
-        root["icon"] = resource_icons.get(root["kind"], "fa-file")
-        if "file_size" in root:
-            root["file_size"] = sizeof_fmt(root["file_size"])
-        if "children" in root:
-            modify_data_recursively(root["children"])
+def format_tree_node(node, reader):
+    """
+    Return the data shown for `node` in the content tree, without its subtree.
+    Topics show the total size of the files below them.
+    """
+    data = {key: value for key, value in node.items() if key != "children"}
+    data["icon"] = resource_icons.get(node["kind"], "fa-file")
+    data["is_topic"] = reader.is_topic(node.get("node_id"))
+    if data["is_topic"]:
+        aggregates = reader.get_aggregates(node["node_id"])
+        data["file_size"] = sizeof_fmt(sum(kind["file_size"] for kind in aggregates.values()))
+    elif "file_size" in node:
+        data["file_size"] = sizeof_fmt(node["file_size"])
+    return data
+
+def run_tree_children(request, runid):
+    """
+    Return the children of the topic `node_id` (GET param, the channel root if
+    empty) in the content tree of the run `runid`. If the tree hasn't been
+    loaded from Studio yet, queue its load and return `building: true` with a
+    202 status so the page polls again.
+    """
+    run = get_object_or_404(ContentChannelRun, run_id=uuid.UUID(runid))
+    node_id = request.GET.get('node_id') or None
+    with TreeReader(run.get_tree_data_path()) as reader:
+        if not reader.exists():
+            schedule_tree_load(run)
+            return JsonResponse({'node_id': node_id, 'building': True, 'children': []}, status=202)
+        children = reader.get_children(node_id, recursive=False)
+        if children is None:
+            raise Http404
+        return JsonResponse({'node_id': node_id,
+                             'children': [format_tree_node(child, reader) for child in children]})
 
 
 # RUN DETAIL ###################################################################
@@ -391,7 +441,7 @@ class RunView(TemplateView):
                 break
 
         try:
-            status_dict = get_channel_status_bulk(run.content_server, run.started_by_user_token, [run.channel.channel_id.hex])
+            status_dict = get_channel_statuses(run.content_server, run.started_by_user_token, [run.channel.channel_id.hex])
             if status_dict:
                 channel_status = status_dict[run.channel.channel_id.hex]
                 context['channel_status'] = channel_status
@@ -401,6 +451,9 @@ class RunView(TemplateView):
 
         context['channel'] = run.channel
         context['run'] = run
+        context['tree_building'] = not TreeReader(run.get_tree_data_path()).exists()
+        if context['tree_building']:
+            schedule_tree_load(run)   # start loading before the tree tab is opened
 
         run.extra_options = run.extra_options or {}
         context['channel_run_status'] = "staged" if run.extra_options.get("staged") else None
@@ -450,26 +503,21 @@ class RunView(TemplateView):
         else:
             context['saved_icon_class'] = 'fa-star-o'
 
-        tree_data = []
+        # The content tree is loaded lazily from `run_tree_children`
+
+        # Log lines are loaded lazily from the run logs API, only show counts here
         try:
-            with open(run.get_tree_data_path(), 'r') as tree_file:
-                tree_data = json.load(tree_file)
-        except FileNotFoundError:
-            tree_data = ccserver_get_topic_tree(run)
-
-        modify_data_recursively(tree_data)
-        context['topic_tree'] = tree_data
-
-        logfile_path = run.logfile.path
-        run.logfile.open(mode='r')
-        context['logs'] = run.logfile.readlines()
-        for level in 'critical', 'error':
-            try:
-                with open("%s.%s" % (logfile_path, level)) as f:
-                    context[level] = f.readlines()
-            except OSError:
-                context[level] = []
-                continue
+            _, log_stats_by_run, listening = get_live_status([run.run_id.hex], [run.channel.channel_id.hex])
+        except Exception as e:
+            log_stats_by_run, listening = {}, {}
+            print('ERROR during get_live_status, continuing...', e)
+        log_counts = (log_stats_by_run.get(run.run_id.hex) or empty_log_stats())['counts']
+        context['log_counts'] = {
+            'logs': log_counts['lines'],
+            'critical': log_counts['CRITICAL'],
+            'error': log_counts['ERROR'],
+        }
+        context['chef_active'] = listening.get(run.channel.channel_id.hex, False)
 
         context['channel_url'] = "%s/%s/edit" % (run.channel.default_content_server, run.channel.channel_id.hex)
         context['request_storage_email'] = run.started_by_user or self.request.user.is_authenticated and self.request.user.email
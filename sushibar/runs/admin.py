@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import ContentChannel, ContentChannelRun, ChannelRunStage
+from .models import ContentChannel, ContentChannelRun, ChannelRunStage, TrelloRequestFailure
 
 
 @admin.register(ContentChannel)
@@ -22,3 +22,8 @@ class ContentChannelRunAdmin(admin.ModelAdmin):
     inlines = [ChannelRunStageInline, ]
     list_display = ('run_id', 'channel_id', 'chef_name', 'created_at')
 
+
+@admin.register(TrelloRequestFailure)
+class TrelloRequestFailureAdmin(admin.ModelAdmin):
+    list_display = ('id', 'method', 'endpoint', 'status_code', 'attempts', 'created_at')
+    search_fields = ['endpoint', 'error']
@@ -1,9 +1,11 @@
 
 from datetime import timedelta
 import json
+import uuid
 
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
 from django.http import Http404, HttpResponseBadRequest
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -15,18 +17,21 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from channels import Group
 
-from .models import ContentChannel, ContentChannelRun, ChannelRunStage
+from .models import ContentChannel, ContentChannelRun, ChannelRunStage, record_run_stages
 from .serializers import ContentChannelSerializer
 from .serializers import ContentChannelRunSerializer
 from .serializers import ChannelRunStageCreateSerializer, ChannelRunStageSerializer
+from .serializers import ChannelRunStageBulkCreateSerializer
 from .serializers import ChannelRunProgressSerializer
+from .serializers import ChannelRunLogsQuerySerializer
 from .serializers import ContentChannelSaveToProfileSerializer
 from .serializers import ChannelControlSerializer
-from .utils import set_run_options, calculate_channel_id
+from .logstats import delete_log_stats
+from .logstore import LogReader
+from .utils import calculate_channel_id, schedule_run_completed
 
 
-from sushibar.services.trello.api import trello_move_card_to_qa_list, trello_add_checklist_item, trello_add_channel_link
-from sushibar.tasks import load_tree_for_channel_task
+from sushibar.services.trello.api import trello_move_card_to_qa_list, trello_add_checklist_item
 
 # REDIS connection #############################################################
 import redis
@@ -168,6 +173,10 @@ class ContentChannelRunDetail(APIView):
     def delete(self, request, run_id, format=None):
         run = self.get_object(run_id)
         run.delete()
+        try:
+            delete_log_stats(run.run_id.hex)
+        except redis.RedisError as e:
+            print('ERROR could not delete log stats of run', run.run_id.hex, e)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -200,27 +209,14 @@ class ChannelRunStageListCreate(APIView):
             duration = timedelta(seconds=create_serializer.data['duration'])
             server_time = timezone.now()
             calculated_started = server_time - duration
-            run_stage = ChannelRunStage.objects.create(run_id=run_id,
+            run_stage = ChannelRunStage.objects.create(run_id=uuid.UUID(run_id),
                                                        name=create_serializer.data['stage'],
                                                        started=calculated_started,
                                                        finished=server_time,
                                                        duration=duration)
             if run_stage.name == 'COMPLETED':
-                run = ContentChannelRun.objects.get(run_id=run_id)
-                # run `load_tree_for_channel` as a background task
-                run_dict = dict(
-                    content_server=run.content_server,
-                    channel_id=run.channel.channel_id.hex,
-                    started_by_user_token=run.started_by_user_token,
-                    tree_data_path=run.get_tree_data_path(),
-                )
-                print('using run_dict', run_dict)
-                load_tree_for_channel_task.delay(run_dict)
-                set_run_options(run)
-                run.channel.new_run_complete = True
-                run.channel.save()
-                if run.channel.trello_url:
-                    trello_add_channel_link(run.channel)
+                run = ContentChannelRun.objects.select_related('channel').get(run_id=run_id)
+                schedule_run_completed(run)
 
             # TODO: cleanup dict in redis under name `run_id` on FINISHED stage
             response_serializer = ChannelRunStageSerializer(run_stage)
@@ -228,6 +224,93 @@ class ChannelRunStageListCreate(APIView):
         return Response(create_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ChannelRunStageBulkCreate(APIView):
+    """
+    Create several stages for the ContentChannelRun `run_id` in one request.
+    """
+    def post(self, request, run_id, format=None):
+        """
+        POST: notify sushibar that `run_id` sushichef has finished these stages,
+        the last one just now. Each stage is taken to have finished when the
+        next one started.
+        """
+        create_serializer = ChannelRunStageBulkCreateSerializer(data=request.data)
+        if not create_serializer.is_valid():
+            return Response(create_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        stages_data = create_serializer.data['stages']
+        if any(stage_data['run_id'] != run_id for stage_data in stages_data):
+            return HttpResponseBadRequest('run_id mismatch in HTTP POST')
+        try:
+            run = ContentChannelRun.objects.select_related('channel').get(run_id=run_id)
+        except ContentChannelRun.DoesNotExist:
+            raise Http404
+
+        finished = timezone.now()
+        run_stages = []
+        for stage_data in reversed(stages_data):
+            duration = timedelta(seconds=stage_data['duration'])
+            run_stages.append(ChannelRunStage(run=run,
+                                              name=stage_data['stage'],
+                                              started=finished - duration,
+                                              finished=finished,
+                                              duration=duration))
+            finished -= duration
+        run_stages.reverse()
+        with transaction.atomic():
+            run_stages = ChannelRunStage.objects.bulk_create(run_stages)
+            record_run_stages(run.run_id, run_stages)   # bulk_create doesn't send post_save
+        if any(run_stage.name == 'COMPLETED' for run_stage in run_stages):
+            schedule_run_completed(run)
+
+        response_serializer = ChannelRunStageSerializer(run_stages, many=True)
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
+
+# CHANNEL RUN LOGS #############################################################
+
+class ChannelRunLogs(APIView):
+    """
+    Read a window of the logs of the ContentChannelRun `run_id`.
+    """
+    level_suffixes = {
+        'all': '',
+        'error': '.error',
+        'critical': '.critical',
+    }
+
+    def get(self, request, run_id, format=None):
+        try:
+            run = ContentChannelRun.objects.get(run_id=run_id)
+        except ContentChannelRun.DoesNotExist:
+            raise Http404
+        serializer = ChannelRunLogsQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        query = serializer.validated_data
+        max_lines = settings.LOG_API_MAX_LINES
+
+        reader = LogReader(run.logfile.path + self.level_suffixes[query['level']])
+        response_data = {
+            'run_id': run.run_id.hex,
+            'level': query['level'],
+            'total_lines': reader.line_count(),
+        }
+        if 'offset' in query:
+            limit = min(query.get('limit', 64 * 1024), max_lines * 1024)
+            lines, next_offset = reader.read_bytes(query['offset'], limit)
+            response_data.update(offset=query['offset'], next_offset=next_offset)
+        elif 'tail' in query:
+            start, lines = reader.tail(min(query['tail'], max_lines))
+            response_data.update(start=start)
+        else:
+            start = query.get('start', 0)
+            lines = reader.read_lines(start, min(query.get('count', max_lines), max_lines))
+            response_data.update(start=start)
+        response_data['lines'] = lines
+        return Response(response_data)
+
+
 
 # CHANNEL RUN PROGRESS #########################################################
 # Temporary hack for MMVP --- manually store/retrieve progress in redis
@@ -0,0 +1,76 @@
+"""
+Bulk lookups of the live state of channel runs kept in redis: the progress
+reported by chefs (see `ChannelRunProgressEndpoints`), the log stats of runs
+(see `sushibar.runs.logstats`) and whether a daemonized chef is listening for
+control commands on the `control-<channel_id>` group of each channel.
+
+Pages showing many runs use `get_live_status` to fetch all of it with one
+pipelined round-trip per redis server instead of several requests per run.
+"""
+import time
+
+from channels import DEFAULT_CHANNEL_LAYER, channel_layers
+from django.conf import settings
+import redis
+
+from .logstats import parse_log_stats, queue_log_stats
+
+
+REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
+                          port=settings.MMVP_REDIS_PORT,
+                          db=settings.MMVP_REDIS_DB,
+                          charset="utf-8",
+                          decode_responses=True)
+
+
+def control_group_name(channel_id):
+    return 'control-' + channel_id
+
+
+def get_live_status(run_ids, channel_ids, client=None):
+    """
+    Return `(progress, log_stats, listening)` where `progress` and `log_stats`
+    are dicts keyed by the run ids in `run_ids` and `listening` maps each of the
+    `channel_ids` (hex strings) to True if a chef is listening on its control group.
+    """
+    pipe = (client or REDIS).pipeline(transaction=False)
+    stats_commands = 0
+    for run_id in run_ids:
+        pipe.hgetall(run_id)
+        stats_commands = queue_log_stats(pipe, run_id)
+    results = iter(pipe.execute() if run_ids else [])
+    progress, log_stats = {}, {}
+    for run_id in run_ids:
+        progress[run_id] = next(results)
+        log_stats[run_id] = parse_log_stats([next(results) for _ in range(stats_commands)])
+    return progress, log_stats, get_listening_channels(channel_ids)
+
+
+def get_listening_channels(channel_ids):
+    """
+    Return `{channel_id: True if a chef is listening on its control group}`.
+    """
+    channel_layer = channel_layers[DEFAULT_CHANNEL_LAYER].channel_layer
+    if not hasattr(channel_layer, '_group_key'):
+        # not an asgi_redis layer, fall back to one lookup per group
+        return {channel_id: len(channel_layer.group_channels(control_group_name(channel_id))) > 0
+                for channel_id in channel_ids}
+
+    # asgi_redis keeps each group in a sorted set scored by the time channels
+    # were added, sharded over its hosts; count the members that haven't expired
+    min_score = '(%d' % (int(time.time()) - channel_layer.group_expiry)
+    pipes = {}           # host index --> pipeline
+    queued = {}          # host index --> channel ids, in the order queued
+    for channel_id in channel_ids:
+        name = control_group_name(channel_id)
+        index = channel_layer.consistent_hash(name)
+        if index not in pipes:
+            pipes[index] = channel_layer.connection(index).pipeline(transaction=False)
+            queued[index] = []
+        pipes[index].zcount(channel_layer._group_key(name), min_score, '+inf')
+        queued[index].append(channel_id)
+    listening = {}
+    for index, pipe in pipes.items():
+        for channel_id, count in zip(queued[index], pipe.execute()):
+            listening[channel_id] = count > 0
+    return listening
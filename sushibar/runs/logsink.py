@@ -0,0 +1,222 @@
+"""
+Buffered writer for the run logs received via websockets.
+
+Opening, appending to and closing the logfile for every log line is expensive
+when many chefs are logging at the same time, so the `LogSink` keeps a bounded
+LRU pool of open file handles and buffers lines in memory for each file. The
+buffer of a file is flushed once it grows past `flush_bytes` or once its oldest
+line has been waiting for more than `flush_interval` seconds. Buffers are kept
+per worker process, so with `background_flush` a daemon thread of the process
+flushes stale buffers even when no more lines arrive, e.g. once a chef goes
+quiet or its websocket disconnect is handled by another worker.
+
+When `index_interval` is set, the sink also maintains the sparse line-offset
+index of each file it writes, and seals the file as a segment of the log once
+it grows past `segment_max_bytes` (see `sushibar.runs.logstore`).
+"""
+import atexit
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .logstore import LineIndex
+
+
+class BackgroundFlusher(object):
+    """
+    Calls `flush` every `interval` seconds from a daemon thread, started by the
+    first call to `ensure_started` in each process.
+    """
+    def __init__(self, flush, interval):
+        self.flush = flush
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='background-flusher', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print('ERROR could not flush buffered lines:', e)
+
+
+class LogSink(object):
+    """
+    Append-only line writer with a pool of open file handles.
+    """
+    def __init__(self, max_open_files=128, flush_bytes=64*1024, flush_interval=1.0,
+                 index_interval=None, segment_max_bytes=None, on_seal=None, background_flush=False):
+        self.max_open_files = max_open_files
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.index_interval = index_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.on_seal = on_seal          # called with the path of each sealed segment
+        self._handles = OrderedDict()   # path --> open file, least recently used first
+        self._indexes = {}              # path --> LineIndex of the open file
+        self._buffers = {}              # path --> list of lines waiting to be written
+        self._buffer_sizes = {}         # path --> number of chars in buffer
+        self._buffered_since = {}       # path --> time when first line was buffered
+        self._lock = threading.RLock()
+        self._flusher = BackgroundFlusher(self.flush_stale, flush_interval) if background_flush else None
+
+    def write(self, path, lines):
+        """
+        Buffer `lines` (newline-terminated strings) for appending to `path`.
+        """
+        if not lines:
+            return
+        if self._flusher:
+            self._flusher.ensure_started()
+        with self._lock:
+            buffer = self._buffers.get(path)
+            if buffer is None:
+                buffer = self._buffers[path] = []
+                self._buffer_sizes[path] = 0
+                self._buffered_since[path] = time.monotonic()
+            buffer.extend(lines)
+            self._buffer_sizes[path] += sum(len(line) for line in lines)
+            if self._buffer_sizes[path] >= self.flush_bytes:
+                self._flush_path(path)
+            self.flush_stale()
+
+    def flush_stale(self):
+        """
+        Flush all buffers that have been waiting for longer than `flush_interval`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            stale_paths = [path for path, since in self._buffered_since.items()
+                           if now - since >= self.flush_interval]
+            for path in stale_paths:
+                self._flush_path(path)
+
+    def flush(self, path=None):
+        """
+        Flush the buffer for `path`, or all buffers if `path` is None.
+        """
+        with self._lock:
+            paths = [path] if path else list(self._buffers.keys())
+            for path in paths:
+                self._flush_path(path)
+
+    def close(self, path):
+        """
+        Flush the buffer for `path` and close its file handle.
+        """
+        with self._lock:
+            self._flush_path(path)
+            self._close_handle(path)
+            index = self._indexes.pop(path, None)
+            if index:
+                index.close()
+
+    def close_all(self):
+        with self._lock:
+            self.flush()
+            for path in list(self._handles.keys()):
+                self._close_handle(path)
+            for index in self._indexes.values():
+                index.close()
+            self._indexes.clear()
+
+    def _close_handle(self, path):
+        handle = self._handles.pop(path, None)
+        if handle:
+            handle.close()
+
+    def _get_handle(self, path):
+        handle = self._handles.get(path)
+        if handle:
+            self._handles.move_to_end(path)
+            return handle
+        while len(self._handles) >= self.max_open_files:
+            evicted_path, evicted_handle = self._handles.popitem(last=False)
+            evicted_handle.close()
+            evicted_index = self._indexes.pop(evicted_path, None)
+            if evicted_index:
+                evicted_index.close()
+        handle = self._handles[path] = open(path, 'ab')
+        return handle
+
+    def _flush_path(self, path):
+        lines = self._buffers.pop(path, None)
+        self._buffer_sizes.pop(path, None)
+        self._buffered_since.pop(path, None)
+        if not lines:
+            return
+        data = ''.join(lines).encode('utf-8')
+        if not self.index_interval:
+            handle = self._get_handle(path)
+            handle.write(data)
+            handle.flush()
+            return
+        index = self._indexes.get(path)
+        if index is None:
+            index = self._indexes[path] = LineIndex(path, interval=self.index_interval)
+            self._close_handle(path)
+        with index.lock():
+            # Other workers may have appended to the file or sealed it since our
+            # last write, so catch up with their changes before indexing ours.
+            if path in self._handles and not self._is_current(path):
+                self._close_handle(path)
+            if path not in self._handles:
+                handle = self._get_handle(path)
+                index.refresh()
+            else:
+                handle = self._get_handle(path)
+                if index.segments.base_offset + os.fstat(handle.fileno()).st_size != index.size:
+                    index.refresh()
+            handle.write(data)
+            handle.flush()
+            index.append(data)
+            size = os.fstat(handle.fileno()).st_size
+            if self.segment_max_bytes and size >= self.segment_max_bytes:
+                sealed_path = index.segments.seal(size)
+                self._close_handle(path)
+                if self.on_seal:
+                    self.on_seal(sealed_path)
+
+    def _is_current(self, path):
+        """
+        Check the open handle for `path` still refers to the active segment.
+        """
+        try:
+            return os.stat(path).st_ino == os.fstat(self._handles[path].fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+
+def compress_sealed_segment(sealed_path):
+    """
+    Compress sealed segments in the background to keep the ASGI worker free.
+    """
+    from sushibar.tasks import compress_log_segment_task
+    try:
+        compress_log_segment_task.delay(sealed_path)
+    except Exception as e:
+        # readers handle plain sealed segments, so only storage is lost
+        print('ERROR could not enqueue compression of log segment', sealed_path, e)
+
+
+sink = LogSink(max_open_files=settings.LOGSINK_MAX_OPEN_FILES,
+               flush_bytes=settings.LOGSINK_FLUSH_BYTES,
+               flush_interval=settings.LOGSINK_FLUSH_INTERVAL,
+               index_interval=settings.LOG_INDEX_INTERVAL,
+               segment_max_bytes=settings.LOG_SEGMENT_MAX_BYTES,
+               on_seal=compress_sealed_segment,
+               background_flush=True)
+atexit.register(sink.close_all)
@@ -0,0 +1,110 @@
+"""
+Running per-level log counts for channel runs, kept in redis.
+
+`ws_logs.receive` updates the counts (and the last few ERROR and CRITICAL
+lines) as log records arrive, so pages that only need log summaries never have
+to open the logfiles.
+"""
+from django.conf import settings
+import redis
+
+from .logstore import LogReader
+
+
+REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
+                          port=settings.MMVP_REDIS_PORT,
+                          db=settings.MMVP_REDIS_DB,
+                          charset="utf-8",
+                          decode_responses=True)
+
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+TAIL_LEVELS = ['ERROR', 'CRITICAL']
+
+
+def logstats_key(run_id):
+    return 'logstats-%s' % run_id
+
+def logtail_key(run_id, level):
+    return 'logtail-%s-%s' % (run_id, level.lower())
+
+
+def record_log_lines(run_id, lines_by_level, client=None):
+    """
+    Increment the log counts for `run_id` given a dict `{levelname: [lines]}`,
+    using a single redis round-trip. The total number of lines is kept under
+    the key `lines` of the counts hash.
+    """
+    pipe = (client or REDIS).pipeline(transaction=False)
+    key = logstats_key(run_id)
+    total = 0
+    for level, lines in lines_by_level.items():
+        if not lines:
+            continue
+        total += len(lines)
+        pipe.hincrby(key, level, len(lines))
+        if level in TAIL_LEVELS:
+            tail_key = logtail_key(run_id, level)
+            tail = lines[-settings.LOG_TAIL_LENGTH:]
+            pipe.rpush(tail_key, *[line.rstrip('\n') for line in tail])
+            pipe.ltrim(tail_key, -settings.LOG_TAIL_LENGTH, -1)
+    if total:
+        pipe.hincrby(key, 'lines', total)
+        pipe.execute()
+
+
+def queue_log_stats(pipe, run_id):
+    """
+    Queue the commands to fetch the log stats of `run_id` on the redis pipeline
+    `pipe` and return how many were queued; their results are parsed by
+    `parse_log_stats`.
+    """
+    pipe.hgetall(logstats_key(run_id))
+    for level in TAIL_LEVELS:
+        pipe.lrange(logtail_key(run_id, level), 0, -1)
+    return 1 + len(TAIL_LEVELS)
+
+def parse_log_stats(results):
+    """
+    Build a log stats dict from the pipeline results queued by `queue_log_stats`.
+    """
+    counts = {level: 0 for level in LOG_LEVELS + ['lines']}
+    counts.update({k: int(v) for k, v in results[0].items()})
+    stats = {'counts': counts}
+    for level, tail in zip(TAIL_LEVELS, results[1:]):
+        stats[level.lower()] = tail
+    return stats
+
+def empty_log_stats():
+    """Log stats of a run without any logs."""
+    return parse_log_stats([{}] + [[] for level in TAIL_LEVELS])
+
+def get_log_stats(run_id, client=None):
+    """
+    Return `{'counts': {levelname: count, 'lines': total}, 'error': [last lines],
+    'critical': [last lines]}` for `run_id`.
+    """
+    pipe = (client or REDIS).pipeline(transaction=False)
+    queue_log_stats(pipe, run_id)
+    return parse_log_stats(pipe.execute())
+
+
+def delete_log_stats(run_id, client=None):
+    """Remove the log stats of `run_id`, e.g. once the run is deleted."""
+    (client or REDIS).delete(logstats_key(run_id), *[logtail_key(run_id, level) for level in TAIL_LEVELS])
+
+
+def rebuild_log_stats(run, client=None):
+    """
+    Recompute the log stats of `run` from its logfiles. Only needed for runs
+    whose logs were received before stats were tracked in redis.
+    """
+    client = client or REDIS
+    lines_by_level = {}
+    for line in LogReader(run.logfile.path).iter_lines():
+        level = line.split(' - ', 1)[0]
+        lines_by_level.setdefault(level if level in LOG_LEVELS else None, []).append(line)
+    other_lines = lines_by_level.pop(None, [])
+    delete_log_stats(run.run_id.hex, client=client)
+    record_log_lines(run.run_id.hex, lines_by_level, client=client)
+    if other_lines:
+        client.hincrby(logstats_key(run.run_id.hex), 'lines', len(other_lines))
@@ -0,0 +1,347 @@
+"""
+Storage of run logs as compressed segments, with a sparse line-offset index.
+
+A log stream (e.g. `<run_id>.log` or `<run_id>.log.error`) is stored as:
+  - `<name>`             the active segment, plain text, appended by the `LogSink`
+  - `<name>.<n>.gz`      sealed segments, gzip-compressed by a celery task
+                         (`<name>.<n>` while waiting to be compressed)
+  - `<name>.segments`    JSON list of sealed segments with their uncompressed
+                         size and their offset in the stream
+  - `<name>.idx`         byte offsets in the stream of every `interval`-th line,
+                         as 8-byte little-endian integers
+
+Offsets are "logical": they count the uncompressed bytes of the whole stream,
+sealed segments included. Seeking to line `n` reads one offset from the index,
+opens the segment that contains it, and skips at most `interval - 1` lines, so
+only the segments needed are decompressed and a window of a multi-hundred-MB
+log never requires reading the log from the start.
+
+Writers (`LogSink`) and readers updating the index hold an exclusive lock on the
+index file. Segments are sealed while holding that lock.
+"""
+from array import array
+from contextlib import contextmanager
+import fcntl
+import gzip
+import json
+import os
+import shutil
+
+from django.conf import settings
+
+
+INDEX_SUFFIX = '.idx'
+SEGMENTS_SUFFIX = '.segments'
+COMPRESSED_SUFFIX = '.gz'
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class LogSegments(object):
+    """
+    The manifest of sealed segments of the log stream at `path`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = path + SEGMENTS_SUFFIX
+        self.segments = []   # [{"number": n, "offset": stream offset, "size": bytes}]
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as manifest:
+                self.segments = json.load(manifest)
+        except FileNotFoundError:
+            self.segments = []
+        return self
+
+    @property
+    def base_offset(self):
+        """The offset in the stream where the active segment starts."""
+        if not self.segments:
+            return 0
+        last = self.segments[-1]
+        return last['offset'] + last['size']
+
+    def segment_path(self, number):
+        return '%s.%d' % (self.path, number)
+
+    def seal(self, size):
+        """
+        Turn the active segment of `size` bytes into a sealed segment and return
+        its path. Callers must hold the stream lock.
+        """
+        number = self.segments[-1]['number'] + 1 if self.segments else 1
+        sealed_path = self.segment_path(number)
+        os.rename(self.path, sealed_path)
+        self.segments.append({'number': number, 'offset': self.base_offset, 'size': size})
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest:
+            json.dump(self.segments, manifest)
+        os.rename(tmp_path, self.manifest_path)
+        return sealed_path
+
+    def open_segment(self, number):
+        """
+        Open the sealed segment `number` for reading, compressed or not.
+        """
+        sealed_path = self.segment_path(number)
+        try:
+            return gzip.open(sealed_path + COMPRESSED_SUFFIX, 'rb')
+        except FileNotFoundError:
+            pass
+        try:
+            return open(sealed_path, 'rb')
+        except FileNotFoundError:
+            # compressed in the meantime
+            return gzip.open(sealed_path + COMPRESSED_SUFFIX, 'rb')
+
+    def iter_chunks(self, offset, active=None):
+        """
+        Yield the bytes of the stream from `offset` on, decompressing only the
+        segments needed. Pass an open file `active` to read the active segment
+        from a file object opened earlier (e.g. while holding the lock).
+        """
+        for segment in self.segments:
+            if offset >= segment['offset'] + segment['size']:
+                continue
+            with self.open_segment(segment['number']) as segment_file:
+                # seeking a gzip file decompresses up to `offset`
+                segment_file.seek(offset - segment['offset'])
+                for chunk in iter(lambda: segment_file.read(READ_CHUNK_SIZE), b''):
+                    offset += len(chunk)
+                    yield chunk
+        base_offset = self.base_offset
+        if offset < base_offset:
+            return
+        try:
+            active_file = active or open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            active_file.seek(offset - base_offset)
+            for chunk in iter(lambda: active_file.read(READ_CHUNK_SIZE), b''):
+                yield chunk
+        finally:
+            if active is None:
+                active_file.close()
+
+
+def compress_segment(sealed_path):
+    """
+    Gzip the sealed segment at `sealed_path` and remove the plain version.
+    """
+    compressed_path = sealed_path + COMPRESSED_SUFFIX
+    tmp_path = compressed_path + '.tmp'
+    with open(sealed_path, 'rb') as fin, gzip.open(tmp_path, 'wb') as fout:
+        shutil.copyfileobj(fin, fout)
+    os.rename(tmp_path, compressed_path)
+    os.remove(sealed_path)
+
+
+def iter_lines(chunks):
+    """
+    Yield the lines (bytes) contained in the iterable of byte `chunks`.
+    """
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+class LineIndex(object):
+    """
+    Sparse index of line start offsets for the log stream at `path`.
+    """
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.interval = interval or settings.LOG_INDEX_INTERVAL
+        self.segments = LogSegments(path)
+        self.offsets = array('Q')   # offsets[i] = stream offset of line i*interval
+        self.size = 0               # number of bytes of the stream indexed so far
+        self.line_count = 0         # number of lines (incl. a trailing partial line)
+        self.at_line_start = True   # False if the last indexed line has no newline yet
+        self._index_file = None
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold the exclusive lock of the stream (taken on its index file).
+        """
+        if self._index_file is None:
+            self._index_file = open(self.index_path, 'ab')
+        fcntl.flock(self._index_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield self
+        finally:
+            fcntl.flock(self._index_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def refresh(self, active=None):
+        """
+        Reload the index and segments, and index the lines added to the stream
+        since the last saved offset. Callers must hold the lock.
+        """
+        # Other writers may have extended the index file since it was loaded,
+        # so resume from what is on disk rather than from our own position.
+        self._load()
+        self.segments.load()
+        new_offsets = []
+        for chunk in self.segments.iter_chunks(self.size, active=active):
+            new_offsets.extend(self._scan(chunk))
+        self._save(new_offsets)
+
+    def append(self, data):
+        """
+        Index `data` (bytes) that was just appended to the active segment.
+        """
+        self._save(self._scan(data))
+
+    def offset_for_line(self, line_number):
+        """
+        Return `(offset, skip)`: the offset of the closest indexed line before
+        `line_number` and the number of lines to skip from there.
+        """
+        block = line_number // self.interval
+        return self.offsets[block], line_number - block * self.interval
+
+    def _load(self):
+        offsets = array('Q')
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+            # ignore a partially written trailing entry
+            offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+        except FileNotFoundError:
+            pass
+        self.offsets = offsets
+        # resume scanning from the last indexed line
+        self.size = offsets[-1] if offsets else 0
+        self.line_count = (len(offsets) - 1) * self.interval if offsets else 0
+        self.at_line_start = True
+
+    def _scan(self, data):
+        new_offsets = []
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self.at_line_start:
+                block, remainder = divmod(self.line_count, self.interval)
+                if remainder == 0 and block == len(self.offsets):
+                    new_offsets.append(self.size + pos)
+                    self.offsets.append(self.size + pos)
+                self.line_count += 1
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                self.at_line_start = False
+                pos = end
+            else:
+                self.at_line_start = True
+                pos = newline + 1
+        self.size += end
+        return new_offsets
+
+    def _save(self, new_offsets):
+        if new_offsets:
+            self._index_file.write(array('Q', new_offsets).tobytes())
+            self._index_file.flush()
+
+
+class LogReader(object):
+    """
+    Read lines or byte ranges from a log stream using its `LineIndex`.
+    """
+    def __init__(self, path, interval=None):
+        self.path = path
+        self.index = LineIndex(path, interval=interval)
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Bring the index up to date and open the active segment while holding
+        the lock, so that reads are consistent even if the active segment is
+        sealed while reading.
+        """
+        if not os.path.exists(self.path) and not os.path.exists(self.index.segments.manifest_path):
+            yield None
+            return
+        try:
+            with self.index.lock():
+                try:
+                    active = open(self.path, 'rb')
+                except FileNotFoundError:
+                    active = None
+                self.index.refresh(active=active)
+        except FileNotFoundError:   # the log directory does not exist
+            yield None
+            return
+        finally:
+            self.index.close()
+        try:
+            yield active
+        finally:
+            if active:
+                active.close()
+
+    def line_count(self):
+        with self.snapshot():
+            return self.index.line_count
+
+    def iter_lines(self, start=0):
+        """
+        Yield all lines (str) from line number `start` on.
+        """
+        with self.snapshot() as active:
+            if start >= self.index.line_count:
+                return
+            offset, skip = self.index.offset_for_line(start)
+            for line in iter_lines(self.index.segments.iter_chunks(offset, active=active)):
+                if skip:
+                    skip -= 1
+                    continue
+                yield line.decode('utf-8', errors='replace')
+
+    def read_lines(self, start, count):
+        """
+        Return up to `count` lines starting at line number `start`.
+        """
+        lines = []
+        if count <= 0:
+            return lines
+        for line in self.iter_lines(start):
+            lines.append(line)
+            if len(lines) >= count:
+                break
+        return lines
+
+    def tail(self, count):
+        """
+        Return `(start, lines)` for the last `count` lines of the log.
+        """
+        start = max(0, self.line_count() - count)
+        return start, self.read_lines(start, count)
+
+    def read_bytes(self, offset, limit):
+        """
+        Return `(lines, next_offset)` for the complete lines found in the `limit`
+        bytes starting at `offset`. Pass `next_offset` back to continue reading.
+        """
+        data = b''
+        with self.snapshot() as active:
+            for chunk in self.index.segments.iter_chunks(offset, active=active):
+                data += chunk
+                if len(data) >= limit:
+                    break
+        data = data[:limit]
+        end = data.rfind(b'\n') + 1
+        if end == 0 and len(data) == limit:
+            end = len(data)  # a single line longer than `limit`
+        lines = data[:end].decode('utf-8', errors='replace').splitlines(True)
+        return lines, offset + end
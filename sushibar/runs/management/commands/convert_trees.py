@@ -0,0 +1,30 @@
+import os
+import zlib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sushibar.runs.treestore import JSON_SUFFIX, convert_json_tree
+
+
+class Command(BaseCommand):
+    help = 'Convert the channel trees stored as JSON under TREES_DIR to the indexed tree format.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-json', action='store_true',
+                            help='Keep the JSON trees after converting them')
+
+    def handle(self, *args, **options):
+        converted = 0
+        for dirpath, dirnames, filenames in os.walk(settings.TREES_DIR):
+            for filename in sorted(filenames):
+                if not filename.endswith(JSON_SUFFIX):
+                    continue
+                json_path = os.path.join(dirpath, filename)
+                try:
+                    convert_json_tree(json_path, keep_json=options['keep_json'])
+                except (OSError, ValueError, zlib.error) as e:
+                    self.stderr.write('Skipping tree %s: %s' % (json_path, e))
+                    continue
+                converted += 1
+        self.stdout.write('Converted %d trees' % converted)
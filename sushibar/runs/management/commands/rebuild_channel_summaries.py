@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from sushibar.runs.models import ContentChannel, rebuild_channel_summary
+
+
+class Command(BaseCommand):
+    help = 'Recompute the channel summaries shown on the dashboard from the runs and stages tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('channel_ids', nargs='*', help='Only rebuild the summaries of these channels')
+
+    def handle(self, *args, **options):
+        channels = ContentChannel.objects.all()
+        if options['channel_ids']:
+            channels = channels.filter(channel_id__in=options['channel_ids'])
+        for channel in channels.iterator():
+            rebuild_channel_summary(channel)
+            self.stdout.write('Rebuilt summary for channel %s' % channel.channel_id.hex)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from sushibar.runs.logstats import REDIS, logstats_key, rebuild_log_stats
+from sushibar.runs.models import ContentChannelRun
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-level log counts in redis from the run logfiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', help='Only rebuild stats for these runs')
+        parser.add_argument('--force', action='store_true',
+                            help='Also rebuild stats for runs that already have them')
+
+    def handle(self, *args, **options):
+        runs = ContentChannelRun.objects.all()
+        if options['run_ids']:
+            runs = runs.filter(run_id__in=options['run_ids'])
+        for run in runs.iterator():
+            if not options['force'] and REDIS.exists(logstats_key(run.run_id.hex)):
+                continue
+            try:
+                rebuild_log_stats(run)
+            except (OSError, ValueError) as e:
+                self.stderr.write('Skipping run %s: %s' % (run.run_id.hex, e))
+                continue
+            self.stdout.write('Rebuilt log stats for run %s' % run.run_id.hex)
@@ -0,0 +1,42 @@
+# Generated by Django 2.0.2 on 2026-10-18 10:12
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Max, Sum
+import django.db.models.deletion
+
+
+def build_channel_summaries(apps, schema_editor):
+    ContentChannel = apps.get_model('runs', 'ContentChannel')
+    ChannelSummary = apps.get_model('runs', 'ChannelSummary')
+    for channel in ContentChannel.objects.all().iterator():
+        last_run = channel.runs.order_by('-created_at').first()
+        summary = ChannelSummary(channel=channel, last_run=last_run)
+        if last_run:
+            summary.state = last_run.state
+            summary.last_run_date = channel.runs.aggregate(Max('modified_at'))['modified_at__max']
+            summary.last_event = last_run.events.order_by('-finished').first()
+            summary.total_duration = last_run.events.aggregate(total=Sum('duration'))['total'] or datetime.timedelta()
+        summary.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('runs', '0010_contentchannel_due_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelSummary',
+            fields=[
+                ('channel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='runs.ContentChannel')),
+                ('total_duration', models.DurationField(default=datetime.timedelta)),
+                ('state', models.CharField(blank=True, max_length=100, null=True)),
+                ('last_run_date', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('last_event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='runs.ChannelRunStage')),
+                ('last_run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='runs.ContentChannelRun')),
+            ],
+        ),
+        migrations.RunPython(build_channel_summaries, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,22 @@
 
+from datetime import timedelta
 from io import StringIO
 import os
 import uuid
 
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max, Sum
 from django.db.models.signals import post_save
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from sushibar.users.models import BarUser
 
-__all__ = ["ContentChannel", "ContentChannelRun", "ChannelRunStage"]
+from .logstore import LogReader
+
+__all__ = ["ContentChannel", "ContentChannelRun", "ChannelRunStage", "ChannelSummary", "TrelloRequestFailure"]
 
 class ContentChannel(models.Model):
     """
@@ -80,10 +85,60 @@ def create_empty_logfile(sender, **kwargs):
         dummy_file = StringIO()
         run_instance.logfile.save('dummy_filename.log', dummy_file)
 
+def update_channel_summary_for_run(sender, **kwargs):
+    """Make a newly created run the last run of its channel's summary."""
+    run = kwargs["instance"]
+    with transaction.atomic():
+        summary, _ = ChannelSummary.objects.select_for_update().get_or_create(channel_id=run.channel_id)
+        if kwargs["created"] or summary.last_run_id is None:
+            summary.last_run = run
+            summary.last_event = None
+            summary.total_duration = timedelta()
+        if summary.last_run_id == run.run_id:
+            summary.state = run.state
+        if summary.last_run_date is None or summary.last_run_date < run.modified_at:
+            summary.last_run_date = run.modified_at
+        summary.save()
+
+def record_run_stages(run_id, stages, created=True):
+    """
+    Make the last of `stages` the state of the run `run_id` and record them in
+    the summary of its channel. Called when a stage is saved, and directly for
+    stages created with `bulk_create` (which doesn't send post_save).
+    The run is changed with an UPDATE of its state and modified_at only.
+    """
+    run_id = uuid.UUID(str(run_id))
+    state = stages[-1].name
+    modified_at = timezone.now()
+    with transaction.atomic():
+        ContentChannelRun.objects.filter(run_id=run_id).update(state=state, modified_at=modified_at)
+        for stage in stages:
+            if ChannelRunStage.run.is_cached(stage):
+                stage.run.state, stage.run.modified_at = state, modified_at
+
+        summary = ChannelSummary.objects.select_for_update(of=('self',)).select_related('last_event')\
+                    .filter(channel__runs=run_id).first()
+        if summary is None:
+            rebuild_channel_summary(ContentChannel.objects.get(runs=run_id))
+            return
+        if summary.last_run_date is None or summary.last_run_date < modified_at:
+            summary.last_run_date = modified_at
+        if summary.last_run_id == run_id:   # stages of older runs only change the date
+            summary.state = state
+            if created:
+                summary.total_duration += sum((stage.duration or timedelta() for stage in stages), timedelta())
+            else:
+                summary.total_duration = ChannelRunStage.objects.filter(run_id=run_id)\
+                                            .aggregate(total=Sum('duration'))['total'] or timedelta()
+            for stage in stages:
+                last_event = summary.last_event
+                if last_event is None or (stage.finished and (last_event.finished is None or last_event.finished <= stage.finished)):
+                    summary.last_event = stage
+        summary.save()
+
 def update_run_state(sender, **kwargs):
-    runstage_instance = kwargs["instance"]
-    runstage_instance.run.state = runstage_instance.name
-    runstage_instance.run.save()
+    stage = kwargs["instance"]
+    record_run_stages(stage.run_id, [stage], created=kwargs["created"])
 
 class ContentChannelRun(models.Model):
     """
@@ -118,15 +173,9 @@ class ContentChannelRun(models.Model):
     def get_logs(self):
         context = {}
         logfile_path = self.logfile.path
-        self.logfile.open(mode='r')
-        context['logs'] = self.logfile.readlines()
+        context['logs'] = list(LogReader(logfile_path).iter_lines())
         for level in 'critical', 'error':
-            try:
-                with open("%s.%s" % (logfile_path, level)) as f:
-                    context[level] = f.readlines()
-            except OSError:
-                context[level] = []
-                continue
+            context[level] = list(LogReader("%s.%s" % (logfile_path, level)).iter_lines())
         return context
 
     def get_tree_data_path(self):
@@ -135,7 +184,7 @@ class ContentChannelRun(models.Model):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        write_to_path = os.path.join(directory, "{}.json".format(self.run_id.hex))
+        write_to_path = os.path.join(directory, "{}.tree".format(self.run_id.hex))
         return write_to_path
 
 
@@ -143,6 +192,7 @@ class ContentChannelRun(models.Model):
         get_latest_by = "created_at"
 
 post_save.connect(create_empty_logfile, sender=ContentChannelRun, dispatch_uid="logfilefix")
+post_save.connect(update_channel_summary_for_run, sender=ContentChannelRun, dispatch_uid="updatechannelsummaryforrun")
 
 
 
@@ -164,3 +214,51 @@ class ChannelRunStage(models.Model):
         return '<RunStage for run ' + self.run.run_id.hex[:8] + '...>'
 
 post_save.connect(update_run_state, sender=ChannelRunStage, dispatch_uid="updatechannelrunstate")
+
+
+
+class ChannelSummary(models.Model):
+    """
+    The last run of a channel with its latest stage and total duration, kept up
+    to date by post_save hooks so that the dashboard doesn't have to compute
+    them from the runs and stages tables. Rebuild with `rebuild_channel_summary`.
+    """
+    channel = models.OneToOneField(ContentChannel, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    last_run = models.ForeignKey(ContentChannelRun, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    last_event = models.ForeignKey(ChannelRunStage, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    total_duration = models.DurationField(default=timedelta)
+    state = models.CharField(max_length=100, blank=True, null=True)
+    last_run_date = models.DateTimeField(blank=True, null=True, db_index=True)  # last time any run was modified
+
+    def __str__(self):
+        return '<Summary for channel ' + self.channel.channel_id.hex[:8] + '...>'
+
+
+def rebuild_channel_summary(channel):
+    """Recompute the summary of `channel` from its runs and stages."""
+    with transaction.atomic():
+        last_run = channel.get_last_run()
+        summary = ChannelSummary(channel=channel, last_run=last_run)
+        if last_run:
+            summary.state = last_run.state
+            summary.last_run_date = channel.runs.aggregate(Max('modified_at'))['modified_at__max']
+            summary.last_event = last_run.events.order_by('-finished').first()
+            summary.total_duration = last_run.events.aggregate(total=Sum('duration'))['total'] or timedelta()
+        summary.save()
+        return summary
+
+
+class TrelloRequestFailure(models.Model):
+    """
+    A write to Trello that the outbox gave up on (see `sushibar.services.trello.outbox`).
+    """
+    method = models.CharField(max_length=10)
+    endpoint = models.CharField(max_length=400)
+    data = JSONField(blank=True, null=True)
+    status_code = models.IntegerField(blank=True, null=True)   # null if no response was received
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '<Trello %s %s failed>' % (self.method, self.endpoint)
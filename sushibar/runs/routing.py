@@ -1,10 +1,14 @@
 from channels.routing import route
 from sushibar.runs import ws_logs
+from sushibar.runs import ws_logs_view
 from sushibar.runs import ws_control
 
 channel_routing = [
     route("websocket.connect", ws_logs.connect, path=r"^/logs/"),
     route("websocket.receive", ws_logs.receive, path=r"^/logs/"),
+    route("websocket.disconnect", ws_logs.disconnect, path=r"^/logs/"),
+    route("websocket.connect", ws_logs_view.connect, path=r"^/logs-view/"),
+    route("websocket.disconnect", ws_logs_view.disconnect, path=r"^/logs-view/"),
     route("websocket.connect", ws_control.connect, path=r"^/control/"),
     route("websocket.receive", ws_control.receive, path=r"^/control/"),
     route("websocket.disconnect", ws_control.disconnect, path=r"^/control/"),
@@ -1,5 +1,6 @@
 
 
+from django.conf import settings
 from rest_framework import serializers
 
 from .models import ContentChannel, ContentChannelRun, ChannelRunStage
@@ -58,11 +59,25 @@ class ChannelRunStageCreateSerializer(serializers.Serializer):
     stage = serializers.CharField(max_length=100)
     duration = serializers.FloatField()
 
+class ChannelRunStageBulkCreateSerializer(serializers.Serializer):
+    """
+    Receiver for several stages of a run at once, in the order they happened:
+    {
+       'stages': [{'run_id': 'string', 'stage': 'STAGENAME', 'duration': duration}, ...]
+    }
+    """
+    stages = ChannelRunStageCreateSerializer(many=True, allow_empty=False)
+
+    def validate_stages(self, stages):
+        if len(stages) > settings.RUN_STAGES_BULK_MAX:
+            raise serializers.ValidationError('At most %d stages can be sent at once' % settings.RUN_STAGES_BULK_MAX)
+        return stages
+
 class ChannelRunStageSerializer(serializers.ModelSerializer):
     """
     Serializer used to return response.
     """
-    run_id = serializers.UUIDField(source='run.run_id', format='hex', read_only=True)
+    run_id = serializers.UUIDField(format='hex', read_only=True)
     duration = serializers.FloatField(source='get_duration_in_seconds')
 
     class Meta:
@@ -86,6 +101,22 @@ class ChannelRunProgressSerializer(serializers.Serializer):
     progress = serializers.FloatField()
 
 
+class ChannelRunLogsQuerySerializer(serializers.Serializer):
+    """
+    Query parameters for reading a window of the run logs. Use either:
+      - `start` and `count` to get lines by line number,
+      - `tail` to get the last `tail` lines, or
+      - `offset` and `limit` to get the complete lines in a range of bytes.
+    The `level` selects the stream of logs to read from.
+    """
+    level = serializers.ChoiceField(choices=['all', 'error', 'critical'], default='all')
+    start = serializers.IntegerField(min_value=0, required=False)
+    count = serializers.IntegerField(min_value=0, required=False)
+    tail = serializers.IntegerField(min_value=0, required=False)
+    offset = serializers.IntegerField(min_value=0, required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+
 class ContentChannelSaveToProfileSerializer(serializers.Serializer):
     """
     A true/false single-field serializer for saving channel to profile.
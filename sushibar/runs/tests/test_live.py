@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.live import get_live_status
+
+
+class LiveStatusTest(SimpleTestCase):
+
+    def setUp(self):
+        self.layer = mock.Mock(group_expiry=60)
+        self.layer.consistent_hash.side_effect = lambda name: 0 if name.endswith('a') else 1
+        self.layer._group_key.side_effect = lambda name: name.encode('utf-8')
+        self.host_pipes = {0: mock.Mock(), 1: mock.Mock()}
+        self.layer.connection.side_effect = lambda index: mock.Mock(pipeline=lambda transaction: self.host_pipes[index])
+        patcher = mock.patch('sushibar.runs.live.channel_layers', {'default': mock.Mock(channel_layer=self.layer)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_pipeline_per_redis_server(self):
+        client = mock.Mock()
+        pipe = client.pipeline.return_value
+        pipe.execute.return_value = [
+            {'progress': '0.5'}, {'ERROR': '2', 'lines': '10'}, ['err 1', 'err 2'], [],
+            {}, {}, [], [],
+        ]
+        self.host_pipes[0].execute.return_value = [1, 0]
+        self.host_pipes[1].execute.return_value = [0]
+        progress, log_stats, listening = get_live_status(['run1', 'run2'], ['chan-a', 'chan-b', 'other-a'], client=client)
+
+        self.assertEqual(pipe.execute.call_count, 1)
+        self.assertEqual(progress, {'run1': {'progress': '0.5'}, 'run2': {}})
+        self.assertEqual(log_stats['run1']['counts']['ERROR'], 2)
+        self.assertEqual(log_stats['run1']['counts']['lines'], 10)
+        self.assertEqual(log_stats['run1']['error'], ['err 1', 'err 2'])
+        self.assertEqual(log_stats['run2']['counts']['CRITICAL'], 0)
+        self.assertEqual(listening, {'chan-a': True, 'other-a': False, 'chan-b': False})
+        self.assertEqual([c[0][0] for c in self.host_pipes[0].zcount.call_args_list],
+                         [b'control-chan-a', b'control-other-a'])
+        self.assertEqual(self.host_pipes[0].execute.call_count, 1)
+
+    def test_no_runs(self):
+        client = mock.Mock()
+        self.assertEqual(get_live_status([], [], client=client), ({}, {}, {}))
+        self.assertFalse(client.pipeline.return_value.execute.called)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.logsink import LogSink
+
+
+class LogSinkTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, name):
+        with open(os.path.join(self.tmpdir, name)) as f:
+            return f.read()
+
+    def test_lines_buffered_until_flush(self):
+        sink = LogSink(flush_bytes=1024, flush_interval=60)
+        path = os.path.join(self.tmpdir, 'run.log')
+        sink.write(path, ['line 1\n', 'line 2\n'])
+        self.assertFalse(os.path.exists(path))
+        sink.flush()
+        self.assertEqual(self._read('run.log'), 'line 1\nline 2\n')
+        sink.close_all()
+
+    def test_flush_on_size(self):
+        sink = LogSink(flush_bytes=10, flush_interval=60)
+        path = os.path.join(self.tmpdir, 'run.log')
+        sink.write(path, ['0123456789\n'])
+        self.assertEqual(self._read('run.log'), '0123456789\n')
+        sink.close_all()
+
+    def test_flush_on_interval(self):
+        sink = LogSink(flush_bytes=1024, flush_interval=0.01)
+        path = os.path.join(self.tmpdir, 'run.log')
+        sink.write(path, ['first\n'])
+        time.sleep(0.02)
+        sink.flush_stale()
+        self.assertEqual(self._read('run.log'), 'first\n')
+        sink.close_all()
+
+    def test_background_flush(self):
+        sink = LogSink(flush_bytes=1024, flush_interval=0.01, background_flush=True)
+        path = os.path.join(self.tmpdir, 'run.log')
+        sink.write(path, ['last line\n'])
+        time.sleep(0.1)   # no more writes
+        self.assertEqual(self._read('run.log'), 'last line\n')
+        sink.close_all()
+
+    def test_handle_pool_is_bounded(self):
+        sink = LogSink(max_open_files=2, flush_bytes=1, flush_interval=60)
+        for name in ['a.log', 'b.log', 'c.log', 'a.log']:
+            sink.write(os.path.join(self.tmpdir, name), [name + '\n'])
+            self.assertLessEqual(len(sink._handles), 2)
+        self.assertEqual(self._read('a.log'), 'a.log\na.log\n')
+        self.assertEqual(self._read('c.log'), 'c.log\n')
+        sink.close_all()
+        self.assertEqual(len(sink._handles), 0)
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+import uuid
+
+from django.test import SimpleTestCase, override_settings
+
+from sushibar.runs.logsink import LogSink
+from sushibar.runs.logstats import delete_log_stats, get_log_stats, rebuild_log_stats, record_log_lines
+
+
+class FakeRedis(object):
+    """
+    The subset of redis used for log stats.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hincrby(self, key, field, amount=1):
+        counts = self.data.setdefault(key, {})
+        counts[field] = str(int(counts.get(field, 0)) + amount)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.lrange(key, start, end)
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class FakePipeline(object):
+    """Queues the calls to a `FakeRedis` until `execute`."""
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+@override_settings(LOG_TAIL_LENGTH=3)
+class LogStatsTest(SimpleTestCase):
+    run_id = '6a2b0c9f6f0a4c3c8a6b5e8f3f4a1b2c'
+
+    def setUp(self):
+        self.redis = FakeRedis()
+
+    def test_counts_by_level(self):
+        record_log_lines(self.run_id, {'INFO': ['INFO - a\n', 'INFO - b\n'], 'ERROR': ['ERROR - c\n']}, client=self.redis)
+        record_log_lines(self.run_id, {'INFO': ['INFO - d\n'], 'WARNING': []}, client=self.redis)
+        stats = get_log_stats(self.run_id, client=self.redis)
+        self.assertEqual(stats['counts'], {'DEBUG': 0, 'INFO': 3, 'WARNING': 0, 'ERROR': 1, 'CRITICAL': 0, 'lines': 4})
+        self.assertEqual(stats['error'], ['ERROR - c'])
+        self.assertEqual(stats['critical'], [])
+
+    def test_tail_is_trimmed(self):
+        record_log_lines(self.run_id, {'ERROR': ['ERROR - %d\n' % i for i in range(5)]}, client=self.redis)
+        record_log_lines(self.run_id, {'ERROR': ['ERROR - 5\n']}, client=self.redis)
+        stats = get_log_stats(self.run_id, client=self.redis)
+        self.assertEqual(stats['counts']['ERROR'], 6)
+        self.assertEqual(stats['error'], ['ERROR - 3', 'ERROR - 4', 'ERROR - 5'])
+
+    def test_rebuild_from_logfile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'run.log')
+        sink = LogSink(flush_bytes=1)
+        sink.write(path, ['INFO - started\n', 'ERROR - failed\n', 'a traceback line\n', 'CRITICAL - stopped\n'])
+        sink.close_all()
+        record_log_lines(self.run_id, {'DEBUG': ['DEBUG - stale\n']}, client=self.redis)
+        run = mock.Mock(run_id=uuid.UUID(self.run_id), logfile=mock.Mock(path=path))
+
+        rebuild_log_stats(run, client=self.redis)
+        stats = get_log_stats(self.run_id, client=self.redis)
+        self.assertEqual(stats['counts'], {'DEBUG': 0, 'INFO': 1, 'WARNING': 0, 'ERROR': 1, 'CRITICAL': 1, 'lines': 4})
+        self.assertEqual(stats['error'], ['ERROR - failed'])
+        self.assertEqual(stats['critical'], ['CRITICAL - stopped'])
+
+    def test_delete(self):
+        record_log_lines(self.run_id, {'ERROR': ['ERROR - a\n']}, client=self.redis)
+        delete_log_stats(self.run_id, client=self.redis)
+        self.assertEqual(self.redis.data, {})
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.logsink import LogSink
+from sushibar.runs.logstore import LineIndex, LogReader, compress_segment
+
+
+class LogStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'run.log')
+        self.lines = ['line %d\n' % i for i in range(25)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_with_sink(self, lines, interval=4, **kwargs):
+        sink = LogSink(flush_bytes=1, index_interval=interval, **kwargs)
+        for line in lines:
+            sink.write(self.path, [line])
+        sink.close_all()
+
+    def test_sink_builds_index(self):
+        self._write_with_sink(self.lines)
+        index = LineIndex(self.path, interval=4)
+        index._load()
+        self.assertEqual(len(index.offsets), 7)   # lines 0, 4, 8, ..., 24
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for i, offset in enumerate(index.offsets):
+            self.assertTrue(data[offset:].startswith(self.lines[i * 4].encode('utf-8')))
+
+    def test_read_lines_window(self):
+        self._write_with_sink(self.lines)
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.line_count(), 25)
+        self.assertEqual(reader.read_lines(5, 3), self.lines[5:8])
+        self.assertEqual(reader.read_lines(24, 10), self.lines[24:])
+        self.assertEqual(reader.read_lines(30, 10), [])
+        self.assertEqual(reader.tail(2), (23, self.lines[23:]))
+
+    def test_reader_indexes_unindexed_logfile(self):
+        with open(self.path, 'w') as f:
+            f.writelines(self.lines)
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.read_lines(10, 2), self.lines[10:12])
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+        # appending with the sink continues the existing index
+        self._write_with_sink(['extra\n'] * 8)
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.line_count(), 33)
+        self.assertEqual(reader.read_lines(24, 2), [self.lines[24], 'extra\n'])
+
+    def test_read_bytes(self):
+        self._write_with_sink(self.lines)
+        reader = LogReader(self.path, interval=4)
+        lines, next_offset = reader.read_bytes(0, 20)
+        self.assertEqual(lines, self.lines[:2])
+        lines, next_offset = reader.read_bytes(next_offset, 1000)
+        self.assertEqual(lines, self.lines[2:])
+        self.assertEqual(reader.read_bytes(next_offset, 1000), ([], next_offset))
+
+    def test_sealed_segments(self):
+        sealed = []
+        self._write_with_sink(self.lines, segment_max_bytes=40, on_seal=sealed.append)
+        self.assertEqual(sealed, [self.path + '.%d' % n for n in range(1, len(sealed) + 1)])
+        self.assertGreater(len(sealed), 3)
+        for sealed_path in sealed[:-1]:
+            compress_segment(sealed_path)
+            self.assertFalse(os.path.exists(sealed_path))
+            self.assertTrue(os.path.exists(sealed_path + '.gz'))
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.line_count(), 25)
+        self.assertEqual(reader.read_lines(0, 25), self.lines)
+        self.assertEqual(reader.read_lines(13, 5), self.lines[13:18])
+        self.assertEqual(reader.tail(3), (22, self.lines[22:]))
+        self.assertEqual(reader.read_bytes(35, 35), (self.lines[5:10], 70))
+        self.assertEqual(''.join(reader.iter_lines(20)), ''.join(self.lines[20:]))
+
+    def test_two_sinks_share_index(self):
+        # two workers appending to the same log in turns
+        sinks = [LogSink(flush_bytes=1, index_interval=4), LogSink(flush_bytes=1, index_interval=4)]
+        for i, line in enumerate(self.lines):
+            sinks[i % 2].write(self.path, [line])
+        for sink in sinks:
+            sink.close_all()
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.line_count(), 25)
+        self.assertEqual(reader.read_lines(20, 2), self.lines[20:22])
+        self.assertEqual(reader.read_lines(5, 100), self.lines[5:])
+
+    def test_sink_continues_after_external_seal(self):
+        sink = LogSink(flush_bytes=1, index_interval=4, segment_max_bytes=1000)
+        sink.write(self.path, self.lines[:10])
+        # another worker writes and seals the active segment
+        other = LogSink(flush_bytes=1, index_interval=4, segment_max_bytes=100)
+        other.write(self.path, self.lines[10:20])
+        other.close_all()
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        sink.write(self.path, self.lines[20:])
+        sink.close_all()
+        reader = LogReader(self.path, interval=4)
+        self.assertEqual(reader.read_lines(0, 100), self.lines)
+        self.assertEqual(reader.line_count(), 25)
+        for start in (5, 9, 13, 21):
+            self.assertEqual(reader.read_lines(start, 3), self.lines[start:start + 3])
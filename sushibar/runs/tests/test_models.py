@@ -1,10 +1,12 @@
 
+from datetime import timedelta
 import os
 import uuid
 
 from django.test import TestCase
+from django.utils import timezone
 
-from sushibar.runs.models import ContentChannel, ContentChannelRun, ChannelRunStage
+from sushibar.runs.models import ContentChannel, ContentChannelRun, ChannelRunStage, ChannelSummary, rebuild_channel_summary
 
 
 class BasicModelsCreation(TestCase):
@@ -64,6 +66,29 @@ class BasicModelsCreation(TestCase):
             log_contents = log_file.read()
         self._cleanup_logfile_and_logdir(run.run_id)
 
+    def test_channel_summary_follows_runs_and_stages(self):
+        ch = ContentChannel.objects.create(channel_id=uuid.uuid4())
+        old_run = ContentChannelRun.objects.create(channel=ch)
+        run = ContentChannelRun.objects.create(channel=ch)
+        now = timezone.now()
+        ChannelRunStage.objects.create(run=run, name='Status.STARTED', finished=now, duration=timedelta(seconds=10))
+        last_stage = ChannelRunStage.objects.create(run=run, name='Status.COMPLETED',
+                                                    finished=now + timedelta(seconds=20), duration=timedelta(seconds=20))
+        # stages of older runs don't change the summary
+        ChannelRunStage.objects.create(run=old_run, name='Status.FAILED', finished=now + timedelta(seconds=30),
+                                       duration=timedelta(seconds=30))
+        summary = ChannelSummary.objects.get(channel=ch)
+        self.assertEqual(summary.last_run, run)
+        self.assertEqual(summary.last_event, last_stage)
+        self.assertEqual(summary.total_duration, timedelta(seconds=30))
+        self.assertEqual(summary.state, 'Status.COMPLETED')
+        self.assertEqual(summary.last_run_date, ContentChannelRun.objects.get(run_id=old_run.run_id).modified_at)
+        rebuilt = rebuild_channel_summary(ch)
+        for field in ['last_run_id', 'last_event_id', 'total_duration', 'state', 'last_run_date']:
+            self.assertEqual(getattr(rebuilt, field), getattr(summary, field))
+        for run_id in [old_run.run_id, run.run_id]:
+            self._cleanup_logfile_and_logdir(run_id)
+
     def _cleanup_logfile_and_logdir(self, test_run_id):
         run = ContentChannelRun.objects.get(run_id=test_run_id)
         logfile_path = run.logfile.path
@@ -9,7 +9,7 @@ https://docs.djangoproject.com/en/1.7/topics/testing/advanced/
 import os
 import uuid
 from datetime import datetime
-from unittest import skipIf
+from unittest import mock, skipIf
 
 from django.urls import reverse
 from rest_framework import status
@@ -147,6 +147,48 @@ class SushiChefFlowTest(APITestCase):
         self.assertEqual(len(list(stages_for_run_in_db)), len(stages_notify_posts), 'Wrong number of stages in DB')
         self._cleanup_logfile_and_logdir()
 
+    def test_create_stages_in_bulk(self):
+        """
+        Test several stages can be reported at once.
+        """
+        self._create_test_content_channel()
+        self._create_test_run()
+        url = reverse('bulk_create_run_stages', kwargs={'run_id': self._random_run_id})
+        stages_post = {"stages": [
+            {"run_id": self._random_run_id, "stage": "Stage.STARTED", "duration": 0},
+            {"run_id": self._random_run_id, "stage": "Stage.PROGRESSED", "duration": 1000},
+            {"run_id": self._random_run_id, "stage": "Stage.FINISHED", "duration": 5000},
+        ]}
+        response = self.client.post(url, stages_post, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, "Can't create stages")
+        self.assertEqual([stage['name'] for stage in response.data], ["Stage.STARTED", "Stage.PROGRESSED", "Stage.FINISHED"])
+        self.assertEqual(response.data[1]['finished'], response.data[2]['started'], "stages out of order")
+
+        run = ContentChannelRun.objects.get(run_id=self._random_run_id)
+        self.assertEqual(run.state, "Stage.FINISHED")
+        self.assertEqual(run.channel.summary.total_duration.total_seconds(), 6000)
+        self.assertEqual(ChannelRunStage.objects.filter(run=run).count(), 3, 'Wrong number of stages in DB')
+
+        stages_post["stages"][0]["run_id"] = uuid.uuid4().hex
+        response = self.client.post(url, stages_post, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, "run_id mismatch not detected")
+        self._cleanup_logfile_and_logdir()
+
+    def test_completed_stage_queues_pipeline(self):
+        """
+        Test the COMPLETED stage is recorded without waiting on Studio or Trello.
+        """
+        self._create_test_content_channel()
+        self._create_test_run()
+        url = reverse('list_run_stages', kwargs={'run_id': self._random_run_id})
+        stage_post = {"run_id": self._random_run_id, "stage": "COMPLETED", "duration": 100}
+        with mock.patch('sushibar.runs.api.schedule_run_completed') as schedule_run_completed:
+            response = self.client.post(url, stage_post, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, "Can't create stage")
+        schedule_run_completed.assert_called_once()
+        self.assertEqual(schedule_run_completed.call_args[0][0].run_id, uuid.UUID(str(self._random_run_id)))
+        self._cleanup_logfile_and_logdir()
+
 
     @skipIf(True, "Skipping because logs use websocket now...")
     def test_create_run_and_log_messages(self):
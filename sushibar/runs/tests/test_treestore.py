@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.treestore import TreeReader, convert_json_tree, write_tree
+
+
+TREE = [
+    {'title': 'Topic A', 'kind': 'topic', 'node_id': 'a', 'children': [
+        {'title': 'Vidéo', 'kind': 'video', 'file_size': 1024},
+        {'title': 'Topic B', 'kind': 'topic', 'node_id': 'b', 'children': [
+            {'title': 'Doc', 'kind': 'document', 'file_size': 10},
+        ]},
+    ]},
+    {'title': 'Exercise', 'kind': 'exercise'},
+    {'title': 'Empty', 'kind': 'topic', 'node_id': 'c', 'children': []},
+]
+
+
+class TreeStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tree.tree')
+        self.json_path = os.path.join(self.tmpdir, 'tree.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_json(self):
+        with open(self.json_path, 'w') as fout:
+            json.dump(TREE, fout)
+
+    def test_load(self):
+        write_tree(self.path, TREE)
+        with TreeReader(self.path) as reader:
+            self.assertEqual(reader.load(), TREE)
+
+    def test_get_children(self):
+        write_tree(self.path, TREE)
+        reader = TreeReader(self.path)
+        self.assertEqual(reader.get_children('a'), TREE[0]['children'])
+        self.assertEqual(reader.get_children('b'), TREE[0]['children'][1]['children'])
+        self.assertEqual(reader.get_children('c'), [])
+        self.assertIsNone(reader.get_children('missing'))
+        self.assertEqual(reader.get_children('a', recursive=False)[1],
+                         {'title': 'Topic B', 'kind': 'topic', 'node_id': 'b'})
+        self.assertTrue(reader.is_topic('a'))
+        self.assertFalse(reader.is_topic('c'))
+        self.assertFalse(reader.is_topic(None))
+
+    def test_iter_nodes(self):
+        write_tree(self.path, TREE)
+        reader = TreeReader(self.path)
+        self.assertEqual([(parent_id, node['title']) for parent_id, node in reader.iter_nodes()],
+                         [(None, 'Topic A'), ('a', 'Vidéo'), ('a', 'Topic B'), ('b', 'Doc'),
+                          (None, 'Exercise'), (None, 'Empty')])
+        self.assertEqual([node['title'] for _, node in reader.iter_nodes('b')], ['Doc'])
+
+    def test_aggregates(self):
+        write_tree(self.path, TREE)
+        reader = TreeReader(self.path)
+        self.assertEqual(reader.get_aggregates(), {
+            'topic': {'count': 3, 'file_size': 0},
+            'video': {'count': 1, 'file_size': 1024},
+            'document': {'count': 1, 'file_size': 10},
+            'exercise': {'count': 1, 'file_size': 0},
+        })
+        self.assertEqual(reader.get_aggregates('b'), {'document': {'count': 1, 'file_size': 10}})
+        self.assertEqual(reader.get_aggregates('c'), {})
+        self.assertIsNone(reader.get_aggregates('missing'))
+
+    def test_reads_json_trees(self):
+        self._write_json()
+        reader = TreeReader(self.path)
+        self.assertTrue(reader.exists())
+        self.assertEqual(reader.load(), TREE)
+        self.assertEqual(reader.get_aggregates('a')['document']['count'], 1)
+
+    def test_convert_json_tree(self):
+        self._write_json()
+        self.assertEqual(convert_json_tree(self.json_path), self.path)
+        self.assertFalse(os.path.exists(self.json_path))
+        self.assertEqual(TreeReader(self.path).load(), TREE)
+        self.assertLess(os.path.getsize(self.path), len(json.dumps(TREE * 100)))
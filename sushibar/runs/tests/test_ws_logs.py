@@ -0,0 +1,38 @@
+import gzip
+import json
+import zlib
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.ws_logs import decode_records, format_record
+
+
+RECORD = {
+    'levelname': 'INFO',
+    'created': 1520000000.0,
+    'filename': 'chef.py',
+    'funcName': 'run',
+    'lineno': 42,
+    'message': 'Downloading...',
+}
+
+
+class LogFramesTest(SimpleTestCase):
+
+    def test_single_record_frame(self):
+        records = decode_records({'text': json.dumps(RECORD)})
+        self.assertEqual(records, [RECORD])
+
+    def test_batched_frame(self):
+        records = decode_records({'text': json.dumps([RECORD, RECORD])})
+        self.assertEqual(records, [RECORD, RECORD])
+
+    def test_compressed_frames(self):
+        data = json.dumps([RECORD, RECORD]).encode('utf-8')
+        self.assertEqual(decode_records({'bytes': zlib.compress(data)}), [RECORD, RECORD])
+        self.assertEqual(decode_records({'bytes': gzip.compress(data)}), [RECORD, RECORD])
+
+    def test_format_record(self):
+        log = format_record(RECORD)
+        self.assertTrue(log.startswith('INFO - '))
+        self.assertTrue(log.endswith(' - chef.py - run - 42 - Downloading...\n'))
@@ -0,0 +1,37 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from sushibar.runs.ws_logs_view import LogViewPublisher, group_name
+
+
+class LogViewPublisherTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('sushibar.runs.ws_logs_view.Group')
+        self.Group = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _sent_groups(self):
+        return [c[0][0] for c in self.Group.call_args_list]
+
+    def test_lines_coalesced_until_flush(self):
+        publisher = LogViewPublisher(max_lines=100, flush_interval=60)
+        publisher.publish('abc', ['one\n'], {'INFO': ['one\n']})
+        publisher.publish('abc', ['two\n'], {'INFO': ['two\n']})
+        self.assertFalse(self.Group.called)
+        publisher.flush('abc')
+        self.assertEqual(self._sent_groups(), [group_name('abc')])
+        self.Group.return_value.send.assert_called_once_with({'text': '{"lines": ["one\\n", "two\\n"]}'})
+
+    def test_lines_filtered_by_level(self):
+        publisher = LogViewPublisher(max_lines=1, flush_interval=60)
+        publisher.publish('abc', ['err\n', 'crit\n'], {'ERROR': ['err\n'], 'CRITICAL': ['crit\n']})
+        self.assertEqual(self._sent_groups(), ['logs-view-abc', 'logs-view-abc-error', 'logs-view-abc-critical'])
+
+    def test_background_flush(self):
+        publisher = LogViewPublisher(max_lines=100, flush_interval=0.01, background_flush=True)
+        publisher.publish('abc', ['last\n'], {'INFO': ['last\n']})
+        time.sleep(0.1)   # no more lines
+        self.Group.return_value.send.assert_called_once_with({'text': '{"lines": ["last\\n"]}'})
@@ -0,0 +1,230 @@
+"""
+Storage of the channel trees loaded from Kolibri Studio.
+
+A tree is stored under `run.get_tree_data_path()` (`<run_id>.tree`) as:
+  - a magic header line
+  - one zlib-compressed JSON block per topic (and one for the channel root),
+    holding the list of its children without their own `children`
+  - a zlib-compressed JSON index mapping the `node_id` of every topic ('' for
+    the channel root) to the offset and length of its block, its number of
+    children and the count and total `file_size` of its descendants per kind
+  - the offset and length of the index, as 8-byte little-endian integers
+
+so the children of any topic are read by decompressing a single block, whole
+subtrees and streaming iteration only decompress one block per topic, and
+aggregates are available without reading any block.
+
+Trees stored as plain JSON (`<run_id>.json`) by earlier versions remain
+readable by `TreeReader`, which loads them in memory; `convert_json_tree` (and
+the `convert_trees` management command) migrates them to the indexed format.
+"""
+import io
+import json
+import os
+import struct
+import zlib
+
+
+MAGIC = b'SUSHIBAR-TREE 1\n'
+TRAILER = struct.Struct('<QQ')   # offset and length of the index block
+ROOT_KEY = ''
+TREE_SUFFIX = '.tree'
+JSON_SUFFIX = '.json'
+COMPRESSION_LEVEL = 6
+
+
+def get_json_tree_path(path):
+    """The path where the JSON version of the tree at `path` would be stored."""
+    return os.path.splitext(path)[0] + JSON_SUFFIX
+
+def _is_topic(node):
+    return bool(node.get('node_id')) and isinstance(node.get('children'), list)
+
+def _strip_children(node):
+    if not _is_topic(node):
+        return node
+    return {key: value for key, value in node.items() if key != 'children'}
+
+
+class _TreeWriter(object):
+    """
+    Writes a tree in the indexed format, one topic block at a time.
+    """
+    def __init__(self, fout):
+        self.fout = fout
+        self.pos = 0
+        self.index = {}
+
+    def emit(self, data):
+        self.fout.write(data)
+        self.pos += len(data)
+
+    def write_block(self, obj):
+        data = zlib.compress(json.dumps(obj).encode('utf-8'), COMPRESSION_LEVEL)
+        offset = self.pos
+        self.emit(data)
+        return offset, len(data)
+
+    def write_topic(self, key, children):
+        """
+        Write the block of topic `key` and of all topics below it, and return
+        the per-kind aggregates of its descendants.
+        """
+        offset, length = self.write_block([_strip_children(child) for child in children])
+        kinds = {}
+        for child in children:
+            counts = kinds.setdefault(child.get('kind'), {'count': 0, 'file_size': 0})
+            counts['count'] += 1
+            counts['file_size'] += child.get('file_size') or 0
+            if _is_topic(child):
+                for kind, child_counts in self.write_topic(child['node_id'], child['children']).items():
+                    counts = kinds.setdefault(kind, {'count': 0, 'file_size': 0})
+                    counts['count'] += child_counts['count']
+                    counts['file_size'] += child_counts['file_size']
+        self.index[key] = {'offset': offset, 'length': length,
+                           'children': len(children), 'kinds': kinds}
+        return kinds
+
+    def write_tree(self, tree):
+        self.emit(MAGIC)
+        self.write_topic(ROOT_KEY, tree)
+        index_offset, index_length = self.write_block(self.index)
+        self.emit(TRAILER.pack(index_offset, index_length))
+
+
+def write_tree(path, tree):
+    """
+    Store `tree` (the list of children of the channel root) at `path`.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        _TreeWriter(fout).write_tree(tree)
+    os.rename(tmp_path, path)
+
+
+def convert_json_tree(json_path, path=None, keep_json=False):
+    """
+    Store the JSON tree at `json_path` in the indexed format (next to it unless
+    `path` is given) and remove the JSON file unless `keep_json` is set.
+    """
+    path = path or os.path.splitext(json_path)[0] + TREE_SUFFIX
+    with open(json_path) as fin:
+        tree = json.load(fin)
+    write_tree(path, tree)
+    if not keep_json:
+        os.remove(json_path)
+        if os.path.exists(json_path + '.idx'):
+            os.remove(json_path + '.idx')   # byte-range index of the JSON tree
+    return path
+
+
+class TreeReader(object):
+    """
+    Read parts of the tree stored at `path`, or in the JSON file next to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._index = None
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(get_json_tree_path(self.path))
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def load(self):
+        """Return the whole tree."""
+        return self.get_children()
+
+    def get_children(self, node_id=None, recursive=True):
+        """
+        Return the children of `node_id` (of the channel root if None), or None
+        if the tree has no topic `node_id`. Topics among the children have their
+        subtree in `children` if `recursive`, and no `children` otherwise.
+        """
+        children = self._read_children(node_id or ROOT_KEY)
+        if children is not None and recursive:
+            stack = [children]
+            while stack:
+                for child in stack.pop():
+                    if child.get('node_id') in self._get_index():
+                        child['children'] = self._read_children(child['node_id'])
+                        stack.append(child['children'])
+        return children
+
+    def iter_nodes(self, node_id=None):
+        """
+        Yield `(parent_id, node)` for every node below `node_id` (the channel
+        root if None) in depth-first order, without their `children`. Only the
+        blocks of the topics on the current path are kept in memory.
+        """
+        key = node_id or ROOT_KEY
+        children = self._read_children(key)
+        if children is None:
+            return
+        stack = [(key, iter(children))]
+        while stack:
+            parent_id, nodes = stack[-1]
+            node = next(nodes, None)
+            if node is None:
+                stack.pop()
+                continue
+            yield parent_id or None, node
+            if node.get('node_id') in self._get_index():
+                stack.append((node['node_id'], iter(self._read_children(node['node_id']))))
+
+    def is_topic(self, node_id):
+        """True if `node_id` is a topic with at least one child."""
+        entry = self._get_index().get(node_id)
+        return bool(entry and entry['children'])
+
+    def get_aggregates(self, node_id=None):
+        """
+        Return `{kind: {"count": n, "file_size": bytes}}` for all the nodes below
+        `node_id` (the channel root if None), or None if it is not a topic.
+        """
+        entry = self._get_index().get(node_id or ROOT_KEY)
+        return entry['kinds'] if entry else None
+
+    def _open(self):
+        if self._file is None:
+            try:
+                self._file = open(self.path, 'rb')
+            except FileNotFoundError:
+                # tree stored as JSON before the indexed format was introduced
+                with open(get_json_tree_path(self.path)) as fin:
+                    tree = json.load(fin)
+                self._file = io.BytesIO()
+                _TreeWriter(self._file).write_tree(tree)
+            self._file.seek(0)
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError('Not a tree file: %s' % self.path)
+        return self._file
+
+    def _read_block(self, offset, length):
+        fin = self._open()
+        fin.seek(offset)
+        return json.loads(zlib.decompress(fin.read(length)).decode('utf-8'))
+
+    def _get_index(self):
+        if self._index is None:
+            fin = self._open()
+            fin.seek(-TRAILER.size, os.SEEK_END)
+            self._index = self._read_block(*TRAILER.unpack(fin.read(TRAILER.size)))
+        return self._index
+
+    def _read_children(self, key):
+        entry = self._get_index().get(key)
+        if entry is None:
+            return None
+        return self._read_block(entry['offset'], entry['length'])
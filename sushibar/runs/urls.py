@@ -3,8 +3,9 @@ from rest_framework.urlpatterns import format_suffix_patterns
 
 from .api import ContentChannelListCreate, ContentChannelDetail, RunsForContentChannelList
 from .api import ContentChannelRunListCreate, ContentChannelRunDetail
-from .api import ChannelRunStageListCreate
+from .api import ChannelRunStageListCreate, ChannelRunStageBulkCreate
 from .api import ChannelRunProgressEndpoints
+from .api import ChannelRunLogs
 from .api import ContentChannelSaveToProfile
 from .api import ChannelControlEndpoints
 from .api import ContentChannelDelete
@@ -46,9 +47,17 @@ urlpatterns = [
         view=ChannelRunStageListCreate.as_view(),
         name='list_run_stages'),
     #
+    url(regex=r'channelruns/(?P<run_id>[0-9A-Fa-f-]+)/stages/bulk/$',
+        view=ChannelRunStageBulkCreate.as_view(),
+        name='bulk_create_run_stages'),
+    #
     url(regex=r'channelruns/(?P<run_id>[0-9A-Fa-f-]+)/progress/$',
         view=ChannelRunProgressEndpoints.as_view(),
         name='run_progress'),
+    #
+    url(regex=r'channelruns/(?P<run_id>[0-9A-Fa-f-]+)/logs/$',
+        view=ChannelRunLogs.as_view(),
+        name='run_logs'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
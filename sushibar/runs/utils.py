@@ -1,11 +1,25 @@
-import json
 import uuid
-from sushibar.ccserverlib.services import ccserver_get_node_children, get_channel_status_bulk
+import zlib
+
+from django.core.cache import cache
+
+from sushibar.ccserverlib.services import get_channel_status_bulk
+from sushibar.ccserverlib.tree_crawler import StudioTreeCrawler
+
+from .treestore import TreeReader, write_tree
+
+PREVIOUS_RUNS_CHECKED = 5        # look for the previous tree in this many runs
+TREE_LOAD_PENDING_TIMEOUT = 600  # don't queue a load of the same tree again for this long
 
 def set_run_options(run):
+    """
+    Save the Studio status of the channel of `run` in its options.
+    Raises `requests.RequestException` if Studio can't be reached.
+    """
     run.extra_options = run.extra_options or {}
-    statuses_dict = get_channel_status_bulk(run.content_server, run.started_by_user_token, [run.channel.channel_id.hex])
-    status = statuses_dict.get(run.channel.channel_id.hex) if statuses_dict else None
+    statuses_dict = get_channel_status_bulk(run.content_server, run.started_by_user_token,
+                                            [run.channel.channel_id.hex], raise_errors=True)
+    status = statuses_dict.get(run.channel.channel_id.hex)
     run.extra_options.update({
         'staged': status == 'staged',
         'published': status =='published'
@@ -18,20 +32,100 @@ def load_tree_for_channel(run_dict):
     cache it under `run_dict['tree_data_path']`. This can take 30secs+ for large
     channels, so we do it as background task to avoid timouts and the notorious
     sushi-eating cat being show to users!
+    Returns None, and caches nothing so that the load is queued again, if the
+    tree couldn't be loaded.
     """
-    tree = recusive_load_children_for_node(run_dict)
-    with open(run_dict['tree_data_path'], 'w+') as fout:
-        json.dump(tree, fout)
+    crawler = StudioTreeCrawler(run_dict['content_server'], run_dict['started_by_user_token'], run_dict['channel_id'])
+    tree = crawler.crawl(previous_tree=load_previous_tree(run_dict))
+    if tree is None:
+        print('ERROR could not load tree for channel', run_dict['channel_id'])
+        return None
+    print('Loaded tree for channel %s with %d requests, %d saved by reusing the previous tree'
+          % (run_dict['channel_id'], crawler.requests_made, crawler.requests_saved))
+    write_tree(run_dict['tree_data_path'], tree)
     return tree
 
-def recusive_load_children_for_node(run_dict, node_id=None):
-    tree = []
-    children = ccserver_get_node_children(run_dict, node_id=node_id)
-    for child in children:
-        if child.get('node_id'):
-            child.update({"children": recusive_load_children_for_node(run_dict, node_id=child['node_id'])})
-        tree.append(child)
-    return tree
+def get_tree_run_dict(run):
+    """
+    Return the info `load_tree_for_channel` needs to load the tree of `run`.
+    """
+    return dict(
+        run_id=run.run_id.hex,
+        content_server=run.content_server,
+        channel_id=run.channel.channel_id.hex,
+        started_by_user_token=run.started_by_user_token,
+        tree_data_path=run.get_tree_data_path(),
+        previous_tree_data_path=get_previous_tree_data_path(run),
+    )
+
+def tree_load_pending_key(run_id):
+    return 'tree-load:%s' % run_id
+
+def schedule_tree_load(run):
+    """
+    Queue a background load of the tree of `run`, unless one is already pending.
+    """
+    from sushibar.tasks import load_tree_for_channel_task
+    if not cache.add(tree_load_pending_key(run.run_id.hex), True, TREE_LOAD_PENDING_TIMEOUT):
+        return
+    try:
+        load_tree_for_channel_task.delay(get_tree_run_dict(run))
+    except Exception as e:
+        cache.delete(tree_load_pending_key(run.run_id.hex))
+        print('ERROR could not queue load of tree for run', run.run_id.hex, e)
+
+def schedule_run_completed(run):
+    """
+    Queue the work to do once the chef of `run` has finished, so that the chef
+    doesn't wait on Studio and Trello. The tasks are independent (a group, not
+    a chain): one failing, e.g. while Trello is down, doesn't keep the others
+    from running. Each task can be run again safely.
+    """
+    from celery import group
+    from sushibar.tasks import (load_run_tree_task, mark_run_complete_task,
+                                set_run_options_task, trello_add_channel_link_task)
+    tasks = group(
+        load_run_tree_task.si(run.run_id.hex),
+        set_run_options_task.si(run.run_id.hex),                    # Studio status of the channel
+        mark_run_complete_task.si(run.run_id.hex),                  # flag the new run on the dashboard
+        trello_add_channel_link_task.si(run.channel.channel_id.hex),
+    )
+    cache.set(tree_load_pending_key(run.run_id.hex), True, TREE_LOAD_PENDING_TIMEOUT)
+    try:
+        tasks.apply_async()
+    except Exception as e:
+        cache.delete(tree_load_pending_key(run.run_id.hex))
+        print('ERROR could not queue completion tasks for run', run.run_id.hex, e)
+
+def mark_run_complete(run):
+    run.channel.new_run_complete = True
+    run.channel.save(update_fields=['new_run_complete'])
+
+def load_previous_tree(run_dict):
+    """
+    Return the tree cached for the previous run of the channel, if any.
+    """
+    path = run_dict.get('previous_tree_data_path')
+    if not path:
+        return None
+    try:
+        with TreeReader(path) as reader:
+            return reader.load()
+    except (OSError, ValueError, zlib.error) as e:
+        print('Could not load previous tree', path, e)
+        return None
+
+def get_previous_tree_data_path(run):
+    """
+    Return the path of the tree cached for the latest run of the channel before
+    `run` that has one, or None.
+    """
+    previous_runs = run.channel.runs.filter(created_at__lt=run.created_at).order_by('-created_at')
+    for previous_run in previous_runs[:PREVIOUS_RUNS_CHECKED]:
+        path = previous_run.get_tree_data_path()
+        if TreeReader(path).exists():
+            return path
+    return None
 
 def calculate_channel_id(source_id, domain):
     domain_namespace = uuid.uuid5(uuid.NAMESPACE_DNS, domain)
@@ -1,44 +1,112 @@
 """
 This module handles logs received via websockets.
+
+Each websocket frame sent to `/logs/<run_id>/` carries log records in one of
+the following formats:
+  - text frame with a single JSON log record (sent by older ricecooker clients)
+  - text frame with a JSON list of log records
+  - binary frame with a zlib- or gzip-compressed JSON record or list of records
+where a log record is a dict with the attributes of a `logging.LogRecord`.
 """
+from collections import defaultdict
 import json
 import time
+import uuid
+import zlib
 
+from .logsink import sink
+from .logstats import record_log_lines
 from .models import ContentChannelRun
+from .ws_logs_view import publisher
 from channels.sessions import channel_session
 from django.http import Http404
 
 
+LOG_LEVEL_SUFFIXES = {
+    'ERROR': '.error',
+    'CRITICAL': '.critical',
+}
+
+
+def get_logfile_path(message):
+    """
+    Return the logfile path for the run of this websocket connection. The path
+    is cached in the channel session so the DB is only hit on connect.
+    """
+    logfile = message.channel_session.get('logfile')
+    if logfile is None:
+        run_id = message.channel_session['run_id']
+        try:
+            run = ContentChannelRun.objects.get(run_id=run_id)
+        except ContentChannelRun.DoesNotExist:
+            raise Http404
+        logfile = run.logfile.path
+        message.channel_session['logfile'] = logfile
+    return logfile
+
+
 @channel_session
 def connect(message):
     # Expected path format: /logs/<run_id>/
-    _, run_id = message['path'].strip('/').split('/')
-    message.channel_session['run_id'] = run_id
+    try:
+        _, run_id = message['path'].strip('/').split('/')
+        message.channel_session['run_id'] = uuid.UUID(run_id).hex
+        get_logfile_path(message)
+    except (ValueError, Http404):   # malformed path or unknown run
+        message.reply_channel.send({"close": True})
+        return
     message.reply_channel.send({"accept": True})
 
 
-@channel_session
-def receive(message):
+def decode_records(message):
     """
-    Stores logs in three files: all logs, error logs, critical logs.
+    Return the list of log records contained in a websocket frame.
     """
-    run_id = message.channel_session['run_id']
-    try:
-        run = ContentChannelRun.objects.get(run_id=run_id)
-        logfile = run.logfile.path
-    except ContentChannelRun.DoesNotExist:
-        raise Http404
-    record = json.loads(message['text'])
+    if message.get('bytes'):
+        # wbits=32+MAX_WBITS auto-detects zlib and gzip headers
+        data = zlib.decompress(message['bytes'], 32 + zlib.MAX_WBITS).decode('utf-8')
+    else:
+        data = message['text']
+    records = json.loads(data)
+    if isinstance(records, dict):
+        records = [records]
+    return records
+
+
+def format_record(record):
     timestamp = time.localtime(float(record['created']))
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S', timestamp)
-    log = '%s - %s - %s - %s - %d - %s' % (
+    return '%s - %s - %s - %s - %d - %s\n' % (
         record['levelname'], timestamp, record['filename'],
         record['funcName'], record['lineno'], record['message'])
-    with open(logfile, 'a') as f:
-        f.write(log + '\n')
-    if record['levelname'] == 'ERROR':
-        with open(logfile+'.error', 'a') as f:
-            f.write(log + '\n')
-    if record['levelname'] == 'CRITICAL':
-        with open(logfile + '.critical', 'a') as f:
-            f.write(log + '\n')
+
+
+@channel_session
+def receive(message):
+    """
+    Stores logs in three files: all logs, error logs, critical logs, and updates
+    the per-level log counts of the run.
+    """
+    logfile = get_logfile_path(message)
+    lines = []
+    lines_by_level = defaultdict(list)
+    for record in decode_records(message):
+        log = format_record(record)
+        lines.append(log)
+        lines_by_level[record['levelname']].append(log)
+    sink.write(logfile, lines)
+    for level, suffix in LOG_LEVEL_SUFFIXES.items():
+        sink.write(logfile + suffix, lines_by_level.get(level))
+    record_log_lines(message.channel_session['run_id'], lines_by_level)
+    publisher.publish(message.channel_session['run_id'], lines, lines_by_level)
+
+
+@channel_session
+def disconnect(message):
+    # Flush buffered lines and release file handles when the chef goes away
+    logfile = message.channel_session.get('logfile')
+    if logfile:
+        sink.close(logfile)
+        for suffix in LOG_LEVEL_SUFFIXES.values():
+            sink.close(logfile + suffix)
+        publisher.flush(message.channel_session['run_id'])
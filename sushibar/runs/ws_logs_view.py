@@ -0,0 +1,121 @@
+"""
+This module pushes the log lines of a run to browsers watching it via websockets.
+
+Browsers connect to `/logs-view/<run_id>/?level=<level>`, where `level` is one of
+`all` (default), `error` or `critical`, the same log streams served by the run
+logs API. Lines are filtered server-side by sending each stream to its own
+group `logs-view-<run_id>[-<level>]`, and are coalesced so that a group
+receives at most one message every `LOGS_VIEW_FLUSH_INTERVAL` seconds (or every
+`LOGS_VIEW_MAX_LINES` lines) instead of one message per log frame. Buffered
+lines are also pushed by a background thread of the worker holding them, so
+viewers see the last lines of a run without waiting for more logs.
+"""
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+import uuid
+
+from channels import Group
+from channels.sessions import channel_session
+from django.conf import settings
+
+from .logsink import BackgroundFlusher
+
+
+LEVELS = ['all', 'error', 'critical']
+
+
+def group_name(run_id, level='all'):
+    if level == 'all':
+        return 'logs-view-%s' % run_id
+    return 'logs-view-%s-%s' % (run_id, level)
+
+
+class LogViewPublisher(object):
+    """
+    Coalesces the log lines sent to the `logs-view-*` groups.
+    """
+    def __init__(self, max_lines=200, flush_interval=0.5, background_flush=False):
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        self._buffers = {}              # group name --> list of lines
+        self._buffered_since = {}       # group name --> time when first line was buffered
+        self._lock = threading.RLock()
+        self._flusher = BackgroundFlusher(self.flush_stale, flush_interval) if background_flush else None
+
+    def publish(self, run_id, lines, lines_by_level):
+        """
+        Queue `lines` for viewers of all logs of `run_id`, and the lines in the
+        dict `lines_by_level` (keyed by levelname) for viewers of that level.
+        """
+        if self._flusher:
+            self._flusher.ensure_started()
+        with self._lock:
+            self._queue(group_name(run_id), lines)
+            for level in LEVELS[1:]:
+                self._queue(group_name(run_id, level), lines_by_level.get(level.upper()))
+            self.flush_stale()
+
+    def flush_stale(self):
+        with self._lock:
+            now = time.monotonic()
+            stale_groups = [name for name, since in self._buffered_since.items()
+                            if now - since >= self.flush_interval]
+            for name in stale_groups:
+                self._send(name)
+
+    def flush(self, run_id):
+        with self._lock:
+            for level in LEVELS:
+                self._send(group_name(run_id, level))
+
+    def _queue(self, name, lines):
+        if not lines:
+            return
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            buffer = self._buffers[name] = []
+            self._buffered_since[name] = time.monotonic()
+        buffer.extend(lines)
+        if len(buffer) >= self.max_lines:
+            self._send(name)
+
+    def _send(self, name):
+        lines = self._buffers.pop(name, None)
+        self._buffered_since.pop(name, None)
+        if lines:
+            Group(name).send({'text': json.dumps({'lines': lines})})
+
+
+publisher = LogViewPublisher(max_lines=settings.LOGS_VIEW_MAX_LINES,
+                             flush_interval=settings.LOGS_VIEW_FLUSH_INTERVAL,
+                             background_flush=True)
+
+
+@channel_session
+def connect(message):
+    # Expected path format: /logs-view/<run_id>/?level=<level>
+    query_string = message.content.get('query_string') or ''
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('utf-8')
+    level = parse_qs(query_string).get('level', ['all'])[0]
+    try:
+        _, run_id = message['path'].strip('/').split('/')
+        run_id = uuid.UUID(run_id).hex
+    except ValueError:
+        run_id = None
+    if run_id is None or level not in LEVELS:
+        message.reply_channel.send({"close": True})
+        return
+    name = group_name(run_id, level)
+    Group(name).add(message.reply_channel)
+    message.channel_session['group'] = name
+    message.reply_channel.send({"accept": True})
+
+
+@channel_session
+def disconnect(message):
+    name = message.channel_session.get('group')
+    if name:
+        Group(name).discard(message.reply_channel)
@@ -1,7 +1,9 @@
 import gspread
 import httplib2
 import json
+import os
 import requests
+import threading
 
 from apiclient import discovery
 from django.conf import settings
@@ -11,6 +13,7 @@ from rest_framework.views import APIView
 
 GOOGLE_QA_TEMPLATE_ID = settings.GOOGLE_QA_TEMPLATE_ID
 TARGET_FOLDER_ID = settings.TARGET_FOLDER_ID
+DRIVE_DISCOVERY_PATH = os.path.join(os.path.dirname(__file__), 'drive_v3.json')   # the methods of the Drive API we use
 
 def get_credentials():
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -18,11 +21,18 @@ def get_credentials():
 
 class GoogleClient():
     def __init__(self, *args, **kwargs):
-        credentials = get_credentials()
-        self.client = gspread.authorize(credentials)
-        http = credentials.authorize(httplib2.Http())
-        self.service = discovery.build('drive', 'v3', http=http)
+        self.credentials = get_credentials()
+        self.client = gspread.authorize(self.credentials)
+        http = self.credentials.authorize(httplib2.Http())
+        with open(DRIVE_DISCOVERY_PATH) as discovery_file:
+            self.service = discovery.build_from_document(discovery_file.read(), http=http)
 
+    def refresh(self):
+        """ refresh: renews the gspread access token if it expired (the Drive service renews its own)
+            Returns: None
+        """
+        if self.credentials.access_token_expired:
+            self.client.login()
 
     def create(self, title, template_id=None):
         """ create: creates a spreadsheet with the given title
@@ -60,6 +70,21 @@ class GoogleClient():
         file = self.service.files().update(fileId=spreadsheet._id, addParents=target_folder_id, removeParents=previous_parents, fields='id, parents').execute()
 
 
+_client = None
+_client_lock = threading.Lock()   # httplib2 connections can't be shared between threads
+
+def get_client():
+    """ get_client: returns the GoogleClient of this process, creating it on first use
+        Returns: GoogleClient
+    """
+    global _client
+    if _client is None:
+        _client = GoogleClient()
+    else:
+        _client.refresh()
+    return _client
+
+
 def create_qa_sheet(sheet_name):
     """ create_qa_sheet: creates qa sheet copy
         Args:
@@ -67,8 +92,9 @@ def create_qa_sheet(sheet_name):
             qa_sheet_id (str) QA sheet id if it already exists (leaving this in for testing purposes for now)
         Returns: generated spreadsheet id
     """
-    client = GoogleClient()                                                # Open Google client to read from
-    target = client.create(sheet_name, template_id=GOOGLE_QA_TEMPLATE_ID)  # Create copy of QA sheet
-    client.move(target, TARGET_FOLDER_ID)                                  # Move sheet to target
+    with _client_lock:
+        client = get_client()                                                  # Open Google client to read from
+        target = client.create(sheet_name, template_id=GOOGLE_QA_TEMPLATE_ID)  # Create copy of QA sheet
+        client.move(target, TARGET_FOLDER_ID)                                  # Move sheet to target
 
     return target._id
@@ -0,0 +1,46 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from sushibar.services.google import api
+
+
+class GoogleClientTest(SimpleTestCase):
+
+    def setUp(self):
+        self.credentials = mock.Mock(access_token_expired=False)
+        patches = [
+            mock.patch.object(api, 'get_credentials', return_value=self.credentials),
+            mock.patch.object(api.gspread, 'authorize'),
+            mock.patch.object(api.discovery, 'build_from_document'),
+            mock.patch.object(api, '_client', None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_client_is_built_once(self):
+        client = api.get_client()
+        self.assertIs(api.get_client(), client)
+        api.get_credentials.assert_called_once_with()
+        api.gspread.authorize.assert_called_once_with(self.credentials)
+        self.assertEqual(api.discovery.build_from_document.call_count, 1)
+        self.assertFalse(client.client.login.called)
+
+    def test_expired_token_is_refreshed(self):
+        client = api.get_client()
+        self.credentials.access_token_expired = True
+        self.assertIs(api.get_client(), client)
+        client.client.login.assert_called_once_with()
+        self.assertEqual(api.gspread.authorize.call_count, 1)
+
+    def test_create_qa_sheet(self):
+        client = api.get_client()
+        client.service.files.return_value.copy.return_value.execute.return_value = {'id': 'sheet1'}
+        client.client.open_by_key.return_value = mock.Mock(_id='sheet1')
+        client.service.files.return_value.get.return_value.execute.return_value = {'parents': ['root']}
+        self.assertEqual(api.create_qa_sheet('Channel QA'), 'sheet1')
+        client.service.files.return_value.copy.assert_called_once_with(
+            fileId=api.GOOGLE_QA_TEMPLATE_ID, body={'name': 'Channel QA'})
+        client.service.files.return_value.update.assert_called_once_with(
+            fileId='sheet1', addParents=api.TARGET_FOLDER_ID, removeParents='root', fields='id, parents')
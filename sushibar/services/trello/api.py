@@ -8,18 +8,20 @@ import urllib
 
 from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache as django_cache
+from django.db.models import Q
 from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseForbidden
 from rest_framework.response import Response
 from rest_framework.views import APIView, status
 
 from sushibar.runs.models import ContentChannel
 from sushibar.services.google.api import create_qa_sheet
-from sushibar.services.trello import config
+from sushibar.services.trello import cache, config, outbox, webhooks
 
 TRELLO_API_KEY = settings.TRELLO_API_KEY
 TRELLO_TOKEN = settings.TRELLO_TOKEN
 TRELLO_BOARD = settings.TRELLO_BOARD
-TRELLO_URL = "https://api.trello.com/1/"
+TRELLO_URL = outbox.TRELLO_URL
 
 TRELLO_FEEDBACK_DEADLINE = 2    # Number of days to allow for feedback from IMPS
 TRELLO_QA_DEADLINE = 7          # Number of days to allow for QA
@@ -32,6 +34,7 @@ logger = logging.getLogger(__name__)
 
 # TRELLO HTTP REQUESTS
 ################################################################################
+# Writes that don't need Trello's response go through `outbox.enqueue` instead.
 
 def post_request(endpoint, data=None):
     logger.debug('calling post_request with endpoint=' + str(endpoint) + ' data=' + str(data))
@@ -68,15 +71,15 @@ def delete_request(endpoint, data=None):
 def trello_set_due_date(card_id, due_days_from_now):
     due_date = datetime.datetime.now() + datetime.timedelta(days=due_days_from_now)
     due_date = datetime.datetime(due_date.year, due_date.month, due_date.day) # Normalize to midnight
-    put_request("cards/{}".format(card_id), data={'dueComplete': 'false', 'due': str(due_date)})
+    outbox.enqueue('PUT', "cards/{}".format(card_id), data={'dueComplete': 'false', 'due': str(due_date)})
+    cache.update_cached_card(card_id, dueComplete=False, due=str(due_date))
 
 def trello_move_card(channel, list_id, due_days_from_now=None):
     card_id = extract_id(channel.trello_url)
-    response = put_request("cards/{}/idList".format(card_id), data={"value": list_id})
-    response.raise_for_status()
+    outbox.enqueue('PUT', "cards/{}/idList".format(card_id), data={"value": list_id})
+    cache.update_cached_card(card_id, idList=list_id)
     if due_days_from_now:
         trello_set_due_date(card_id, due_days_from_now)
-    return response
 
 def trello_move_card_to_run_list(channel):
     return trello_move_card(channel, config.TRELLO_RUN_LIST_ID)
@@ -91,7 +94,7 @@ def trello_move_card_to_done_list(channel):
 def trello_create_webhook(request, channel, card_id):
     # Delete webhook if no channels are using it
     if channel.trello_webhook_id and not ContentChannel.objects.filter(trello_webhook_id=channel.trello_webhook_id).exists():
-        delete_request("webhooks/{}".format(channel.trello_webhook_id))
+        outbox.enqueue('DELETE', "webhooks/{}".format(channel.trello_webhook_id))
 
     domain = settings.LOCAL_DEV_DEFAULT_DOMAIN or request.META.get('HTTP_ORIGIN') or \
             "http://{}".format(request.get_host() or \
@@ -116,20 +119,19 @@ def trello_create_webhook(request, channel, card_id):
 
 def trello_get_list_name(channel):
     card_id = extract_id(channel.trello_url)
-    response = get_request("cards/{}".format(card_id))
-    trello_data = json.loads(response.content.decode('utf-8'))
-    list_id = trello_data['idList']
-    list_response = get_request("lists/{}".format(list_id))
-    return trello_data['name']
+    status_code, trello_data = cache.get_card(card_id)
+    if status_code != 200:
+        return None
+    status_code, list_data = cache.get_list(trello_data['idList'])
+    return list_data['name'] if status_code == 200 else None
 
 def validate_trello_card(trello_url):
     card_id = extract_id(trello_url)
-    response = get_request("cards/{}".format(card_id))
-    if response.status_code == 200:
-        trello_data = json.loads(response.content.decode('utf-8'))
+    status_code, trello_data = cache.get_card(card_id)
+    if status_code == 200:
         if trello_data['idBoard'] != TRELLO_BOARD:
             return False
-    return response.status_code == 200
+    return status_code == 200
 
 def trello_add_card_to_channel(request, channel, trello_url):
     # Check the url is formatted correctly
@@ -138,9 +140,8 @@ def trello_add_card_to_channel(request, channel, trello_url):
         return HttpResponseBadRequest("Invalid id")
 
     # Check the card is from the sushibar board
-    response = get_request("cards/{}".format(card_id))
-    if response.status_code == 200:
-        trello_data = json.loads(response.content.decode('utf-8'))
+    status_code, trello_data = cache.get_card(card_id)
+    if status_code == 200:
         if trello_data['idBoard'] != TRELLO_BOARD:
             return HttpResponseForbidden("Not authorized to access card")
 
@@ -148,15 +149,16 @@ def trello_add_card_to_channel(request, channel, trello_url):
         channel.trello_url = trello_url
         channel.save()
         trello_create_webhook(request, channel, trello_data['id'])
-        return HttpResponse(response.content)
+        return HttpResponse(json.dumps(trello_data))
     else:
-        return HttpResponseBadRequest(response.content.capitalize())
+        return HttpResponseBadRequest(trello_data.capitalize())
 
 def trello_add_checklist_item(channel, message):
     # Get any checklists that are on the card
     card_id = extract_id(channel.trello_url)
-    checklist_response = get_request("cards/{}/checklists".format(card_id))
-    checklists = json.loads(checklist_response.content.decode('utf-8'))
+    status_code, checklists = cache.get_checklists(card_id)
+    if status_code != 200:
+        return HttpResponseBadRequest(checklists.capitalize())
 
     # If there are no checklists, create a new one
     # Otherwise, add to first list on the board
@@ -166,6 +168,7 @@ def trello_add_checklist_item(channel, message):
         if create_response.status_code != 200:
             return HttpResponseBadRequest(create_response.content.capitalize())
         checklist = json.loads(create_response.content.decode('utf-8'))
+        checklists.append(checklist)
 
     # Format message with timestamp
     current_timestamp = format_datetime(datetime.datetime.now())
@@ -176,14 +179,14 @@ def trello_add_checklist_item(channel, message):
     match = next((i for i in checklist['checkItems'] if i['name'].startswith(message)), None)
     if match:
         update_url = "cards/{}/checkItem/{}".format(card_id, match['id'])
-        response = put_request(update_url, data={"name": formatted_message, "state": "incomplete"})
-        if response.status_code != 200:
-            return HttpResponseBadRequest(response.content.capitalize())
+        outbox.enqueue('PUT', update_url, data={"name": formatted_message, "state": "incomplete"})
+        match.update(name=formatted_message, state="incomplete")
+        cache.set_cached_checklists(card_id, checklists)
     else:
         create_url = "checklists/{}/checkItems".format(checklist['id'])
-        response = post_request(create_url, data={"name": formatted_message, "checked": "false"})
-        if response.status_code != 200:
-            return HttpResponseBadRequest(response.content.capitalize())
+        outbox.enqueue('POST', create_url, data={"name": formatted_message, "checked": "false"})
+        # the id of the new item is only known once the outbox sent the request
+        cache.invalidate_card(card_id)
 
     return HttpResponse("Added checklist item '{}'".format(formatted_message))
 
@@ -191,20 +194,20 @@ def trello_add_channel_link(channel):
     # Check if channel is already linked to card
     card_id = extract_id(channel.trello_url)
     card_endpoint = "cards/{}".format(card_id)
-    card_response = get_request(card_endpoint)
+    status_code, trello_data = cache.get_card(card_id)
 
     # Return bad request if getting card fails
-    if card_response.status_code != 200:
-        return HttpResponseBadRequest(card_response.content.capitalize())
+    if status_code != 200:
+        return HttpResponseBadRequest(trello_data.capitalize())
 
-    description = json.loads(card_response.content.decode('utf-8')).get('desc')
+    description = trello_data.get('desc')
     channel_link = "Channel: [%s](%s/%s/edit)" % (channel.name, channel.default_content_server, channel.channel_id.hex)
 
     # If the channel link isn't in the description, append it
     if description and channel_link not in description:
-        response = put_request(card_endpoint, data={'desc': "%s\n%s" % (description, channel_link)})
-        if response.status_code != 200:
-            return HttpResponseBadRequest(response.content.capitalize())
+        description = "%s\n%s" % (description, channel_link)
+        outbox.enqueue('PUT', card_endpoint, data={'desc': description})
+        cache.update_cached_card(card_id, desc=description)
     return HttpResponse("Updated description with " + channel_link)
 
 def extract_id(url):
@@ -262,7 +265,7 @@ class ContentChannelSaveTrelloUrl(TrelloBaseView):
         if trello_url == "":
             # Delete webhook if no channels are using it
             if channel.trello_webhook_id and not ContentChannel.objects.filter(trello_webhook_id=channel.trello_webhook_id).exists():
-                delete_request("webhooks/{}".format(channel.trello_webhook_id))
+                outbox.enqueue('DELETE', "webhooks/{}".format(channel.trello_webhook_id))
             channel.trello_url = None
             channel.trello_webhook_url = None
             channel.trello_webhook_id = None
@@ -304,19 +307,11 @@ class TrelloBaseMoveList(TrelloBaseView):
         except ContentChannel.DoesNotExist:
             return HttpResponseNotFound("Channel not found")
 
-        # Get any checklists that are on the card
-        card_id = extract_id(channel.trello_url)
-        response = self.put_request("cards/{}/idList".format(card_id), {"value": self.list_id})
-
-        list_response = self.get_request("lists/{}".format(self.list_id))
-
-        if response.status_code != 200:
-            return HttpResponseBadRequest(response.content.capitalize())
-
-        if self.due_days_from_now:
-            trello_set_due_date(card_id, self.due_days_from_now)
-
-        return HttpResponse(list_response.content)
+        trello_move_card(channel, self.list_id, due_days_from_now=self.due_days_from_now)
+        status_code, list_data = cache.get_list(self.list_id)
+        if status_code != 200:
+            return HttpResponseBadRequest(list_data.capitalize())
+        return HttpResponse(json.dumps(list_data))
 
 
 class TrelloMoveToFeedbackList(TrelloBaseMoveList):
@@ -327,13 +322,70 @@ class TrelloMoveToFeedbackList(TrelloBaseMoveList):
     due_days_from_now = TRELLO_FEEDBACK_DEADLINE
 
 
+def qa_sheet_pending_key(channel):
+    return 'qa-sheet:%s' % channel.channel_id.hex
+
+def schedule_qa_sheet(channel):
+    """
+    Queue the creation of the QA sheet of `channel` and its checklist item,
+    unless it is already pending.
+    """
+    from sushibar.tasks import create_qa_sheet_task   # tasks uses this module
+    if not django_cache.add(qa_sheet_pending_key(channel), True, settings.QA_SHEET_PENDING_TIMEOUT):
+        return
+    try:
+        create_qa_sheet_task.delay(channel.channel_id.hex)
+    except Exception as e:
+        django_cache.delete(qa_sheet_pending_key(channel))
+        print('ERROR could not queue QA sheet for channel', channel.channel_id.hex, e)
+        add_qa_sheet(channel.channel_id.hex)
+
+def add_qa_sheet(channel_id):
+    """
+    Create the QA sheet of the channel if it doesn't have one yet, and link
+    it from the card's checklist. Called by `create_qa_sheet_task`.
+    """
+    channel = ContentChannel.objects.get(channel_id=channel_id)
+    try:
+        if not channel.qa_sheet_id:
+            qa_sheet_id = create_qa_sheet(channel.name + " QA")
+            # Keep the sheet of a concurrent task if it got there first
+            if ContentChannel.objects.filter(pk=channel.pk).filter(Q(qa_sheet_id__isnull=True) | Q(qa_sheet_id='')) \
+                                     .update(qa_sheet_id=qa_sheet_id):
+                channel.qa_sheet_id = qa_sheet_id
+            else:
+                channel.refresh_from_db(fields=['qa_sheet_id'])
+
+        message = "Fill out [QA sheet]({})".format("https://docs.google.com/spreadsheets/d/{}/edit".format(channel.qa_sheet_id))
+        trello_add_checklist_item(channel, message)
+    except Exception as e:
+        print('ERROR could not add QA sheet for channel', channel_id, e)
+        raise
+    finally:
+        django_cache.delete(qa_sheet_pending_key(channel))
+
+
 class ContentChannelFlagForQA(APIView):
     """
     Flag channel for QA:
       - Move card to QA list
-      - Create QA sheet and save it to Content/QA/ folder on the LE shared drive
+      - Create QA sheet and save it to Content/QA/ folder on the LE shared drive (in the background)
     """
 
+    def get(self, request, channel_id, format=None):
+        """
+        Return the QA sheet of the channel, polled while it is being created;
+        `pending` is false once its creation is over, whether it failed or not.
+        """
+        try:
+            channel = ContentChannel.objects.get(channel_id=channel_id)
+        except ContentChannel.DoesNotExist:
+            raise Http404
+        return Response({
+            "qa_sheet_id": channel.qa_sheet_id or None,
+            "pending": bool(django_cache.get(qa_sheet_pending_key(channel))),
+        }, status=status.HTTP_200_OK)
+
     def post(self, request, channel_id, format=None):
         """
         Handle "flag_for_qa" ajax calls.
@@ -343,21 +395,10 @@ class ContentChannelFlagForQA(APIView):
         except ContentChannel.DoesNotExist:
             raise Http404
 
-        # TODO: Don't generate if channel.qa_sheet_id already exists!
-        if not channel.qa_sheet_id:
-            channel.qa_sheet_id = create_qa_sheet(channel.name + " QA")
-            channel.save()
+        schedule_qa_sheet(channel)
+        trello_move_card_to_qa_list(channel)   # also sets the QA due date
 
-        message = "Fill out [QA sheet]({})".format("https://docs.google.com/spreadsheets/d/{}/edit".format(channel.qa_sheet_id))
-        trello_response = trello_add_checklist_item(channel, message)
-
-        response = trello_move_card_to_qa_list(channel)
-        response.raise_for_status()
-
-        card_id = extract_id(channel.trello_url)
-        trello_set_due_date(card_id, TRELLO_QA_DEADLINE)
-
-        return Response({"success": True, "qa_sheet_id": channel.qa_sheet_id}, status=status.HTTP_200_OK)
+        return Response({"success": True, "qa_sheet_id": channel.qa_sheet_id or None}, status=status.HTTP_200_OK)
 
 
 
@@ -381,46 +422,15 @@ class TrelloNotifyCardChange(TrelloBaseView):
 
     def handle_change(self, request, channel_id):
         """
-        Handle card change from Trello (webhook)
+        Handle card change from Trello (webhook), applied asynchronously
+        (see `sushibar.services.trello.webhooks`)
         """
-        try:
-            channel = ContentChannel.objects.get(channel_id=channel_id)
-        except ContentChannel.DoesNotExist:
-            return HttpResponseNotFound("Channel not found")
-
-        try:
-            request_data = request.data['action']['data']
-
-            # Card has been moved
-            if request_data.get('listAfter'):
-                self.handle_move(request_data, channel)
-
-            # Card's due date has been updated (due may be null, so check for key)
-            elif request_data.get('old') and 'due' in request_data['old']:
-                self.handle_due_date(request_data, channel)
-
-        except KeyError:
-            pass
-
+        action = request.data.get('action') if isinstance(request.data, dict) else None
+        if not webhooks.is_valid_action(action):
+            return HttpResponseBadRequest("Invalid action")
+        webhooks.enqueue_action(channel_id, action)
         return HttpResponse("")
 
-    def handle_due_date(self, request_data, channel):
-        channel.due_date = request_data['card']['due']
-        channel.save()
-
-    def handle_move(self, request_data, channel):
-        new_list = request_data['listAfter']['id']
-        old_list = request_data['listBefore']['id']
-
-        # Only set if chef is not in initial stage
-        if old_list != config.TRELLO_READY_LIST_ID:
-            channel.run_needed = new_list == config.TRELLO_RUN_LIST_ID
-            channel.changes_needed = new_list == config.TRELLO_DEVELOPMENT_LIST_ID
-        channel.new_run_complete = False
-        channel.save()
-
-        # TODO: Add logic for emailing/pinging developer here
-
     def post(self, request, channel_id):
         return self.handle_change(request, channel_id)
 
@@ -447,10 +457,5 @@ class TrelloSendComment(TrelloBaseView):
 
         comment = "{}: {}".format(request.user.email, request.data['comment'])
         card_id = extract_id(channel.trello_url)
-
-        response = self.post_request('cards/{}/actions/comments'.format(card_id), data={'text': comment})
-
-        if response.status_code != 200:
-            return HttpResponseBadRequest(response.content.capitalize())
-
+        outbox.enqueue('POST', 'cards/{}/actions/comments'.format(card_id), data={'text': comment})
         return HttpResponse("")
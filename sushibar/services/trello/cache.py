@@ -0,0 +1,68 @@
+"""
+Cache of the Trello cards, checklists and lists sushibar reads.
+
+Cards and their checklists are cached in the django cache by card short id for
+`TRELLO_CACHE_TTL` seconds, and lists by id for `TRELLO_LIST_CACHE_TTL` seconds.
+The writes sushibar queues in the outbox update the cached card right away (the
+outbox drops it if the write fails for good), and the `TrelloNotifyCardChange`
+webhook drops the cached card and checklists when the card is changed on Trello,
+so most actions only need their write request.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def card_key(card_id):
+    return 'trello-card:%s' % card_id
+
+def checklists_key(card_id):
+    return 'trello-checklists:%s' % card_id
+
+def list_key(list_id):
+    return 'trello-list:%s' % list_id
+
+
+def fetch(endpoint):
+    from .api import get_request   # api uses this module
+    return get_request(endpoint)
+
+def _get(key, endpoint, ttl):
+    """
+    Return `(status_code, data)` for the Trello `endpoint`, from the cache if
+    possible. `data` is the response content if the request failed.
+    """
+    data = cache.get(key)
+    if data is not None:
+        return 200, data
+    response = fetch(endpoint)
+    if response.status_code != 200:
+        return response.status_code, response.content
+    data = json.loads(response.content.decode('utf-8'))
+    cache.set(key, data, ttl)
+    return 200, data
+
+
+def get_card(card_id):
+    return _get(card_key(card_id), "cards/{}".format(card_id), settings.TRELLO_CACHE_TTL)
+
+def get_checklists(card_id):
+    return _get(checklists_key(card_id), "cards/{}/checklists".format(card_id), settings.TRELLO_CACHE_TTL)
+
+def get_list(list_id):
+    return _get(list_key(list_id), "lists/{}".format(list_id), settings.TRELLO_LIST_CACHE_TTL)
+
+
+def update_cached_card(card_id, **fields):
+    """Apply a change sushibar made to the card to its cached copy, if any."""
+    card = cache.get(card_key(card_id))
+    if card is not None:
+        card.update(fields)
+        cache.set(card_key(card_id), card, settings.TRELLO_CACHE_TTL)
+
+def set_cached_checklists(card_id, checklists):
+    cache.set(checklists_key(card_id), checklists, settings.TRELLO_CACHE_TTL)
+
+def invalidate_card(card_id):
+    cache.delete_many([card_key(card_id), checklists_key(card_id)])
@@ -0,0 +1,196 @@
+"""
+Outbox for the writes sushibar makes to Trello.
+
+Writes whose response isn't needed (moving cards, due dates, comments, ...) are
+queued with `enqueue` and sent by the celery task `send_trello_request_task`,
+so web requests and chef callbacks never wait on Trello.
+
+Each queued write is a redis hash of the form data to send. PUTs and DELETEs to
+the same endpoint are coalesced: while a write is waiting, later writes to the
+same endpoint are merged into it (newer fields win) instead of being queued, so
+e.g. several updates of a card's due date result in one request.
+
+Requests are sent at most `TRELLO_RATE_LIMIT` per second (with bursts of up to
+`TRELLO_RATE_BURST`) across all workers, using a token bucket kept in redis.
+Writes that fail with a connection error, a 429 or a 5xx are retried with
+exponential backoff, up to `TRELLO_OUTBOX_MAX_ATTEMPTS` attempts. Writes that
+fail for good are recorded as `TrelloRequestFailure`s.
+"""
+import re
+import time
+import uuid
+
+from django.conf import settings
+import redis
+import requests
+
+from sushibar.runs.models import TrelloRequestFailure
+from sushibar.services.trello import cache
+
+
+REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
+                          port=settings.MMVP_REDIS_PORT,
+                          db=settings.MMVP_REDIS_DB,
+                          charset="utf-8",
+                          decode_responses=True)
+
+TRELLO_URL = "https://api.trello.com/1/"
+REQUEST_TIMEOUT = (5, 30)          # (connect, read) timeouts in seconds
+JOB_TTL = 24 * 60 * 60             # drop writes still queued after this long
+QUEUED_AT_FIELD = '_queued_at'     # keeps the hash of writes without data non-empty
+BUCKET_KEY = 'trello-outbox:bucket'
+CARD_ENDPOINT_REGEX = r'^cards/([^/]+)'
+
+# Take a token from the bucket, returning "0" or the number of seconds to wait
+# for the next token. KEYS[1]: bucket, ARGV: rate, burst, now
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('hmset', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def job_key(method, endpoint, coalesce):
+    key = 'trello-outbox:%s:%s' % (method, endpoint)
+    return key if coalesce else '%s:%s' % (key, uuid.uuid4().hex)
+
+
+def enqueue(method, endpoint, data=None, coalesce=None):
+    """
+    Queue a `method` request to the Trello `endpoint` with the form `data`.
+    PUTs and DELETEs are coalesced with the pending write to the same endpoint
+    unless `coalesce` is False.
+    """
+    if coalesce is None:
+        coalesce = method != 'POST'
+    key = job_key(method, endpoint, coalesce)
+    fields = dict(data or {}, **{QUEUED_AT_FIELD: time.time()})
+    try:
+        pipe = REDIS.pipeline(transaction=True)
+        pipe.exists(key)
+        pipe.hmset(key, fields)
+        pipe.expire(key, JOB_TTL)
+        already_queued = pipe.execute()[0]
+    except redis.RedisError as e:
+        print('ERROR could not queue Trello request, sending it now', method, endpoint, e)
+        send_now(method, endpoint, data or {})
+        return
+    if not already_queued:
+        schedule(method, endpoint, key)
+
+
+def schedule(method, endpoint, key, failures=0, countdown=0):
+    from sushibar.tasks import send_trello_request_task
+    try:
+        send_trello_request_task.apply_async(args=[method, endpoint, key, failures], countdown=countdown)
+    except Exception as e:
+        print('ERROR could not schedule Trello request, sending it now', method, endpoint, e)
+        data = pop_job(key)
+        if data is not None:
+            send_now(method, endpoint, data)
+
+
+def process_job(method, endpoint, key, failures=0):
+    """
+    Send the write queued under `key`, called by `send_trello_request_task`.
+    `failures` is the number of failed attempts so far.
+    """
+    wait = acquire_token()
+    if wait:
+        schedule(method, endpoint, key, failures, countdown=wait)
+        return
+    data = pop_job(key)
+    if data is None:
+        return   # already sent along with a coalesced write
+    status_code, error = send_request(method, endpoint, data)
+    if not error:
+        return
+    failures += 1
+    retryable = status_code is None or status_code == 429 or status_code >= 500
+    if retryable and failures < settings.TRELLO_OUTBOX_MAX_ATTEMPTS:
+        requeue_job(key, data)
+        schedule(method, endpoint, key, failures,
+                 countdown=settings.TRELLO_OUTBOX_BACKOFF * 2 ** (failures - 1))
+        return
+    record_failure(method, endpoint, data, status_code, error, failures)
+
+
+def send_now(method, endpoint, data):
+    """Send a write without going through the queue, e.g. if redis is down."""
+    status_code, error = send_request(method, endpoint, data)
+    if error:
+        record_failure(method, endpoint, data, status_code, error, 1)
+
+
+def send_request(method, endpoint, data):
+    """
+    Send a request to Trello and return `(status_code, error)`, where `error`
+    is None if the request succeeded.
+    """
+    url = "{}{}".format(TRELLO_URL, endpoint)
+    params = dict(data, key=settings.TRELLO_API_KEY, token=settings.TRELLO_TOKEN)
+    try:
+        if method == 'DELETE':
+            response = requests.delete(url, params=params, timeout=REQUEST_TIMEOUT)
+        else:
+            response = requests.request(method, url, data=params, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        return None, str(e)
+    if response.ok:
+        return response.status_code, None
+    return response.status_code, response.text[:1000] or response.reason
+
+
+def acquire_token(client=None):
+    """
+    Take a token from the rate limiter. Returns 0, or the number of seconds to
+    wait before trying again if none are left.
+    """
+    now = '%.6f' % time.time()
+    wait = (client or REDIS).eval(TOKEN_BUCKET_SCRIPT, 1, BUCKET_KEY,
+                                  settings.TRELLO_RATE_LIMIT, settings.TRELLO_RATE_BURST, now)
+    return float(wait)
+
+
+def pop_job(key):
+    """Remove and return the data of the write queued under `key`, or None."""
+    pipe = REDIS.pipeline(transaction=True)
+    pipe.hgetall(key)
+    pipe.delete(key)
+    fields = pipe.execute()[0]
+    if not fields:
+        return None
+    fields.pop(QUEUED_AT_FIELD, None)
+    return fields
+
+
+def requeue_job(key, data):
+    """Put back the data of a failed write, without overwriting newer writes."""
+    pipe = REDIS.pipeline(transaction=True)
+    for field, value in data.items():
+        pipe.hsetnx(key, field, value)
+    pipe.hsetnx(key, QUEUED_AT_FIELD, time.time())
+    pipe.expire(key, JOB_TTL)
+    pipe.execute()
+
+
+def record_failure(method, endpoint, data, status_code, error, attempts):
+    print('ERROR Trello request failed after', attempts, 'attempts:', method, endpoint, status_code, error)
+    match = re.match(CARD_ENDPOINT_REGEX, endpoint)
+    if match:
+        cache.invalidate_card(match.group(1))   # the cached card may have the change that failed
+    TrelloRequestFailure.objects.create(method=method, endpoint=endpoint, data=data,
+                                        status_code=status_code, error=error or '', attempts=attempts)
@@ -0,0 +1,93 @@
+"""
+Periodic reconciliation of the channel flags kept in sync with the Trello board.
+
+`TrelloNotifyCardChange` updates `run_needed`, `changes_needed` and `due_date`
+of a channel when its card is moved or its due date changes, so a lost webhook
+leaves the channel out of sync until the card changes again. The celery beat
+task `reconcile_trello_board_task` repairs this every `TRELLO_RECONCILE_INTERVAL`
+seconds: it fetches all the open cards (and lists) of `TRELLO_BOARD` with one
+request each, and updates the channels whose flags differ from their card with
+a single query.
+
+The webhook leaves the flags alone for cards moved out of the "ready" list,
+i.e. for channels whose chef hasn't run yet; reconciliation does the same for
+channels without runs.
+"""
+import json
+
+from django.conf import settings
+from django.db.models import BooleanField, Case, DateTimeField, Value, When
+from django.utils.dateparse import parse_datetime
+
+from sushibar.runs.models import ContentChannel
+from sushibar.services.trello import cache, config
+
+
+def fetch_board(get_request):
+    """
+    Return `(cards, lists)` of the board, or None if a request failed.
+    """
+    board_endpoint = "boards/{}".format(settings.TRELLO_BOARD)
+    cards_response = get_request(board_endpoint + "/cards", data={"filter": "open", "fields": "shortLink,idList,due"})
+    lists_response = get_request(board_endpoint + "/lists", data={"fields": "name"})
+    if cards_response.status_code != 200 or lists_response.status_code != 200:
+        print('ERROR could not fetch Trello board', cards_response.status_code, lists_response.status_code)
+        return None
+    return (json.loads(cards_response.content.decode('utf-8')),
+            json.loads(lists_response.content.decode('utf-8')))
+
+
+def expected_flags(card, run_needed, changes_needed, has_runs):
+    """
+    Return the `(run_needed, changes_needed, due_date)` the channel of `card`
+    should have, given its current flags.
+    """
+    due_date = parse_datetime(card['due']) if card.get('due') else None
+    if has_runs:
+        run_needed = card['idList'] == config.TRELLO_RUN_LIST_ID
+        changes_needed = card['idList'] == config.TRELLO_DEVELOPMENT_LIST_ID
+    return run_needed, changes_needed, due_date
+
+
+def reconcile_channels(cards):
+    """
+    Update the channels linked to `cards` whose flags differ from their card.
+    Returns the number of channels updated.
+    """
+    from .api import extract_id
+    cards_by_id = {card['shortLink']: card for card in cards}
+    channels = ContentChannel.objects.exclude(trello_url__isnull=True).exclude(trello_url='')\
+                   .values_list('pk', 'trello_url', 'run_needed', 'changes_needed', 'due_date',
+                                'summary__last_run')
+    changes = {}   # pk --> (run_needed, changes_needed, due_date)
+    for pk, trello_url, run_needed, changes_needed, due_date, last_run in channels.iterator():
+        card = cards_by_id.get(extract_id(trello_url))
+        if card is None:
+            continue   # archived card, or a card of another board
+        expected = expected_flags(card, run_needed, changes_needed, last_run is not None)
+        if expected != (run_needed, changes_needed, due_date):
+            changes[pk] = expected
+    if not changes:
+        return 0
+
+    def case(index, output_field):
+        return Case(*[When(pk=pk, then=Value(values[index])) for pk, values in changes.items()],
+                    output_field=output_field)
+    ContentChannel.objects.filter(pk__in=list(changes)).update(
+        run_needed=case(0, BooleanField()),
+        changes_needed=case(1, BooleanField()),
+        due_date=case(2, DateTimeField()),
+    )
+    return len(changes)
+
+
+def reconcile_trello_board():
+    from .api import get_request
+    board = fetch_board(get_request)
+    if board is None:
+        return
+    cards, lists = board
+    for trello_list in lists:
+        cache.cache.set(cache.list_key(trello_list['id']), trello_list, settings.TRELLO_LIST_CACHE_TTL)
+    updated = reconcile_channels(cards)
+    print('Reconciled Trello board: %d cards, %d channels updated' % (len(cards), updated))
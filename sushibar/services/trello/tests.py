@@ -0,0 +1,339 @@
+import json
+from unittest import mock
+import uuid
+
+from django.core.cache import cache as django_cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from sushibar.services.trello import cache as trello_cache
+from sushibar.services.trello import api, config, outbox, reconcile, webhooks
+
+
+class FakeRedis(object):
+    """
+    The subset of redis used by the outbox, with pipelines run on `execute`.
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.calls = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def exists(self, key):
+        self.calls.append(lambda: key in self.hashes)
+        return self
+
+    def hmset(self, key, fields):
+        self.calls.append(lambda: self.hashes.setdefault(key, {}).update(
+            {field: str(value) for field, value in fields.items()}))
+        return self
+
+    def hsetnx(self, key, field, value):
+        self.calls.append(lambda: self.hashes.setdefault(key, {}).setdefault(field, str(value)))
+        return self
+
+    def hgetall(self, key):
+        self.calls.append(lambda: dict(self.hashes.get(key, {})))
+        return self
+
+    def delete(self, key):
+        self.calls.append(lambda: self.hashes.pop(key, None))
+        return self
+
+    def expire(self, key, ttl):
+        self.calls.append(lambda: True)
+        return self
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [call() for call in calls]
+
+
+@override_settings(TRELLO_OUTBOX_MAX_ATTEMPTS=3, TRELLO_OUTBOX_BACKOFF=5)
+class TrelloOutboxTest(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.scheduled = []
+        self.sent = []
+        self.responses = []
+        patches = [
+            mock.patch.object(outbox, 'REDIS', self.redis),
+            mock.patch.object(outbox, 'schedule', side_effect=lambda *args, **kwargs: self.scheduled.append((args, kwargs))),
+            mock.patch.object(outbox, 'acquire_token', return_value=0),
+            mock.patch.object(outbox, 'send_request', side_effect=self._send),
+            mock.patch.object(outbox, 'record_failure'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _send(self, method, endpoint, data):
+        self.sent.append((method, endpoint, data))
+        return self.responses.pop(0) if self.responses else (200, None)
+
+    def _run_scheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for args, kwargs in scheduled:
+            outbox.process_job(*args)
+
+    def test_coalesces_writes_to_the_same_card(self):
+        outbox.enqueue('PUT', 'cards/abc', data={'due': '1', 'dueComplete': 'false'})
+        outbox.enqueue('PUT', 'cards/abc', data={'due': '2'})
+        outbox.enqueue('PUT', 'cards/abc', data={'desc': 'new'})
+        outbox.enqueue('POST', 'cards/abc/actions/comments', data={'text': 'one'})
+        outbox.enqueue('POST', 'cards/abc/actions/comments', data={'text': 'two'})
+        self.assertEqual(len(self.scheduled), 3)
+        self._run_scheduled()
+        self.assertEqual(self.sent, [
+            ('PUT', 'cards/abc', {'due': '2', 'dueComplete': 'false', 'desc': 'new'}),
+            ('POST', 'cards/abc/actions/comments', {'text': 'one'}),
+            ('POST', 'cards/abc/actions/comments', {'text': 'two'}),
+        ])
+        self.assertEqual(self.redis.hashes, {})
+
+    def test_retries_with_backoff(self):
+        self.responses = [(None, 'connection refused'), (429, 'rate limited')]
+        outbox.enqueue('PUT', 'cards/abc/idList', data={'value': 'list1'})
+        self._run_scheduled()
+        self.assertEqual(self.scheduled[0][1], {'countdown': 5})
+        outbox.enqueue('PUT', 'cards/abc/idList', data={'value': 'list2'})   # newer write while waiting
+        self._run_scheduled()
+        self.assertEqual(self.scheduled[0][1], {'countdown': 10})
+        self._run_scheduled()
+        self.assertEqual([data for _, _, data in self.sent], [{'value': 'list1'}, {'value': 'list2'}, {'value': 'list2'}])
+        self.assertFalse(outbox.record_failure.called)
+
+    def test_records_failures(self):
+        self.responses = [(400, 'invalid value')]
+        outbox.enqueue('PUT', 'cards/abc', data={'due': 'x'})
+        self._run_scheduled()
+        outbox.record_failure.assert_called_once_with('PUT', 'cards/abc', {'due': 'x'}, 400, 'invalid value', 1)
+        self.responses = [(503, 'unavailable')] * 3
+        outbox.enqueue('DELETE', 'webhooks/1')
+        for _ in range(3):
+            self._run_scheduled()
+        self.assertEqual(len(self.sent), 4)
+        outbox.record_failure.assert_called_with('DELETE', 'webhooks/1', {}, 503, 'unavailable', 3)
+
+    def test_waits_for_rate_limit(self):
+        outbox.acquire_token.return_value = 0.25
+        outbox.enqueue('PUT', 'cards/abc', data={'due': '1'})
+        self._run_scheduled()
+        self.assertEqual(self.sent, [])
+        (args, kwargs), = self.scheduled
+        self.assertEqual(kwargs, {'countdown': 0.25})
+        self.assertEqual(args[3], 0)   # waiting isn't a failed attempt
+
+
+@override_settings(TRELLO_CACHE_TTL=60, TRELLO_LIST_CACHE_TTL=60)
+class TrelloCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        patcher = mock.patch.object(trello_cache, 'fetch', return_value=mock.Mock(
+            status_code=200, content=b'{"idList": "l1", "desc": "d"}'))
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_card_is_fetched_once(self):
+        self.assertEqual(trello_cache.get_card('abcd1234'), (200, {'idList': 'l1', 'desc': 'd'}))
+        trello_cache.update_cached_card('abcd1234', idList='l2')
+        self.assertEqual(trello_cache.get_card('abcd1234'), (200, {'idList': 'l2', 'desc': 'd'}))
+        self.fetch.assert_called_once_with('cards/abcd1234')
+        trello_cache.invalidate_card('abcd1234')
+        self.assertEqual(trello_cache.get_card('abcd1234')[1]['idList'], 'l1')
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        self.fetch.return_value = mock.Mock(status_code=404, content=b'card not found')
+        self.assertEqual(trello_cache.get_card('abcd1234'), (404, b'card not found'))
+        trello_cache.get_card('abcd1234')
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+@override_settings(TRELLO_CACHE_TTL=60)
+class TrelloChecklistTest(SimpleTestCase):
+    channel = mock.Mock(trello_url='https://trello.com/c/abcd1234/1-channel')
+
+    def setUp(self):
+        django_cache.clear()
+        checklists = [{'id': 'cl1', 'name': config.TRELLO_CHECKLIST_NAME,
+                       'checkItems': [{'id': 'i1', 'name': 'Fill out QA sheet (requested ...)', 'state': 'complete'}]}]
+        patches = [
+            mock.patch.object(trello_cache, 'fetch', side_effect=lambda endpoint: mock.Mock(
+                status_code=200, content=json.dumps(checklists).encode('utf-8'))),
+            mock.patch.object(outbox, 'enqueue'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_existing_item_is_unchecked(self):
+        api.trello_add_checklist_item(self.channel, 'Fill out QA sheet')
+        method, endpoint = outbox.enqueue.call_args[0]
+        self.assertEqual((method, endpoint), ('PUT', 'cards/abcd1234/checkItem/i1'))
+        status_code, checklists = trello_cache.get_checklists('abcd1234')
+        self.assertEqual(checklists[0]['checkItems'][0]['state'], 'incomplete')
+        self.assertEqual(trello_cache.fetch.call_count, 1)
+
+    def test_new_item_is_sent_again_until_created(self):
+        # Trello hasn't created the first item yet, or its write failed
+        api.trello_add_checklist_item(self.channel, 'Review channel')
+        api.trello_add_checklist_item(self.channel, 'Review channel')
+        self.assertEqual([call[0][:2] for call in outbox.enqueue.call_args_list],
+                         [('POST', 'checklists/cl1/checkItems')] * 2)
+        self.assertEqual(trello_cache.fetch.call_count, 2)
+
+    def test_failed_card_write_drops_the_cached_card(self):
+        trello_cache.get_card('abcd1234')
+        with mock.patch.object(outbox.TrelloRequestFailure.objects, 'create'):
+            outbox.record_failure('PUT', 'cards/abcd1234', {'idList': 'l2'}, 400, 'invalid value', 1)
+        self.assertIsNone(django_cache.get(trello_cache.card_key('abcd1234')))
+
+
+@override_settings(QA_SHEET_PENDING_TIMEOUT=60)
+class TrelloQASheetTest(SimpleTestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        self.channel = mock.Mock(pk=1, channel_id=uuid.UUID('6a2b0c9f6f0a4c3c8a6b5e8f3f4a1b2c'), qa_sheet_id=None)
+        self.channel.name = 'Channel'
+        patches = [
+            mock.patch.object(api.ContentChannel, 'objects'),
+            mock.patch.object(api, 'create_qa_sheet', return_value='sheet1'),
+            mock.patch.object(api, 'trello_add_checklist_item'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.objects = api.ContentChannel.objects
+        self.objects.get.return_value = self.channel
+        self.update = self.objects.filter.return_value.filter.return_value.update
+        django_cache.set(api.qa_sheet_pending_key(self.channel), True)
+
+    def test_creates_sheet(self):
+        self.update.return_value = 1
+        api.add_qa_sheet(self.channel.channel_id.hex)
+        api.create_qa_sheet.assert_called_once_with('Channel QA')
+        self.update.assert_called_once_with(qa_sheet_id='sheet1')
+        self.assertIn('/d/sheet1/edit', api.trello_add_checklist_item.call_args[0][1])
+        self.assertIsNone(django_cache.get(api.qa_sheet_pending_key(self.channel)))
+
+    def test_keeps_existing_sheet(self):
+        self.channel.qa_sheet_id = 'sheet0'
+        api.add_qa_sheet(self.channel.channel_id.hex)
+        self.assertFalse(api.create_qa_sheet.called)
+        self.assertIn('/d/sheet0/edit', api.trello_add_checklist_item.call_args[0][1])
+
+    def test_keeps_sheet_of_concurrent_task(self):
+        self.update.return_value = 0
+        self.channel.refresh_from_db.side_effect = lambda fields: setattr(self.channel, 'qa_sheet_id', 'sheet0')
+        api.add_qa_sheet(self.channel.channel_id.hex)
+        self.channel.refresh_from_db.assert_called_once_with(fields=['qa_sheet_id'])
+        self.assertIn('/d/sheet0/edit', api.trello_add_checklist_item.call_args[0][1])
+
+    def test_failure_clears_pending(self):
+        api.create_qa_sheet.side_effect = RuntimeError('drive unavailable')
+        with self.assertRaises(RuntimeError):
+            api.add_qa_sheet(self.channel.channel_id.hex)
+        self.assertIsNone(django_cache.get(api.qa_sheet_pending_key(self.channel)))
+
+    def test_get_reports_pending_sheet(self):
+        view = api.ContentChannelFlagForQA.as_view()
+        url = '/services/trello/%s/flag_for_qa/' % self.channel.channel_id.hex
+        response = view(RequestFactory().get(url), channel_id=self.channel.channel_id.hex)
+        self.assertEqual(response.data, {'qa_sheet_id': None, 'pending': True})
+        django_cache.delete(api.qa_sheet_pending_key(self.channel))
+        self.channel.qa_sheet_id = 'sheet1'
+        response = view(RequestFactory().get(url), channel_id=self.channel.channel_id.hex)
+        self.assertEqual(response.data, {'qa_sheet_id': 'sheet1', 'pending': False})
+
+
+class TrelloReconcileTest(SimpleTestCase):
+
+    def test_flags_follow_the_list_of_the_card(self):
+        card = {'shortLink': 'abcd1234', 'idList': config.TRELLO_RUN_LIST_ID, 'due': '2018-03-01T12:00:00.000Z'}
+        run_needed, changes_needed, due_date = reconcile.expected_flags(card, False, True, True)
+        self.assertEqual((run_needed, changes_needed), (True, False))
+        self.assertEqual((due_date.year, due_date.month, due_date.day, due_date.hour), (2018, 3, 1, 12))
+        self.assertIsNotNone(due_date.tzinfo)
+
+    def test_flags_of_channels_without_runs_are_kept(self):
+        card = {'shortLink': 'abcd1234', 'idList': config.TRELLO_DEVELOPMENT_LIST_ID, 'due': None}
+        self.assertEqual(reconcile.expected_flags(card, True, False, False), (True, False, None))
+
+    @override_settings(TRELLO_BOARD='board1')
+    def test_board_fetch_failure(self):
+        get_request = mock.Mock(side_effect=[mock.Mock(status_code=200, content=b'[]'),
+                                             mock.Mock(status_code=429, content=b'')])
+        self.assertIsNone(reconcile.fetch_board(get_request))
+        self.assertEqual(get_request.call_args_list[0][0][0], 'boards/board1/cards')
+
+
+class TrelloWebhookTest(SimpleTestCase):
+    channel_id = '6a2b0c9f6f0a4c3c8a6b5e8f3f4a1b2c'
+
+    def setUp(self):
+        self.seen = set()
+        redis_client = mock.Mock()
+        redis_client.set.side_effect = lambda key, value, nx, ex: key not in self.seen and not self.seen.add(key)
+        patches = [
+            mock.patch.object(webhooks, 'REDIS', redis_client),
+            mock.patch.object(webhooks, 'schedule_batch'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.redis = redis_client
+
+    def move(self, action_id, date, before, after):
+        return {'id': action_id, 'date': date,
+                'data': {'card': {'shortLink': 'abcd1234'}, 'listBefore': {'id': before}, 'listAfter': {'id': after}}}
+
+    def test_duplicate_actions_are_queued_once(self):
+        action = self.move('a1', '2018-03-01T12:00:00.000Z', 'l1', config.TRELLO_RUN_LIST_ID)
+        webhooks.enqueue_action(self.channel_id, action)
+        webhooks.enqueue_action(self.channel_id, action)
+        self.assertEqual(self.redis.rpush.call_count, 1)
+        self.assertEqual(webhooks.schedule_batch.call_count, 1)
+
+    def test_action_is_applied_if_it_cant_be_scheduled(self):
+        action = self.move('a1', '2018-03-01T12:00:00.000Z', 'l1', config.TRELLO_RUN_LIST_ID)
+        webhooks.schedule_batch.side_effect = webhooks.redis.RedisError
+        with mock.patch.object(webhooks, 'apply_actions') as apply_actions:
+            webhooks.enqueue_action(self.channel_id, action)
+        apply_actions.assert_called_once_with([{'channel_id': self.channel_id, 'action': action}])
+
+    def test_failed_batch_is_requeued(self):
+        items = [{'channel_id': self.channel_id, 'action': self.move(action_id, '2018-03-01T12:00:00.000Z', 'l1', 'l2')}
+                 for action_id in ['a0', 'a1', 'a2']]
+        with mock.patch.object(webhooks, 'pop_batch', return_value=(items, 0)), \
+             mock.patch.object(webhooks, 'apply_actions', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                webhooks.process_batch()
+        pushed = self.redis.lpush.call_args[0]
+        self.assertEqual(pushed[0], webhooks.QUEUE_KEY)
+        # lpush pushes its values one at a time, so the batch keeps its order
+        self.assertEqual([json.loads(item)['action']['id'] for item in reversed(pushed[1:])],
+                         ['a0', 'a1', 'a2'])
+        self.assertEqual(webhooks.schedule_batch.call_count, 1)
+
+    def test_last_action_wins(self):
+        items = [
+            {'channel_id': self.channel_id, 'action': self.move('a2', '2018-03-01T12:05:00.000Z', 'l1', config.TRELLO_DEVELOPMENT_LIST_ID)},
+            {'channel_id': self.channel_id, 'action': self.move('a1', '2018-03-01T12:00:00.000Z', 'l1', config.TRELLO_RUN_LIST_ID)},
+            {'channel_id': self.channel_id, 'action': self.move('a0', '2018-03-01T11:00:00.000Z', 'l1', 'l2')},
+        ]
+        actions = webhooks.group_actions(items, {self.channel_id: '2018-03-01T11:30:00.000Z'})
+        self.assertEqual([action['id'] for action in actions[self.channel_id]], ['a1', 'a2'])
+        fields = {}
+        for action in actions[self.channel_id]:
+            webhooks.apply_action(fields, action['data'])
+        self.assertEqual(fields, {'run_needed': False, 'changes_needed': True, 'new_run_complete': False})
+
+    def test_invalid_actions(self):
+        self.assertFalse(webhooks.is_valid_action(None))
+        self.assertFalse(webhooks.is_valid_action({'data': {}}))
+        self.assertTrue(webhooks.is_valid_action({'id': 'a1', 'data': {}}))
@@ -0,0 +1,183 @@
+"""
+Asynchronous processing of the card changes Trello sends to `TrelloNotifyCardChange`.
+
+Trello expects webhooks to answer quickly, and moving many cards at once sends
+bursts of notifications. The view only checks the action and queues it with
+`enqueue_action` (a redis list); the celery task `apply_trello_actions_task`
+then applies the queued actions in batches of up to `TRELLO_WEBHOOK_BATCH_SIZE`,
+`TRELLO_WEBHOOK_BATCH_DELAY` seconds after the first action of the batch.
+
+Trello may send an action more than once, so actions are only queued the first
+time their id is seen. The actions of a channel are applied in the order of
+their date, and actions older than the last one applied to the channel are
+ignored: the last action wins.
+"""
+import json
+import uuid
+
+from django.conf import settings
+import redis
+
+from sushibar.runs.models import ContentChannel
+from sushibar.services.trello import cache, config
+
+
+REDIS = redis.StrictRedis(host=settings.MMVP_REDIS_HOST,
+                          port=settings.MMVP_REDIS_PORT,
+                          db=settings.MMVP_REDIS_DB,
+                          charset="utf-8",
+                          decode_responses=True)
+
+QUEUE_KEY = 'trello-webhook:actions'
+SCHEDULED_KEY = 'trello-webhook:scheduled'   # set while a batch is scheduled
+SEEN_TTL = 24 * 60 * 60                      # seconds action ids are remembered
+LAST_ACTION_TTL = 30 * 24 * 60 * 60          # seconds the date of a channel's last action is kept
+
+def seen_key(action_id):
+    return 'trello-webhook:seen:%s' % action_id
+
+def last_action_key(channel_id):
+    return 'trello-webhook:last:%s' % channel_id
+
+
+def is_valid_action(action):
+    return isinstance(action, dict) and bool(action.get('id')) and isinstance(action.get('data'), dict)
+
+
+def enqueue_action(channel_id, action):
+    """
+    Queue the Trello `action` for the channel `channel_id`, unless it was
+    already queued, and schedule a batch if none is.
+    """
+    # Drop the cached card now, the webhook is only called when it changed
+    card_data = action['data'].get('card') or {}
+    if card_data.get('shortLink'):
+        cache.invalidate_card(card_data['shortLink'])
+
+    item = json.dumps({'channel_id': uuid.UUID(str(channel_id)).hex, 'action': action})
+    try:
+        if not REDIS.set(seen_key(action['id']), 1, nx=True, ex=SEEN_TTL):
+            return   # duplicate delivery
+        REDIS.rpush(QUEUE_KEY, item)
+        schedule_batch()
+    except redis.RedisError as e:
+        print('ERROR could not queue Trello action, applying it now', action['id'], e)
+        apply_actions([json.loads(item)])
+
+
+def schedule_batch(countdown=None):
+    from sushibar.tasks import apply_trello_actions_task
+    if not REDIS.set(SCHEDULED_KEY, 1, nx=True, ex=settings.TRELLO_WEBHOOK_BATCH_DELAY + 60):
+        return   # the scheduled batch will pick up the action
+    if countdown is None:
+        countdown = settings.TRELLO_WEBHOOK_BATCH_DELAY
+    try:
+        apply_trello_actions_task.apply_async(countdown=countdown)
+    except Exception as e:
+        print('ERROR could not schedule Trello actions, applying them now', e)
+        REDIS.delete(SCHEDULED_KEY)
+        process_batch()
+
+
+def pop_batch(size):
+    pipe = REDIS.pipeline(transaction=True)
+    pipe.lrange(QUEUE_KEY, 0, size - 1)
+    pipe.ltrim(QUEUE_KEY, size, -1)
+    pipe.llen(QUEUE_KEY)
+    items, _, remaining = pipe.execute()
+    return [json.loads(item) for item in items], remaining
+
+
+def process_batch():
+    """
+    Apply the next batch of queued actions, called by `apply_trello_actions_task`.
+    """
+    REDIS.delete(SCHEDULED_KEY)   # actions queued from now on need another batch
+    items, remaining = pop_batch(settings.TRELLO_WEBHOOK_BATCH_SIZE)
+    if items:
+        try:
+            apply_actions(items)
+        except Exception:
+            # Trello won't send these actions again (their ids were seen), so put
+            # them back at the head of the queue for another batch to retry
+            REDIS.lpush(QUEUE_KEY, *[json.dumps(item) for item in reversed(items)])
+            schedule_batch()
+            raise
+    if remaining:
+        schedule_batch(countdown=0)
+
+
+def apply_action(fields, data):
+    """
+    Update the dict of channel `fields` to save with the changes of the card
+    described by the action `data`.
+    """
+    # Card has been moved
+    if data.get('listAfter'):
+        new_list = data['listAfter']['id']
+        old_list = data['listBefore']['id']
+        # Only set if chef is not in initial stage
+        if old_list != config.TRELLO_READY_LIST_ID:
+            fields['run_needed'] = new_list == config.TRELLO_RUN_LIST_ID
+            fields['changes_needed'] = new_list == config.TRELLO_DEVELOPMENT_LIST_ID
+        fields['new_run_complete'] = False
+        # TODO: Add logic for emailing/pinging developer here
+
+    # Card's due date has been updated (due may be null, so check for key)
+    elif data.get('old') and 'due' in data['old']:
+        fields['due_date'] = data['card']['due']
+
+
+def group_actions(items, last_dates):
+    """
+    Return `{channel_id: [action]}` with the actions of each channel sorted by
+    date, without the ones older than the date in `last_dates` (if any).
+    """
+    actions = {}
+    for item in items:
+        actions.setdefault(item['channel_id'], []).append(item['action'])
+    for channel_id, channel_actions in actions.items():
+        channel_actions.sort(key=lambda action: action.get('date') or '')
+        last_date = last_dates.get(channel_id)
+        if last_date:
+            actions[channel_id] = [action for action in channel_actions
+                                   if (action.get('date') or '') >= last_date]
+    return actions
+
+
+def apply_actions(items):
+    """
+    Apply the queued `items` (`{'channel_id', 'action'}` dicts), saving each
+    channel once.
+    """
+    from .api import extract_id   # api uses this module
+    channel_ids = sorted({item['channel_id'] for item in items})
+    try:
+        last_dates = dict(zip(channel_ids, REDIS.mget([last_action_key(c) for c in channel_ids])))
+    except redis.RedisError:
+        last_dates = {}
+    actions = group_actions(items, last_dates)
+
+    channels = ContentChannel.objects.filter(channel_id__in=channel_ids)
+    for channel in channels:
+        channel_actions = actions.get(channel.channel_id.hex)
+        if not channel_actions:
+            continue
+        fields = {}
+        for action in channel_actions:
+            try:
+                apply_action(fields, action['data'])
+            except KeyError:
+                pass
+        if channel.trello_url and not any((a['data'].get('card') or {}).get('shortLink') for a in channel_actions):
+            cache.invalidate_card(extract_id(channel.trello_url))
+        if fields:
+            for name, value in fields.items():
+                setattr(channel, name, value)
+            channel.save(update_fields=list(fields))
+        last_date = channel_actions[-1].get('date')
+        if last_date:
+            try:
+                REDIS.set(last_action_key(channel.channel_id.hex), last_date, ex=LAST_ACTION_TTL)
+            except redis.RedisError:
+                pass
@@ -72,6 +72,131 @@ function create_config(data) {
 
 
 
+/****************** RUN LOGS ******************/
+
+var LOG_PAGE_SIZE = 500;
+
+function run_logs_url(params) {
+  return "/api/channelruns/" + run_id + "/logs/?" + $.param(params);
+}
+
+function render_log_lines(lines) {
+  return lines.map(function(line) {
+    return $("<span>").text(line).get(0);
+  });
+}
+
+function show_log_lines(pre, start, lines) {
+  pre.data("start", start);
+  pre.find(".load-earlier-logs")
+     .after(render_log_lines(lines))
+     .toggleClass("hidden", start === 0);
+}
+
+function load_latest_logs(pre) {
+  var params = {level: pre.data("level"), tail: LOG_PAGE_SIZE};
+  $.getJSON(run_logs_url(params), function(data) {
+    show_log_lines(pre, data.start, data.lines);
+    follow_logs(pre);
+  });
+}
+
+function follow_logs(pre) {
+  // Append new lines pushed by the server while the run is in progress
+  if (!window.WebSocket) { return; }
+  var ws_scheme = window.location.protocol == "https:" ? "wss://" : "ws://";
+  var socket = new WebSocket(ws_scheme + window.location.host + "/logs-view/" + run_id + "/?level=" + pre.data("level"));
+  socket.onmessage = function(event) {
+    var at_bottom = pre.scrollTop() + pre.innerHeight() >= pre[0].scrollHeight - 5;
+    pre.append(render_log_lines(JSON.parse(event.data).lines));
+    if (at_bottom) {
+      pre.scrollTop(pre[0].scrollHeight);
+    }
+  };
+}
+
+function load_earlier_logs(pre) {
+  var end = pre.data("start");
+  var start = Math.max(0, end - LOG_PAGE_SIZE);
+  var params = {level: pre.data("level"), start: start, count: end - start};
+  $.getJSON(run_logs_url(params), function(data) {
+    show_log_lines(pre, start, data.lines);
+  });
+}
+
+function load_run_logs() {
+  $(".run-logs").each(function() {
+    var pre = $(this);
+    if (!pre.data("loaded")) {
+      pre.data("loaded", true);
+      load_latest_logs(pre);
+    }
+  });
+}
+
+
+
+
+/****************** CONTENT TREE ******************/
+
+function run_tree_url(node_id) {
+  return "/runs/" + run_id + "/tree/?" + $.param({node_id: node_id || ""});
+}
+
+function render_tree_nodes(nodes) {
+  return nodes.map(function(node) {
+    var link = $("<a>").append(
+      $("<i>").addClass("icon fa " + node.icon), " ",
+      $("<div class='title truncate'>").attr("title", node.title).text(node.title));
+    if (node.file_size) {
+      link.append(" (" + node.file_size + ")");
+    }
+    var li = $("<li>").addClass(node.is_topic ? "topic" : "file").append(link);
+    if (node.is_topic) {
+      li.append($("<ul class='content-tree'>").attr("data-node-id", node.node_id).hide());
+    }
+    return li.get(0);
+  });
+}
+
+var TREE_POLL_INTERVAL = 5000;
+var TREE_POLL_MAX_ATTEMPTS = 120;   // give up after 10 minutes, when the server would queue a new load
+
+function fetch_tree_nodes(ul, callback, attempt) {
+  attempt = attempt || 0;
+  $.getJSON(run_tree_url(ul.data("node-id")), function(data) {
+    if (data.building) {
+      // The tree is being loaded from Studio in the background, check again later
+      if (attempt >= TREE_POLL_MAX_ATTEMPTS) {
+        $("#tree .tree-building").hide();
+        $("#tree .tree-error").show();
+        ul.data("loaded", false);
+        return;
+      }
+      $("#tree .tree-building").show();
+      setTimeout(function() { fetch_tree_nodes(ul, callback, attempt + 1); }, TREE_POLL_INTERVAL);
+      return;
+    }
+    $("#tree .tree-building").hide();
+    ul.append(render_tree_nodes(data.children));
+    callback();
+  });
+}
+
+function load_tree_nodes(ul, callback) {
+  // Children of a topic are only fetched the first time it is expanded
+  if (ul.data("loaded")) { return callback(); }
+  ul.data("loaded", true);
+  fetch_tree_nodes(ul, callback);
+}
+
+function load_content_tree() {
+  load_tree_nodes($("#tree > .content-tree"), function() {});
+}
+
+
+
+
 /****************** TRELLO API FUNCTIONS ******************/
 
 
@@ -192,16 +317,51 @@ function create_config(data) {
     });
   }
 
+  function show_qa_sheet(qa_sheet_id) {
+    $("#feedback-link").attr("href", "https://docs.google.com/spreadsheets/d/" + qa_sheet_id);
+    $("#feedback-embed").attr("src", "https://docs.google.com/a/learningequality.org/spreadsheets/d/" + qa_sheet_id + "/htmlembed")
+    $("#feedback-embed-wrapper").removeClass("hidden");
+    $("#feedback-prompt-wrapper").addClass("hidden");
+  }
+
+  // The QA sheet is created in the background, check for it until it's ready,
+  // its creation failed, or QA_SHEET_POLL_MAX_ATTEMPTS checks (10 minutes) went by
+  var QA_SHEET_POLL_INTERVAL = 3000;
+  var QA_SHEET_POLL_MAX_ATTEMPTS = 200;
+
+  function qa_sheet_error() {
+    alert_trello_error({responseText: "The QA sheet could not be created, flag the channel for QA again to retry."});
+  }
+
+  function poll_qa_sheet(attempt) {
+    attempt = attempt || 1;
+    $.ajax({
+      url: "/services/trello/" + channel_id + "/flag_for_qa/",
+      type: "GET",
+      success: function(data) {
+        if (data.qa_sheet_id) {
+          show_qa_sheet(data.qa_sheet_id);
+        } else if (!data.pending || attempt >= QA_SHEET_POLL_MAX_ATTEMPTS) {
+          qa_sheet_error();
+        } else {
+          setTimeout(function() { poll_qa_sheet(attempt + 1); }, QA_SHEET_POLL_INTERVAL);
+        }
+      },
+      error: qa_sheet_error
+    });
+  }
+
   function trello_flag_channel_for_qa(onpending, onsuccess, onerror) {
     onpending();
     $.ajax({
       url: "/services/trello/" + channel_id + "/flag_for_qa/",
       type: "POST",
       success: function(data) {
-        $("#feedback-link").attr("href", "https://docs.google.com/spreadsheets/d/" + data.qa_sheet_id);
-        $("#feedback-embed").attr("src", "https://docs.google.com/a/learningequality.org/spreadsheets/d/" + data.qa_sheet_id + "/htmlembed")
-        $("#feedback-embed-wrapper").removeClass("hidden");
-        $("#feedback-prompt-wrapper").addClass("hidden");
+        if (data.qa_sheet_id) {
+          show_qa_sheet(data.qa_sheet_id);
+        } else {
+          setTimeout(function() { poll_qa_sheet(1); }, QA_SHEET_POLL_INTERVAL);
+        }
         history.replaceState(undefined, undefined, "#feedback");
         $('.nav-link[href="#feedback"]').tab('show');
         onsuccess("Flagged channel for QA");
@@ -329,11 +489,19 @@ $(function() {
             return x.resource_counts !== undefined && x.resource_counts !== null;
           }).slice(0, 10)));
     });
-    // Collapse content tree.
-    $('.content-tree > li a').click(function() {
-      $(this).parent().find('ul').slideToggle(100);
+    // Expand and collapse topics of the content tree.
+    $('#tree').on('click', '.content-tree > li.topic > a', function() {
+      var ul = $(this).siblings('ul');
+      load_tree_nodes(ul, function() { ul.slideToggle(100); });
     });
+    $('.nav-link[href="#tree"]').on('shown.bs.tab', load_content_tree);
+
 
+    // Logs are only fetched when the LOGS tab is opened
+    $('.nav-link[href="#logs"]').on('shown.bs.tab', load_run_logs);
+    $(".load-earlier-logs").on("click", function() {
+      load_earlier_logs($(this).parent());
+    });
 
     var hash = window.location.hash || "#summary";
     history.replaceState(undefined, undefined, hash);
@@ -1,9 +1,20 @@
 from __future__ import absolute_import, unicode_literals
 
+import requests
+
 from celery.decorators import task
 from celery.utils.log import get_task_logger
+from django.core.cache import cache
 from django.core.management import call_command
-from sushibar.runs.utils import load_tree_for_channel
+from sushibar.ccserverlib.status_cache import refresh_active_channel_statuses, refresh_channel_statuses
+from sushibar.runs.logstore import compress_segment
+from sushibar.runs.models import ContentChannel, ContentChannelRun
+from sushibar.runs.utils import (get_tree_run_dict, load_tree_for_channel, mark_run_complete, set_run_options,
+                                 tree_load_pending_key)
+from sushibar.services.trello.api import add_qa_sheet, trello_add_channel_link
+from sushibar.services.trello.outbox import process_job
+from sushibar.services.trello.reconcile import reconcile_trello_board
+from sushibar.services.trello.webhooks import process_batch
 
 logger = get_task_logger(__name__)
 
@@ -18,6 +29,99 @@ def load_tree_for_channel_task(run_dict):
     have turned this into a celery task to avoid blocking the request.
     """
     print('load_tree_for_channel_task received run_dict', run_dict)
-    load_tree_for_channel(run_dict)
-    # intentionally ignoring the return value (since json data is saved to disk)
+    try:
+        load_tree_for_channel(run_dict)
+        # intentionally ignoring the return value (since json data is saved to disk)
+    finally:
+        cache.delete(tree_load_pending_key(run_dict['run_id']))
+
+
+@task(name='load_run_tree_task')
+def load_run_tree_task(run_id):
+    """
+    Load the tree of a completed run (see `schedule_run_completed`).
+    """
+    try:
+        run = ContentChannelRun.objects.select_related('channel').get(run_id=run_id)
+        load_tree_for_channel(get_tree_run_dict(run))
+    finally:
+        cache.delete(tree_load_pending_key(run_id))
+
+
+@task(name='set_run_options_task', bind=True, max_retries=3, default_retry_delay=30)
+def set_run_options_task(self, run_id):
+    """
+    Save the Studio status of the channel of a completed run, retried while
+    Studio can't be reached rather than recording it as not staged or published.
+    """
+    try:
+        set_run_options(ContentChannelRun.objects.select_related('channel').get(run_id=run_id))
+    except requests.RequestException as e:
+        raise self.retry(exc=e)
+
+
+@task(name='mark_run_complete_task')
+def mark_run_complete_task(run_id):
+    mark_run_complete(ContentChannelRun.objects.select_related('channel').get(run_id=run_id))
+
+
+@task(name='compress_log_segment_task')
+def compress_log_segment_task(sealed_path):
+    """
+    Gzip a sealed segment of a run log (see `sushibar.runs.logstore`).
+    """
+    compress_segment(sealed_path)
+
+
+@task(name='refresh_channel_statuses_task')
+def refresh_channel_statuses_task(content_server, cctoken, channel_ids):
+    refresh_channel_statuses(content_server, cctoken, channel_ids)
+
+
+@task(name='refresh_active_channel_statuses_task')
+def refresh_active_channel_statuses_task():
+    """
+    Periodic task (see CELERYBEAT_SCHEDULE) refreshing cached Studio statuses.
+    """
+    refresh_active_channel_statuses()
+
+
+@task(name='send_trello_request_task')
+def send_trello_request_task(method, endpoint, key, failures=0):
+    """
+    Send a write queued in the Trello outbox (see `sushibar.services.trello.outbox`).
+    """
+    process_job(method, endpoint, key, failures)
+
+
+@task(name='trello_add_channel_link_task')
+def trello_add_channel_link_task(channel_id):
+    channel = ContentChannel.objects.get(channel_id=channel_id)
+    if channel.trello_url:
+        trello_add_channel_link(channel)
 
+
+@task(name='create_qa_sheet_task')
+def create_qa_sheet_task(channel_id):
+    """
+    Create the QA sheet of a channel flagged for QA and add it to its Trello card.
+    """
+    add_qa_sheet(channel_id)
+
+
+@task(name='apply_trello_actions_task')
+def apply_trello_actions_task():
+    """
+    Apply a batch of the card changes queued by the Trello webhook
+    (see `sushibar.services.trello.webhooks`).
+    """
+    process_batch()
+
+
+@task(name='reconcile_trello_board_task')
+def reconcile_trello_board_task():
+    """
+    Periodic task (see CELERYBEAT_SCHEDULE) syncing the channel flags with the
+    Trello board, in case webhooks were missed.
+    """
+    reconcile_trello_board()